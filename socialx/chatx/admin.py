@@ -1,7 +1,7 @@
 # chatx/admin.py
 
 from django.contrib import admin
-from .models import Post, Profile, Comment, Notification, EmailVerification
+from .models import Post, Profile, Comment, Notification, EmailVerification, OutboxEmail, MediaJob, MediaBlob
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
@@ -21,7 +21,7 @@ class CommentAdmin(admin.ModelAdmin):
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ('recipient', 'sender', 'notification_type', 'is_read', 'created_at')
+    list_display = ('recipient', 'sender', 'notification_type', 'actor_count', 'is_read', 'updated_at')
     list_filter = ('notification_type', 'is_read')
 
 @admin.register(EmailVerification)
@@ -29,4 +29,20 @@ class EmailVerificationAdmin(admin.ModelAdmin):
     list_display = ('user', 'email', 'otp', 'verified', 'created_at', 'expires_at')
     list_filter = ('verified',)
     search_fields = ('user__username', 'email', 'otp')
-    readonly_fields = ('created_at', 'expires_at')
\ No newline at end of file
+    readonly_fields = ('created_at', 'expires_at')
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+
+@admin.register(MediaJob)
+class MediaJobAdmin(admin.ModelAdmin):
+    list_display = ('post', 'status', 'attempts', 'queued_at', 'next_attempt_at', 'finished_at')
+    list_filter = ('status',)
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'created_at')
+    search_fields = ('sha256', 'name')
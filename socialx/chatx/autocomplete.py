@@ -0,0 +1,116 @@
+# chatx/autocomplete.py
+
+import bisect
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+AUTOCOMPLETE_LIMIT = 8
+
+# Every gunicorn worker holds its own copy of the index. A change in one
+# worker updates that copy in place and increments the shared version here;
+# the others notice the mismatch on their next lookup and rebuild.
+VERSION_CACHE_KEY = 'autocomplete:usernames:version'
+
+# Lookups compare against the shared version at most this often (seconds), so
+# another worker's change can take up to this long to show up here.
+VERSION_CHECK_INTERVAL = 1.0
+
+
+class UsernameIndex:
+    """Usernames kept sorted case-insensitively, so a prefix lookup is two bisects"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []       # lowercased usernames, sorted
+        self._entries = []    # (username, user_id), same order as _keys
+        self._names = {}      # user_id -> username
+        self._version = None
+        self._checked_at = None
+
+    def _load(self, version):
+        rows = sorted(User.objects.values_list('username', 'pk'), key=lambda row: row[0].lower())
+        self._keys = [username.lower() for username, _ in rows]
+        self._entries = rows
+        self._names = {pk: username for username, pk in rows}
+        self._version = version
+
+    def _ensure_current(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None:
+            # Start from a random value so an evicted key can't match a stale copy
+            cache.add(VERSION_CACHE_KEY, random.getrandbits(48), None)
+            version = cache.get(VERSION_CACHE_KEY)
+        if version != self._version:
+            self._load(version)
+
+    def _publish(self):
+        """
+        Announce a change to the other workers. This copy stays current only if
+        no other worker changed anything since it was last in sync.
+        """
+        try:
+            version = cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            version = None
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+        else:
+            self._version = None
+
+    def _insert(self, user_id, username):
+        key = username.lower()
+        position = bisect.bisect_left(self._keys, key)
+        self._keys.insert(position, key)
+        self._entries.insert(position, (username, user_id))
+        self._names[user_id] = username
+
+    def _remove(self, user_id):
+        username = self._names.pop(user_id, None)
+        if username is None:
+            return
+        key = username.lower()
+        position = bisect.bisect_left(self._keys, key)
+        while position < len(self._keys) and self._keys[position] == key:
+            if self._entries[position][1] == user_id:
+                del self._keys[position]
+                del self._entries[position]
+                return
+            position += 1
+
+    def search(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Return up to `limit` (username, user_id) pairs starting with `prefix`"""
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        with self._lock:
+            self._ensure_current()
+            start = bisect.bisect_left(self._keys, prefix)
+            end = bisect.bisect_left(self._keys, prefix + '￿', start)
+            return self._entries[start:min(end, start + limit)]
+
+    def user_saved(self, user):
+        """Add a new user or pick up a username change; callers skip other saves"""
+        with self._lock:
+            if self._version is not None:
+                if self._names.get(user.pk) == user.username:
+                    return
+                self._remove(user.pk)
+                self._insert(user.pk, user.username)
+            self._publish()
+
+    def user_deleted(self, user_id):
+        with self._lock:
+            if self._version is not None:
+                self._remove(user_id)
+            self._publish()
+
+
+username_index = UsernameIndex()
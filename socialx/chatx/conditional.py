@@ -0,0 +1,105 @@
+# chatx/conditional.py
+
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import Count, Max, Sum
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import Post, Profile, TimelineEntry
+from .notifications import unread_count
+from .pagination import keyset_page
+from .versions import get_versions
+
+# Pages show relative times ("5 minutes ago"), so every validator also rolls
+# over on this interval, matching the post card fragment cache.
+FRESHNESS_WINDOW = 120
+
+
+def _page_etag(request, rows, pairs):
+    """
+    Hash what a page shows into an ETag: `rows` are the database values it
+    renders and `pairs` the (kind, pk) version tokens covering the rest.
+    Returns None, meaning "always render", while flash messages are pending.
+    """
+    if messages.get_messages(request):
+        return None
+
+    user = request.user
+    pairs = set(pairs)
+    viewer = None
+    if user.is_authenticated:
+        pairs |= {('viewer', user.pk), ('user', user.pk)}
+        viewer = (user.pk, unread_count(user))
+    versions = get_versions(pairs)
+
+    parts = (
+        viewer,
+        # A cached page carries a CSRF token that must still match the cookie
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        int(time.time() // FRESHNESS_WINDOW),
+        rows,
+        sorted(versions.items()),
+    )
+    return hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+
+def feed_etag(request):
+    entries, next_cursor = keyset_page(
+        TimelineEntry.objects.filter(user=request.user).select_related('post').only(
+            'post', 'author', 'created_at', 'post__likes_count', 'post__comments_count'
+        ),
+        request.GET.get('cursor'),
+        pk_field='post_id',
+    )
+    rows = [(e.post_id, e.post.likes_count, e.post.comments_count) for e in entries]
+    pairs = {('post', e.post_id) for e in entries} | {('user', e.author_id) for e in entries}
+    return _page_etag(request, (rows, next_cursor), pairs)
+
+
+def profile_etag(request, username):
+    profile = (
+        Profile.objects.filter(user__username=username)
+        .values_list('user_id', 'followers_count', 'following_count').first()
+    )
+    if profile is None:
+        return None
+    # One aggregate row, however many posts: new and deleted posts move the
+    # count or the newest id, likes and comments the sums, and edits bump the
+    # author's posts token. Changes that cancel out in the sums wait for the
+    # freshness window.
+    posts = Post.objects.filter(author_id=profile[0]).aggregate(
+        count=Count('pk'), newest=Max('pk'), likes=Sum('likes_count'), comments=Sum('comments_count'),
+    )
+    pairs = {('user', profile[0]), ('posts', profile[0])}
+    return _page_etag(request, (profile, sorted(posts.items())), pairs)
+
+
+def post_detail_etag(request, pk):
+    post = Post.objects.filter(pk=pk).values_list('author_id', 'likes_count', 'comments_count').first()
+    if post is None:
+        return None
+    return _page_etag(request, post, {('post', pk), ('user', post[0])})
+
+
+def conditional_page(etag_func):
+    """
+    Like django's @condition(etag_func=...): a matching If-None-Match gets a
+    304 without running the view. Tagged responses are marked private and
+    must be revalidated, so browsers come back with the ETag every time.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.has_header('ETag'):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
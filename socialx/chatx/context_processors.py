@@ -0,0 +1,10 @@
+# chatx/context_processors.py
+
+from .notifications import unread_count
+
+
+def notifications(request):
+    """Expose the viewer's unread notification count to every template"""
+    if not request.user.is_authenticated:
+        return {}
+    return {'unread_notifications_count': unread_count(request.user)}
@@ -0,0 +1,81 @@
+# chatx/counters.py
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Post, Profile, Comment
+from .lookups import forget_user
+
+PostLike = Post.likes.through
+PostSave = Post.saves.through
+Follow = Profile.follows.through
+
+
+def adjust(queryset, **deltas):
+    """Atomically add deltas to counter columns on every row of `queryset`, never going below zero"""
+    return queryset.update(**{
+        field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()
+    })
+
+
+def count_rows(model, field):
+    """Correlated COUNT(*) of `model` rows whose `field` points at the outer row"""
+    rows = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return Coalesce(Subquery(rows.annotate(n=Count('pk')).values('n')), 0)
+
+
+def actual_post_counts():
+    return {
+        'likes_count': count_rows(PostLike, 'post'),
+        'comments_count': count_rows(Comment, 'post'),
+        'saves_count': count_rows(PostSave, 'post'),
+    }
+
+
+def actual_profile_counts():
+    return {
+        'followers_count': count_rows(Follow, 'to_profile'),
+        'following_count': count_rows(Follow, 'from_profile'),
+    }
+
+
+def _forget_on_commit(user_ids):
+    """
+    Drop the cached lookups once the counts are committed: dropped any
+    earlier, a concurrent request could cache the old counts again.
+    """
+    def forget():
+        for user_id in user_ids:
+            forget_user(user_id)
+    transaction.on_commit(forget)
+
+
+def follow_changed(follower_profile, followed_profile, delta):
+    """Keep both sides of a follow edge in step (delta is +1 or -1)"""
+    adjust(Profile.objects.filter(pk=follower_profile.pk), following_count=delta)
+    adjust(Profile.objects.filter(pk=followed_profile.pk), followers_count=delta)
+    _forget_on_commit([follower_profile.user_id, followed_profile.user_id])
+
+
+def release_user(user):
+    """
+    Take a user's likes, saves, comments and follow edges off everyone else's
+    counters. Call this before deleting the user; the cascade removes the rows
+    themselves but never touches the stored counts.
+    """
+    adjust(Post.objects.filter(likes=user), likes_count=-1)
+    adjust(Post.objects.filter(saves=user), saves_count=-1)
+
+    comment_totals = (
+        Comment.objects.filter(author=user).exclude(post__author=user)
+        .values('post').annotate(n=Count('pk')).values_list('post', 'n')
+    )
+    for post_id, n in comment_totals:
+        adjust(Post.objects.filter(pk=post_id), comments_count=-n)
+
+    profile = user.profile
+    adjust(Profile.objects.filter(followed_by=profile), followers_count=-1)
+    adjust(Profile.objects.filter(follows=profile), following_count=-1)
+    neighbours = Profile.objects.filter(Q(followed_by=profile) | Q(follows=profile))
+    _forget_on_commit(list(neighbours.values_list('user_id', flat=True).distinct()))
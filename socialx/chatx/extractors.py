@@ -0,0 +1,109 @@
+# chatx/extractors.py
+
+import json
+import shutil
+import subprocess
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import mp4
+
+# Posters are scaled down to this width at most
+POSTER_MAX_WIDTH = 1280
+
+# ffprobe/ffmpeg on a damaged file can hang; give up after this long
+TOOL_TIMEOUT = 60
+
+# Sample entry codes (what the MP4 headers say) -> codec names (what ffprobe says)
+FOURCC_CODECS = {
+    'avc1': 'h264', 'avc3': 'h264',
+    'hvc1': 'hevc', 'hev1': 'hevc',
+    'vp08': 'vp8', 'vp09': 'vp9',
+    'av01': 'av1',
+    'mp4v': 'mpeg4',
+}
+
+
+class ExtractionError(Exception):
+    """The extractor couldn't read the file; the job is worth retrying"""
+
+
+class Mp4HeaderExtractor:
+    """
+    Pure Python: reads width, height, duration and codec from MP4/MOV
+    headers (chatx.mp4). It can't decode a frame, so there is no poster.
+    """
+
+    def probe(self, path):
+        with open(path, 'rb') as f:
+            info = mp4.probe(f) or {}
+        if 'codec' in info:
+            info['codec'] = FOURCC_CODECS.get(info['codec'], info['codec'])
+        return info
+
+    def poster(self, path, seconds):
+        return None
+
+
+class FFmpegExtractor:
+    """ffprobe for the details (any container), ffmpeg for the poster frame"""
+
+    @staticmethod
+    def available():
+        return bool(shutil.which('ffprobe') and shutil.which('ffmpeg'))
+
+    def _run(self, args):
+        try:
+            result = subprocess.run(args, capture_output=True, timeout=TOOL_TIMEOUT, check=True)
+        except subprocess.TimeoutExpired as e:
+            raise ExtractionError(f'{args[0]} timed out') from e
+        except subprocess.CalledProcessError as e:
+            raise ExtractionError(e.stderr.decode(errors='replace').strip()[-500:]) from e
+        return result.stdout
+
+    def probe(self, path):
+        output = self._run([
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'stream=width,height,codec_name:stream_tags=rotate:stream_side_data=rotation:format=duration',
+            '-of', 'json', path,
+        ])
+        data = json.loads(output or b'{}')
+        info = {}
+        duration = data.get('format', {}).get('duration')
+        if duration:
+            info['duration'] = float(duration)
+
+        streams = data.get('streams') or [{}]
+        stream = streams[0]
+        if stream.get('codec_name'):
+            info['codec'] = stream['codec_name']
+        if stream.get('width') and stream.get('height'):
+            info['width'], info['height'] = stream['width'], stream['height']
+            # Phones record portrait video as landscape plus a rotation
+            rotation = stream.get('tags', {}).get('rotate') or next(
+                (side.get('rotation') for side in stream.get('side_data_list', []) if 'rotation' in side), 0
+            )
+            if abs(int(float(rotation))) % 180 == 90:
+                info['width'], info['height'] = info['height'], info['width']
+        return info
+
+    def poster(self, path, seconds):
+        """One JPEG frame from `seconds` in; ffmpeg applies the rotation itself"""
+        return self._run([
+            'ffmpeg', '-v', 'error', '-ss', f'{seconds:.3f}', '-i', path,
+            '-frames:v', '1', '-vf', f"scale='min({POSTER_MAX_WIDTH},iw)':-2",
+            '-q:v', '3', '-f', 'image2pipe', '-vcodec', 'mjpeg', 'pipe:1',
+        ]) or None
+
+
+def get_extractor():
+    """
+    The MEDIA_EXTRACTOR setting (a dotted path to a class with probe() and
+    poster()), or else ffmpeg when it is installed and the MP4 header reader
+    when it isn't.
+    """
+    path = getattr(settings, 'MEDIA_EXTRACTOR', None)
+    if path:
+        return import_string(path)()
+    return FFmpegExtractor() if FFmpegExtractor.available() else Mp4HeaderExtractor()
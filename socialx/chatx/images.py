@@ -0,0 +1,168 @@
+# chatx/images.py
+
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Rendition name -> target width. Nothing is ever upscaled, so a small upload
+# may end up with fewer renditions than this.
+RENDITION_WIDTHS = {
+    'thumb': 320,
+    'feed': 640,
+    'full': 1280,
+}
+
+RENDITION_DIR = 'post_images/renditions'
+
+# Each rendition is written in both formats: WebP for browsers that take it,
+# JPEG as the <img> fallback
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+# How a stripped original is re-encoded, per source format
+ORIGINAL_SAVE_OPTIONS = {
+    'JPEG': {'quality': 92, 'optimize': True},
+    'WEBP': {'quality': 90},
+    'PNG': {'optimize': True},
+}
+
+
+# Anything bigger is refused before it's decoded: a 20MB JPEG is already far
+# past any phone photo, and 50 megapixels decode to about 150MB of RGB
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+MAX_IMAGE_PIXELS = 50_000_000
+
+
+class InvalidImage(ValueError):
+    """The upload isn't an image Pillow can read, or is too big to process"""
+
+
+def _open(field_file):
+    """Decode straight from the file, after checking its size and then its header's dimensions"""
+    if field_file.size > MAX_IMAGE_SIZE:
+        raise InvalidImage(f'The image is larger than {MAX_IMAGE_SIZE // (1024 * 1024)}MB.')
+    field_file.open('rb')
+    try:
+        image = Image.open(field_file)
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            raise InvalidImage(f'The image is larger than {MAX_IMAGE_PIXELS // 1_000_000} megapixels.')
+        image.load()
+        getattr(image, 'is_animated', False)  # Counting GIF frames reads ahead, so it happens while the file is open
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as error:
+        raise InvalidImage(str(error)) from error
+    finally:
+        if field_file._committed:
+            field_file.close()
+        else:
+            field_file.seek(0)  # The upload itself is still to be stored
+    return image
+
+
+def _flatten(image):
+    """RGB for JPEG: transparent areas go white instead of black"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, options):
+    options = dict(options)
+    if options['format'] == 'JPEG':
+        image = _flatten(image)
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, **options)
+    return buffer.getvalue()
+
+
+def _target_sizes(width, height):
+    """(name, width, height) for each rendition, skipping ones that would repeat a smaller size"""
+    sizes = []
+    for name, target in sorted(RENDITION_WIDTHS.items(), key=lambda item: item[1]):
+        if sizes and sizes[-1][1] >= width:
+            break
+        w = min(target, width)
+        sizes.append((name, w, max(1, round(height * w / width))))
+    return sizes
+
+
+def _has_metadata(image):
+    return bool(image.getexif()) or 'xmp' in image.info
+
+
+def _strip_metadata(image, source_format, name):
+    """
+    A copy of the (already upright) upload without EXIF or XMP: camera, GPS
+    and so on. The ICC profile is kept for colour. None if the format isn't
+    one we re-encode.
+    """
+    options = ORIGINAL_SAVE_OPTIONS.get(source_format)
+    if options is None:
+        return None
+    icc_profile = image.info.get('icc_profile')
+    if icc_profile:
+        options = {**options, 'icc_profile': icc_profile}
+    if source_format == 'JPEG':
+        image = _flatten(image)
+    buffer = io.BytesIO()
+    image.save(buffer, format=source_format, **options)
+    return ContentFile(buffer.getvalue(), name=os.path.basename(name))
+
+
+def build_renditions(image, name):
+    """Write every rendition of `image` to storage and return their description"""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    renditions = {}
+    for rendition, width, height in _target_sizes(*image.size):
+        resized = image if (width, height) == image.size else image.resize(
+            (width, height), Image.LANCZOS, reducing_gap=2.0
+        )
+        entry = {'width': width, 'height': height}
+        for extension, options in FORMATS.items():
+            path = f'{RENDITION_DIR}/{stem}_{rendition}.{extension}'
+            entry[extension] = default_storage.save(path, ContentFile(_encode(resized, options)))
+        renditions[rendition] = entry
+    return renditions
+
+
+def process_post_image(post):
+    """
+    Strip metadata from post.image, record its dimensions and build its
+    renditions. Works on a fresh upload or a stored file; the post still has
+    to be saved afterwards. Raises InvalidImage for anything Pillow can't read.
+    """
+    image = _open(post.image)
+    # MPO is what some phones write: a JPEG with extra frames we don't need
+    source_format = 'JPEG' if image.format == 'MPO' else image.format
+    name = post.image.name
+
+    if getattr(image, 'is_animated', False) and image.format != 'MPO':
+        # Resizing would keep only the first frame, so animations are served as uploaded
+        post.media_width, post.media_height = image.size
+        post.image_renditions = {}
+        return
+
+    upright = ImageOps.exif_transpose(image)
+    if _has_metadata(image):
+        stripped = _strip_metadata(upright, source_format, name)
+        if stripped is not None:
+            post.image = stripped
+
+    post.media_width, post.media_height = upright.size
+    post.image_renditions = build_renditions(upright, name)
+
+
+def delete_renditions(renditions):
+    for entry in (renditions or {}).values():
+        for extension in FORMATS:
+            if entry.get(extension):
+                default_storage.delete(entry[extension])
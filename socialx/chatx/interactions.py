@@ -0,0 +1,92 @@
+# chatx/interactions.py
+
+from django.db import connections, router, transaction
+
+from .counters import Follow, PostLike, PostSave, adjust, follow_changed
+from .models import Post
+from .versions import bump_viewer
+
+
+def _insert_ignore(through, **values):
+    """Insert a through-table row (field name -> pk) unless it exists; returns the number of rows inserted"""
+    meta = through._meta
+    # Raw SQL skips the router, so ask it for the write database explicitly
+    connection = connections[router.db_for_write(through)]
+    table = connection.ops.quote_name(meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(meta.get_field(name).column) for name in values)
+    placeholders = ', '.join(['%s'] * len(values))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON CONFLICT DO NOTHING',
+            list(values.values()),
+        )
+        return cursor.rowcount
+
+
+def _set_membership(through, counter, post, user, state):
+    """
+    Make the (post, user) row in `through` exist iff `state`, moving the counter
+    only when a row was really inserted or deleted. The unique (post, user)
+    constraint settles races, so there is no check-then-act window.
+    Returns True when something changed.
+    """
+    with transaction.atomic():
+        if state:
+            if not _insert_ignore(through, post=post.pk, user=user.pk):
+                return False
+        else:
+            deleted, _ = through.objects.filter(post_id=post.pk, user_id=user.pk).delete()
+            if not deleted:
+                return False
+        adjust(Post.objects.filter(pk=post.pk), **{counter: 1 if state else -1})
+    bump_viewer(user.pk)
+    return True
+
+
+def _toggle_membership(through, counter, post, user):
+    """Flip membership and return the new state (and whether it changed)"""
+    if _set_membership(through, counter, post, user, False):
+        return False, True
+    # Nothing to remove, so add; losing an insert race still ends up "on"
+    return True, _set_membership(through, counter, post, user, True)
+
+
+def set_like(post, user, liked):
+    return _set_membership(PostLike, 'likes_count', post, user, liked)
+
+
+def toggle_like(post, user):
+    return _toggle_membership(PostLike, 'likes_count', post, user)
+
+
+def set_save(post, user, saved):
+    return _set_membership(PostSave, 'saves_count', post, user, saved)
+
+
+def toggle_save(post, user):
+    return _toggle_membership(PostSave, 'saves_count', post, user)
+
+
+def set_follow(follower, followed, state):
+    """
+    Make the follow edge between two profiles exist iff `state`, moving both
+    sides' counters only when a row was really inserted or deleted (the same
+    race-free approach as _set_membership). Returns True when something changed.
+    """
+    with transaction.atomic():
+        if state:
+            if not _insert_ignore(Follow, from_profile=follower.pk, to_profile=followed.pk):
+                return False
+        else:
+            deleted, _ = Follow.objects.filter(from_profile_id=follower.pk, to_profile_id=followed.pk).delete()
+            if not deleted:
+                return False
+        follow_changed(follower, followed, 1 if state else -1)
+    return True
+
+
+def toggle_follow(follower, followed):
+    """Flip the follow edge and return the new state (and whether it changed)"""
+    if set_follow(follower, followed, False):
+        return False, True
+    return True, set_follow(follower, followed, True)
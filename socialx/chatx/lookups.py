@@ -0,0 +1,89 @@
+# chatx/lookups.py
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Profile
+
+# Entries are dropped by the signal handlers on every User/Profile save and
+# by follow_changed(); the timeout only bounds drift from bulk updates.
+LOOKUP_CACHE_TIMEOUT = 60 * 5
+
+
+def _user_key(user_id):
+    return f'lookup:user:{user_id}'
+
+
+def _username_key(username):
+    return f'lookup:username:{username}'
+
+
+def _load(**filters):
+    return User.objects.select_related('profile').filter(**filters).first()
+
+
+def get_user(user_id):
+    """The User with `.profile` already loaded, or None"""
+    key = _user_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = _load(pk=user_id)
+        if user is None:
+            return None
+        cache.set(key, user, LOOKUP_CACHE_TIMEOUT)
+    return user
+
+
+def get_user_by_username(username):
+    """Like get_user(), but by username; usernames map to ids in their own entries"""
+    user_id = cache.get(_username_key(username))
+    if user_id is not None:
+        user = get_user(user_id)
+        # An old username keeps pointing at its former owner until it expires
+        if user is not None and user.username == username:
+            return user
+
+    user = _load(username=username)
+    if user is None:
+        return None
+    cache.set_many({
+        _username_key(username): user.pk,
+        _user_key(user.pk): user,
+    }, LOOKUP_CACHE_TIMEOUT)
+    return user
+
+
+def get_user_or_404(username):
+    user = get_user_by_username(username)
+    if user is None:
+        raise Http404('No such user.')
+    return user
+
+
+def forget_user(user_id, *usernames):
+    """Drop the cached user/profile and any of the given username entries"""
+    cache.delete_many([_user_key(user_id)] + [_username_key(name) for name in usernames])
+
+
+def attach_profile(user):
+    """Give an authenticated user its cached profile, saving the profile query"""
+    if user.is_authenticated and not user._state.fields_cache.get('profile'):
+        cached = get_user(user.pk)
+        if cached is not None:
+            # For reading only: saving it would write back whatever it held when cached
+            cached.profile._from_lookup_cache = True
+            user.profile = cached.profile
+    return user
+
+
+def writable_profile(user):
+    """
+    The user's profile fresh from the database, for code that saves it. The
+    copy attach_profile() hands out can be up to LOOKUP_CACHE_TIMEOUT old on
+    this worker, and Profile.save() writes every field. The fresh copy also
+    replaces the cached one on `user`.
+    """
+    profile = Profile.objects.get(user_id=user.pk)
+    user.profile = profile
+    return profile
@@ -0,0 +1,73 @@
+# chatx/management/commands/benchmark_search.py
+
+import random
+import string
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chatx.models import Post
+from chatx.search import fts_enabled, match_expression, rebuild_index, ranked_ids, SEARCH_PAGE_SIZE
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare full-text search with the old icontains scan on the current (or synthetic) data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('terms', nargs='*', help='Search terms to time (default: a few sample words)')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per term and method')
+        parser.add_argument(
+            '--synthetic', type=int, default=0,
+            help='Insert this many random posts first; they are rolled back afterwards',
+        )
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            raise CommandError('The full-text index is only available on the SQLite backend.')
+
+        try:
+            with transaction.atomic():
+                if options['synthetic']:
+                    self.seed(options['synthetic'])
+                self.run(options['terms'] or ['hello', 'photo', 'django', 'sunset'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, count):
+        words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 9))) for _ in range(5000)]
+        words += ['hello', 'photo', 'django', 'sunset']
+        author, _ = User.objects.get_or_create(username='benchmark_search_user')
+        Post.objects.bulk_create(
+            [Post(author=author, text=' '.join(random.choices(words, k=20))) for _ in range(count)],
+            batch_size=1000,
+        )
+        # bulk_create skips the post_save signal, so index everything in one go
+        rebuild_index()
+        self.stdout.write(f'Seeded {count} synthetic post(s).')
+
+    def run(self, terms, repeat):
+        self.stdout.write(f'{Post.objects.count()} post(s), {repeat} run(s) per term\n')
+        self.stdout.write(f'{"term":<16}{"icontains ms":>14}{"fts5 ms":>10}{"speedup":>10}')
+
+        for term in terms:
+            icontains = self.time(repeat, lambda: list(
+                Post.objects.filter(text__icontains=term).values_list('pk', flat=True)[:SEARCH_PAGE_SIZE]
+            ))
+            fts = self.time(repeat, lambda: ranked_ids('post', term, SEARCH_PAGE_SIZE))
+            speedup = icontains / fts if fts else float('inf')
+            self.stdout.write(f'{term:<16}{icontains:>14.3f}{fts:>10.3f}{speedup:>9.1f}x')
+
+        self.stdout.write(f'\nFTS5 query for the first term: {match_expression(terms[0])}')
+
+    def time(self, repeat, fn):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - start) * 1000 / repeat
@@ -0,0 +1,121 @@
+# chatx/management/commands/benchmark_writes.py
+
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from chatx.counters import adjust
+from chatx.interactions import toggle_like
+from chatx.models import Comment, Post
+
+# What the project ran with before: rollback journal, deferred transactions
+# and the sqlite3 module's default 5 second busy timeout
+LEGACY_OPTIONS = {'init_command': 'PRAGMA journal_mode=DELETE', 'timeout': 5}
+
+
+def _write_load(args):
+    """One worker process: like/unlike and comment until the deadline"""
+    seconds, user_id, post_ids, seed = args
+    rng = random.Random(seed)
+    user = User(pk=user_id)
+    latencies, locked = [], 0
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        post = Post(pk=rng.choice(post_ids))
+        start = time.perf_counter()
+        try:
+            if rng.random() < 0.5:
+                toggle_like(post, user)
+            else:
+                # The same writes as the add_comment view
+                with transaction.atomic():
+                    Comment.objects.create(post=post, author=user, text='benchmark')
+                    adjust(Post.objects.filter(pk=post.pk), comments_count=1)
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+        else:
+            latencies.append(time.perf_counter() - start)
+
+    connection.close()
+    return latencies, locked
+
+
+class Command(BaseCommand):
+    help = 'Measure concurrent like/comment throughput and lock errors under the old and the current SQLite settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Writer processes')
+        parser.add_argument('--seconds', type=float, default=5, help='Length of each run')
+        parser.add_argument('--posts', type=int, default=20, help='Posts the writes are spread over')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark is for the SQLite backend.')
+
+        original = dict(connection.settings_dict)
+        current = settings.DATABASES['default'].get('OPTIONS', {})
+        try:
+            # A scratch database, so the real one never sees the load
+            with tempfile.TemporaryDirectory() as tmp:
+                name = os.path.join(tmp, 'benchmark.sqlite3')
+                self.use_database(name, current)
+                call_command('migrate', verbosity=0)
+                user_ids, post_ids = self.seed(options['workers'], options['posts'])
+
+                self.stdout.write(
+                    f'{options["workers"]} worker(s), {options["seconds"]:g}s per run, '
+                    f'{len(post_ids)} post(s)\n'
+                )
+                self.stdout.write(f'{"settings":<10}{"writes":>8}{"writes/s":>10}{"locked":>8}{"p50 ms":>9}{"p95 ms":>9}')
+                for label, sqlite_options in (('legacy', LEGACY_OPTIONS), ('current', current)):
+                    self.use_database(name, sqlite_options)
+                    self.report(label, self.run(user_ids, post_ids, options['seconds']), options['seconds'])
+        finally:
+            connection.close()
+            connection.settings_dict.update(original)
+
+    def use_database(self, name, sqlite_options):
+        """Point the default connection at `name` with `sqlite_options`"""
+        connection.close()
+        connection.settings_dict.update(NAME=name, OPTIONS=sqlite_options)
+        # Switch the journal mode here, once, rather than in every worker at once
+        connection.ensure_connection()
+        connection.close()
+
+    def seed(self, workers, posts):
+        users = User.objects.bulk_create([User(username=f'benchmark_writer_{i}') for i in range(workers)])
+        author = users[0]
+        created = Post.objects.bulk_create([Post(author=author, text=f'Benchmark post {i}') for i in range(posts)])
+        return [user.pk for user in users], [post.pk for post in created]
+
+    def run(self, user_ids, post_ids, seconds):
+        # Children must open their own connections, never share the parent's
+        connection.close()
+        jobs = [(seconds, user_id, post_ids, i) for i, user_id in enumerate(user_ids)]
+        with multiprocessing.get_context('fork').Pool(len(jobs)) as pool:
+            results = pool.map(_write_load, jobs)
+        latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+        return latencies, sum(locked for _, locked in results)
+
+    def report(self, label, result, seconds):
+        latencies, locked = result
+        if len(latencies) >= 2:
+            cuts = statistics.quantiles(latencies, n=20)
+            p50, p95 = cuts[9] * 1000, cuts[18] * 1000
+        else:
+            p50 = p95 = float('nan')
+        self.stdout.write(
+            f'{label:<10}{len(latencies):>8}{len(latencies) / seconds:>10.0f}{locked:>8}{p50:>9.2f}{p95:>9.2f}'
+        )
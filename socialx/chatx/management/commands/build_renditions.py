@@ -0,0 +1,34 @@
+# chatx/management/commands/build_renditions.py
+
+from django.core.management.base import BaseCommand
+
+from chatx.images import InvalidImage, delete_renditions, process_post_image
+from chatx.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Strip metadata from post images and build their resized renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild posts that already have renditions')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            posts = posts.filter(image_renditions={})
+
+        built = skipped = 0
+        for post in posts.iterator():
+            stale = post.image_renditions
+            try:
+                process_post_image(post)
+            except (InvalidImage, FileNotFoundError) as error:
+                self.stderr.write(f'Post {post.pk}: skipped ({error})')
+                skipped += 1
+                continue
+            post.media_bytes = post.image.size
+            post.save(update_fields=['image', 'media_width', 'media_height', 'media_bytes', 'image_renditions'])
+            delete_renditions(stale)
+            built += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {built} image(s), skipped {skipped}.'))
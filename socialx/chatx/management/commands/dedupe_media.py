@@ -0,0 +1,105 @@
+# chatx/management/commands/dedupe_media.py
+
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chatx.models import MediaBlob
+from chatx.signals import DEDUP_FIELDS
+from chatx.storage import BLOB_DIR, content_sha256, media_storage
+
+# A blob nothing points at yet may belong to an upload whose post is still being saved
+ORPHAN_GRACE = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = 'Move media stored before deduplication into shared blobs, then recount every blob\'s references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be shared without changing anything')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        sizes = {}  # sha256 -> size, to tell first copies from duplicates
+        moved = {}  # Old name -> blob name
+        files = duplicates = saved_bytes = 0
+
+        for model, fields in DEDUP_FIELDS.items():
+            for field in fields:
+                rows = (
+                    model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                    .exclude(**{f'{field}__startswith': f'{BLOB_DIR}/'}).values_list('pk', field)
+                )
+                for pk, name in rows.iterator():
+                    if name not in moved:
+                        if not media_storage.exists(name):
+                            self.stderr.write(f'{model.__name__} #{pk}: {name} is missing, skipped')
+                            continue
+                        with media_storage.open(name) as f:
+                            sha256 = content_sha256(f)
+                            files += 1
+                            if sha256 in sizes:
+                                duplicates += 1
+                                saved_bytes += f.size
+                            sizes.setdefault(sha256, f.size)
+                            moved[name] = name if dry_run else media_storage.save(name, f)
+                    if not dry_run:
+                        # Only if the row wasn't given new media in the meantime
+                        model.objects.filter(pk=pk, **{field: name}).update(**{field: moved[name]})
+
+        verb = 'Would share' if dry_run else 'Shared'
+        self.stdout.write(
+            f'{verb} {files} file(s) as {len(sizes)} blob(s): {duplicates} duplicate(s), '
+            f'{saved_bytes / (1024 * 1024):.1f}MB.'
+        )
+        if dry_run:
+            return
+
+        for name in moved:
+            media_storage.delete(name)  # Files from before deduplication have no MediaBlob, so this removes them
+
+        fixed, orphans = self.recount()
+        self.stdout.write(self.style.SUCCESS(
+            f'Fixed {fixed} reference count(s) and removed {orphans} unreferenced blob(s).'
+        ))
+
+    def recount(self):
+        """Set every blob's refcount from the rows pointing at it; remove blobs and blob files nobody points at"""
+        fixed = orphans = 0
+        # One transaction, so no reference is taken or given back halfway through
+        with transaction.atomic():
+            counts = Counter()
+            for model, fields in DEDUP_FIELDS.items():
+                for field in fields:
+                    names = model.objects.filter(**{f'{field}__startswith': f'{BLOB_DIR}/'}).values_list(field, flat=True)
+                    counts.update(names.iterator())
+
+            cutoff = timezone.now() - ORPHAN_GRACE
+            for blob in MediaBlob.objects.select_for_update().iterator():
+                actual = counts[blob.name]
+                if not actual and blob.created_at < cutoff:
+                    blob.delete()
+                    # Straight to the file: the storage's own delete() counts references
+                    FileSystemStorage.delete(media_storage, blob.name)
+                    orphans += 1
+                elif blob.refcount != actual:
+                    MediaBlob.objects.filter(pk=blob.pk).update(refcount=actual)
+                    fixed += 1
+
+            # Files whose blob row was rolled back with the save that stored them
+            known = set(MediaBlob.objects.values_list('name', flat=True))
+            root = media_storage.path(BLOB_DIR)
+            for directory, _, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    name = f'{BLOB_DIR}/{os.path.relpath(path, root).replace(os.sep, "/")}'
+                    modified = datetime.fromtimestamp(os.path.getmtime(path), tz=dt_timezone.utc)
+                    if name not in known and modified < cutoff:
+                        os.remove(path)
+                        orphans += 1
+        return fixed, orphans
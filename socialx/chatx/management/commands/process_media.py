@@ -0,0 +1,53 @@
+# chatx/management/commands/process_media.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatx.extractors import get_extractor
+from chatx.media import MEDIA_BATCH_SIZE, process_batch, queue_media_job
+from chatx.models import MediaJob, Post
+
+
+class Command(BaseCommand):
+    help = 'Probe uploaded videos for their details and poster frame'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new jobs')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+        parser.add_argument('--batch-size', type=int, default=MEDIA_BATCH_SIZE)
+        parser.add_argument('--backfill', action='store_true', help='First queue every video post that has no job yet')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            posts = Post.objects.exclude(video='').exclude(video__isnull=True).filter(media_job__isnull=True)
+            queued = 0
+            for post in posts.iterator():
+                queue_media_job(post)
+                queued += 1
+            self.stdout.write(f'Queued {queued} video(s).')
+
+        extractor = get_extractor()
+        self.stdout.write(f'Using {extractor.__class__.__name__}.')
+        while True:
+            self.drain(options['batch_size'], extractor)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        failed = MediaJob.objects.filter(status=MediaJob.FAILED).count()
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} job(s) have failed for good.'))
+
+    def drain(self, batch_size, extractor):
+        """Run batches until nothing is due"""
+        while True:
+            stats = process_batch(batch_size, extractor)
+            handled = sum(stats.values())
+            if not handled:
+                return
+            self.stdout.write(
+                f'Processed {stats["done"]}, retrying {stats["retried"]}, gave up on {stats["failed"]}.'
+            )
+            if handled < batch_size:
+                return
@@ -0,0 +1,31 @@
+# chatx/management/commands/purge_email_verifications.py
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from chatx.models import EmailVerification
+
+
+class Command(BaseCommand):
+    help = 'Delete verified and expired EmailVerification rows (codes now live in chatx.otp)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Delete every row, including codes that have not expired yet',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would go')
+
+    def handle(self, *args, **options):
+        rows = EmailVerification.objects.all()
+        if not options['all']:
+            rows = rows.filter(Q(verified=True) | Q(expires_at__lte=timezone.now()))
+
+        if options['dry_run']:
+            self.stdout.write(f'{rows.count()} row(s) would be deleted.')
+            return
+
+        deleted, _ = rows.delete()
+        remaining = EmailVerification.objects.count()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} row(s); {remaining} left.'))
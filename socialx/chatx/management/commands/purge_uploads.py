@@ -0,0 +1,27 @@
+# chatx/management/commands/purge_uploads.py
+
+import os
+
+from django.core.management.base import BaseCommand
+
+from chatx.models import ChunkedUpload
+from chatx.uploads import purge_expired, upload_dir
+
+
+class Command(BaseCommand):
+    help = 'Remove chunked uploads abandoned for a day, and spool files nothing refers to'
+
+    def handle(self, *args, **options):
+        purged = purge_expired()
+
+        # List the files before the rows, so an upload started meanwhile is never mistaken for an orphan
+        directory = upload_dir()
+        names = os.listdir(directory)
+        known = {f'{pk}.part' for pk in ChunkedUpload.objects.values_list('pk', flat=True)}
+        orphans = 0
+        for name in names:
+            if name.endswith('.part') and name not in known:
+                os.remove(os.path.join(directory, name))
+                orphans += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Removed {purged} upload(s) and {orphans} orphaned file(s).'))
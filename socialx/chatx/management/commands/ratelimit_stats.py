@@ -0,0 +1,19 @@
+# chatx/management/commands/ratelimit_stats.py
+
+from django.core.management.base import BaseCommand
+
+import chatx.views  # noqa: F401 - the @ratelimit decorators register their scopes
+from chatx.ratelimit import SCOPES, stats
+
+
+class Command(BaseCommand):
+    help = 'Show how many requests each rate limit has allowed and throttled'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"scope":<24}{"rate":>8}{"allowed":>10}{"throttled":>11}{"shed %":>8}')
+        for scope, counts in stats().items():
+            total = counts['allowed'] + counts['throttled']
+            shed = 100 * counts['throttled'] / total if total else 0
+            self.stdout.write(
+                f'{scope:<24}{SCOPES[scope]:>8}{counts["allowed"]:>10}{counts["throttled"]:>11}{shed:>7.1f}%'
+            )
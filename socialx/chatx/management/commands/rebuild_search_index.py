@@ -0,0 +1,18 @@
+# chatx/management/commands/rebuild_search_index.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chatx.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from posts, usernames and bios'
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            raise CommandError('The full-text index is only available on the SQLite backend.')
+
+        with transaction.atomic():
+            rows = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {rows} row(s).'))
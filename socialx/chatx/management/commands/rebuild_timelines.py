@@ -0,0 +1,25 @@
+# chatx/management/commands/rebuild_timelines.py
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from chatx.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized home timelines from posts and follows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only rebuild these users (default: everyone)')
+
+    def handle(self, *args, **options):
+        users = User.objects.select_related('profile')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        count = 0
+        for user in users.iterator():
+            rebuild_timeline(user)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} timeline(s).'))
@@ -0,0 +1,45 @@
+# chatx/management/commands/reconcile_counters.py
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from chatx.counters import actual_post_counts, actual_profile_counts
+from chatx.models import Post, Profile
+
+
+class Command(BaseCommand):
+    help = 'Compare stored post/profile counters with the real rows and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        total = 0
+        total += self.reconcile(Post, actual_post_counts(), options['dry_run'])
+        total += self.reconcile(Profile, actual_profile_counts(), options['dry_run'])
+
+        if not total:
+            self.stdout.write(self.style.SUCCESS('All counters match.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{total} row(s) have drifted.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Fixed {total} row(s).'))
+
+    def reconcile(self, model, expressions, dry_run):
+        actual = {f'actual_{field}': expr for field, expr in expressions.items()}
+        drifted = Q()
+        for field in expressions:
+            drifted |= ~Q(**{field: F(f'actual_{field}')})
+
+        rows = model.objects.annotate(**actual).filter(drifted).values('pk', *expressions, *actual)
+        count = 0
+        for row in rows.iterator():
+            fixes = {field: row[f'actual_{field}'] for field in expressions}
+            changes = ', '.join(
+                f'{field} {row[field]} -> {value}' for field, value in fixes.items() if row[field] != value
+            )
+            self.stdout.write(f'{model.__name__} #{row["pk"]}: {changes}')
+            if not dry_run:
+                model.objects.filter(pk=row['pk']).update(**fixes)
+            count += 1
+        return count
@@ -0,0 +1,52 @@
+# chatx/management/commands/send_outbox.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatx.outbox import OUTBOX_BATCH_SIZE, deliver_batch, metrics, purge_finished
+
+# With --loop, finished mail past its retention is deleted this often (seconds)
+PURGE_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails from the outbox, one backend connection per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new mail')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument('--stats', action='store_true', help='Print delivery metrics and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for name, value in metrics().items():
+                self.stdout.write(f'{name:<24}{value:>10.1f}' if isinstance(value, float) else f'{name:<24}{value:>10}')
+            return
+
+        last_purge = None
+        while True:
+            self.drain(options['batch_size'])
+            if last_purge is None or time.monotonic() - last_purge >= PURGE_INTERVAL:
+                purged = purge_finished()
+                if purged:
+                    self.stdout.write(f'Purged {purged} finished email(s).')
+                last_purge = time.monotonic()
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def drain(self, batch_size):
+        """Send batches until nothing is due"""
+        while True:
+            stats = deliver_batch(batch_size)
+            handled = stats['sent'] + stats['retried'] + stats['failed']
+            if not handled:
+                return
+            self.stdout.write(
+                f'Sent {stats["sent"]}, retrying {stats["retried"]}, '
+                f'gave up on {stats["failed"]} in {stats["smtp_ms"]} ms.'
+            )
+            if handled < batch_size:
+                return
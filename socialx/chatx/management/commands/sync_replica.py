@@ -0,0 +1,57 @@
+# chatx/management/commands/sync_replica.py
+
+import os
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from chatx.routers import REPLICA_ALIAS, replica_configured
+
+
+class Command(BaseCommand):
+    help = 'Refresh the SQLite stand-in replica with a consistent snapshot of the primary'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep copying every this many seconds instead of once',
+        )
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError('No replica configured; set REPLICA_DATABASE_NAME.')
+        primary = connections['default'].settings_dict
+        replica = connections[REPLICA_ALIAS].settings_dict
+        if primary['ENGINE'] != 'django.db.backends.sqlite3' or replica['ENGINE'] != primary['ENGINE']:
+            raise CommandError('sync_replica only copies SQLite databases; use real replication elsewhere.')
+
+        while True:
+            start = time.perf_counter()
+            self.copy(str(primary['NAME']), str(replica['NAME']))
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stdout.write(f'Replica refreshed in {elapsed:.0f} ms.')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def copy(self, source, target):
+        """
+        Back up into a temporary file and swap it in, so readers see either the
+        old snapshot or the new one, never a half-written file.
+        """
+        partial = f'{target}.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+
+        src = sqlite3.connect(source)
+        dst = sqlite3.connect(partial)
+        try:
+            src.backup(dst)
+            # A plain rollback journal: the replica is only ever read
+            dst.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            dst.close()
+            src.close()
+        os.replace(partial, target)
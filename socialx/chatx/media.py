@@ -0,0 +1,203 @@
+# chatx/media.py
+
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from .extractors import get_extractor
+from .images import delete_renditions, process_post_image
+from .models import MediaJob, Post
+
+MEDIA_BATCH_SIZE = 10
+MAX_ATTEMPTS = 3
+RETRY_DELAY = timedelta(minutes=2)
+
+# A claimed job is hidden from other workers this long; if the worker dies
+# mid-job it simply becomes due again afterwards
+CLAIM_LEASE = timedelta(minutes=10)
+
+# Posters come from a little way in, past any fade from black
+POSTER_AT_SECONDS = 1.0
+
+
+def _is_new(field_file):
+    """True when the field holds an upload that hasn't been stored yet"""
+    return bool(field_file) and not field_file._committed
+
+
+class MediaChange:
+    """What update_post_media() changed; call saved() once the post is saved"""
+
+    def __init__(self, changed=False, stale_renditions=None, new_video=False):
+        self.changed = changed
+        self.stale_renditions = stale_renditions or {}
+        self.new_video = new_video
+
+    def saved(self, post):
+        delete_renditions(self.stale_renditions)
+        if self.new_video:
+            queue_media_job(post)
+        elif self.changed:
+            # Now an image or no media at all: no video left to probe
+            MediaJob.objects.filter(post=post).delete()
+
+
+def update_post_media(post):
+    """
+    Bring the stored media details (dimensions, byte size, image renditions)
+    in line with post.image / post.video before the post is saved, so pages
+    never have to open the file. A video's other details arrive later from
+    its MediaJob. Returns a MediaChange; call its saved() after the save to
+    clean up and queue that job. Raises InvalidImage for an image Pillow
+    can't read.
+    """
+    if (post.image or post.video) and not (_is_new(post.image) or _is_new(post.video)):
+        return MediaChange()
+
+    change = MediaChange(True, post.image_renditions, new_video=_is_new(post.video))
+    post.image_renditions = {}
+    post.media_width = post.media_height = post.media_bytes = post.media_duration = None
+    post.video_codec = ''
+    post.video_poster = None  # django_cleanup removes the old file after the save
+
+    if post.image:
+        process_post_image(post)
+        post.media_bytes = post.image.size
+    elif post.video:
+        post.media_bytes = post.video.size
+    return change
+
+
+def queue_media_job(post):
+    """Queue (or start over) the job for the post's current video"""
+    now = timezone.now()
+    job, _ = MediaJob.objects.update_or_create(post=post, defaults={
+        'queued_at': now,
+        'status': MediaJob.PENDING,
+        'attempts': 0,
+        'next_attempt_at': now,
+        'last_error': '',
+        'finished_at': None,
+    })
+    if getattr(settings, 'MEDIA_PROCESS_IMMEDIATELY', False):
+        # No worker running (see BACKGROUND_WORKERS), so process right after
+        # the commit; just this video, never a backlog queued by others
+        transaction.on_commit(lambda: process_batch(ids=[job.pk]))
+
+
+@contextmanager
+def local_path(field_file):
+    """A filesystem path for the file, copying it down first if storage is remote"""
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+    if path:
+        yield path
+        return
+
+    suffix = os.path.splitext(field_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as copy:
+        with field_file.open('rb') as f:
+            for chunk in f.chunks():
+                copy.write(chunk)
+        copy.flush()
+        yield copy.name
+
+
+def _claim(limit, ids=None):
+    """Take up to `limit` due jobs, leasing them so no other worker runs them too"""
+    now = timezone.now()
+    due = MediaJob.objects.filter(status=MediaJob.PENDING, next_attempt_at__lte=now)
+    if ids is not None:
+        due = due.filter(pk__in=ids)
+    with transaction.atomic():
+        batch = list(
+            due.select_for_update(skip_locked=True)
+            .select_related('post')
+            .order_by('next_attempt_at', 'id')[:limit]
+        )
+        MediaJob.objects.filter(pk__in=[job.pk for job in batch]).update(
+            next_attempt_at=now + CLAIM_LEASE
+        )
+    return batch
+
+
+def _current(job):
+    """The job's row as long as nobody re-queued or deleted it since it was claimed"""
+    return MediaJob.objects.filter(pk=job.pk, queued_at=job.queued_at)
+
+
+def _finish(job, status, error=''):
+    _current(job).update(
+        status=status, attempts=job.attempts + 1, last_error=error[:1000], finished_at=timezone.now()
+    )
+
+
+def _failed(job, error):
+    if job.attempts + 1 >= MAX_ATTEMPTS:
+        _finish(job, MediaJob.FAILED, error)
+        return True
+    _current(job).update(
+        attempts=job.attempts + 1,
+        last_error=error[:1000],
+        next_attempt_at=timezone.now() + RETRY_DELAY * (job.attempts + 1),
+    )
+    return False
+
+
+def _store(job, info, poster):
+    """Save the results, unless a new video was uploaded (or it was removed) meanwhile"""
+    with transaction.atomic():
+        if not _current(job).select_for_update().exists():
+            return False
+        post = Post.objects.get(pk=job.post_id)
+        post.media_width = info.get('width') or None
+        post.media_height = info.get('height') or None
+        post.media_duration = info.get('duration')
+        post.video_codec = info.get('codec', '')[:32]
+        fields = ['media_width', 'media_height', 'media_duration', 'video_codec']
+        if poster:
+            name = os.path.splitext(os.path.basename(post.video.name))[0]
+            post.video_poster.save(f'{name}.jpg', ContentFile(poster), save=False)
+            fields.append('video_poster')
+        post.save(update_fields=fields)
+    return True
+
+
+def process_job(job, extractor):
+    """Probe the video and grab its poster frame"""
+    post = job.post
+    if not post.video:
+        return
+
+    with local_path(post.video) as path:
+        info = extractor.probe(path)
+        duration = info.get('duration') or 0
+        poster = extractor.poster(path, min(POSTER_AT_SECONDS, duration / 2))
+    _store(job, info, poster)
+
+
+def process_batch(limit=MEDIA_BATCH_SIZE, extractor=None, ids=None):
+    """Run one batch of due jobs (only those with the given `ids` when passed). Returns {'done', 'retried', 'failed'}."""
+    stats = {'done': 0, 'retried': 0, 'failed': 0}
+    batch = _claim(limit, ids)
+    if not batch:
+        return stats
+
+    extractor = extractor or get_extractor()
+    for job in batch:
+        try:
+            process_job(job, extractor)
+        except Exception as e:
+            stats['failed' if _failed(job, str(e) or e.__class__.__name__) else 'retried'] += 1
+        else:
+            _finish(job, MediaJob.DONE)
+            stats['done'] += 1
+    return stats
@@ -0,0 +1,43 @@
+# chatx/middleware.py
+
+from django.contrib.auth.middleware import get_user
+from django.utils.functional import SimpleLazyObject
+
+from .lookups import attach_profile
+from .routers import STICKY_COOKIE, STICKY_SECONDS, replica_configured, tracking_writes
+
+
+class ViewerProfileMiddleware:
+    """
+    Attach the viewer's cached profile to request.user, so the many
+    `request.user.profile` reads cost no query. Goes after
+    AuthenticationMiddleware: the user itself is still loaded, and its
+    session checked, by django.contrib.auth, and stays lazy.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user = SimpleLazyObject(lambda: attach_profile(get_user(request)))
+        return self.get_response(request)
+
+
+class ReadYourWritesMiddleware:
+    """
+    After a request that wrote to the primary, set a short-lived cookie that
+    makes @read_from_replica views read from the primary for that client.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with tracking_writes() as writes:
+            response = self.get_response(request)
+        if writes['seen'] and replica_configured():
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=STICKY_SECONDS,
+                secure=request.is_secure(), httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Same limits as chatx/timeline.py, copied so later changes there don't alter this migration
+BACKFILL_LIMIT = 100
+BATCH_SIZE = 500
+
+
+def populate_timelines(apps, schema_editor):
+    """Give every user the timeline rebuild_timeline() would: their own recent posts and those of everyone they follow"""
+    Post = apps.get_model('chatx', 'Post')
+    Profile = apps.get_model('chatx', 'Profile')
+    TimelineEntry = apps.get_model('chatx', 'TimelineEntry')
+
+    recent = {}  # author id -> [(post id, created_at)], read once however many follow them
+
+    def recent_posts(author_id):
+        if author_id not in recent:
+            recent[author_id] = list(
+                Post.objects.filter(author_id=author_id)
+                .order_by('-created_at', '-id')
+                .values_list('id', 'created_at')[:BACKFILL_LIMIT]
+            )
+        return recent[author_id]
+
+    followed = {}  # follower user id -> followed user ids
+    for user_id, followed_user_id in Profile.follows.through.objects.values_list(
+        'from_profile__user_id', 'to_profile__user_id'
+    ).iterator():
+        followed.setdefault(user_id, []).append(followed_user_id)
+
+    batch = []
+    for user_id in Profile.objects.values_list('user_id', flat=True).iterator():
+        for author_id in [user_id, *followed.get(user_id, [])]:
+            for post_id, created_at in recent_posts(author_id):
+                batch.append(TimelineEntry(
+                    user_id=user_id, post_id=post_id, author_id=author_id, created_at=created_at,
+                ))
+            if len(batch) >= BATCH_SIZE:
+                TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatx', '0009_post_created_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='chatx.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx'), models.Index(fields=['user', 'author'], name='timeline_user_author_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'post'), name='timeline_unique_user_post')],
+            },
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:08
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_rows(model, field):
+    rows = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return Coalesce(Subquery(rows.annotate(n=Count('pk')).values('n')), 0)
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('chatx', 'Post')
+    Profile = apps.get_model('chatx', 'Profile')
+    Comment = apps.get_model('chatx', 'Comment')
+
+    Post.objects.update(
+        likes_count=count_rows(Post.likes.through, 'post'),
+        comments_count=count_rows(Comment, 'post'),
+        saves_count=count_rows(Post.saves.through, 'post'),
+    )
+    Profile.objects.update(
+        followers_count=count_rows(Profile.follows.through, 'to_profile'),
+        following_count=count_rows(Profile.follows.through, 'from_profile'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatx', '0010_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='saves_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_aggregation(apps, schema_editor):
+    Notification = apps.get_model('chatx', 'Notification')
+    for notification in Notification.objects.only('pk', 'sender_id', 'created_at').iterator():
+        Notification.objects.filter(pk=notification.pk).update(
+            updated_at=notification.created_at,
+            recent_actor_ids=[notification.sender_id],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatx', '0011_interaction_counters'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='notification',
+            options={'ordering': ['-updated_at', '-id']},
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='recent_actor_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_aggregation, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatx', '0012_notification_aggregation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'is_read', '-updated_at'], name='notif_recipient_read_idx'),
+        ),
+    ]
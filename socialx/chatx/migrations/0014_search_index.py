@@ -0,0 +1,45 @@
+# Creates the SQLite FTS5 index used by chatx.search (a no-op on other backends)
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # rowids follow chatx.search.row_id(): object_id * 2, plus 1 for users
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chatx_search_index USING fts5(
+            kind UNINDEXED,
+            object_id UNINDEXED,
+            title,
+            body,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    schema_editor.execute("""
+        INSERT INTO chatx_search_index (rowid, kind, object_id, title, body)
+        SELECT id * 2, 'post', id, '', text FROM chatx_post
+    """)
+    schema_editor.execute("""
+        INSERT INTO chatx_search_index (rowid, kind, object_id, title, body)
+        SELECT auth_user.id * 2 + 1, 'user', auth_user.id, auth_user.username, chatx_profile.bio
+        FROM auth_user JOIN chatx_profile ON chatx_profile.user_id = auth_user.id
+    """)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS chatx_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatx', '0013_notification_inbox_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
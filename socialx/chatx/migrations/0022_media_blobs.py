@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:45
+
+import chatx.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatx', '0021_chunked_uploads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=chatx.storage.DedupStorage(), upload_to='post_images/'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='video',
+            field=models.FileField(blank=True, null=True, storage=chatx.storage.DedupStorage(), upload_to='post_videos/'),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=chatx.storage.DedupStorage(), upload_to='profile_pics'),
+        ),
+    ]
@@ -1,43 +1,152 @@
 # chatx/models.py
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Prefetch, Value
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
 import random
 import string
+import uuid
 
-class Post(models.Model):
+from .storage import media_storage
+
+class CounterFieldsMixin:
+    """
+    Counter columns only move through F() updates (see chatx.counters), so a
+    plain save() of an existing row leaves them out rather than writing back
+    whatever stale value was loaded with the instance.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class MediaReferencesMixin:
+    """
+    Storing an upload takes its blob reference right away (chatx/storage.py),
+    so the row is saved in the same transaction: if the save fails, the
+    reference is given back along with it.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class PostQuerySet(models.QuerySet):
+    def for_viewer(self, user):
+        """
+        Preload everything a post card renders, so a page of posts costs a
+        fixed number of queries: author and profile are joined, the viewer's
+        liked/saved flags are annotated, and the first three comments (with
+        their authors' profiles) are prefetched into `recent_comments`.
+        Counts come from the stored *_count columns.
+        """
+        if user.is_authenticated:
+            is_liked = Exists(Post.likes.through.objects.filter(post=OuterRef('pk'), user=user))
+            is_saved = Exists(Post.saves.through.objects.filter(post=OuterRef('pk'), user=user))
+        else:
+            is_liked = is_saved = Value(False)
+
+        recent_comments = Comment.objects.select_related('author__profile').order_by('created_at', 'id')[:3]
+        return self.select_related('author__profile').annotate(
+            is_liked=is_liked,
+            is_saved=is_saved,
+        ).prefetch_related(
+            Prefetch('comments', queryset=recent_comments, to_attr='recent_comments'),
+        )
+
+
+class Post(MediaReferencesMixin, CounterFieldsMixin, models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField(max_length=280)
-    image = models.ImageField(upload_to='post_images/', blank=True, null=True)
-    video = models.FileField(upload_to='post_videos/', blank=True, null=True)
+    # Both deduplicated by content, as is the profile image (see chatx/storage.py)
+    image = models.ImageField(upload_to='post_images/', storage=media_storage, blank=True, null=True)
+    video = models.FileField(upload_to='post_videos/', storage=media_storage, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    # Details of the image or video, filled in at upload time by chatx.media
+    media_width = models.PositiveIntegerField(null=True, blank=True)
+    media_height = models.PositiveIntegerField(null=True, blank=True)
+    media_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    media_duration = models.FloatField(null=True, blank=True)  # Seconds, videos only
+    video_codec = models.CharField(max_length=32, blank=True)
+    # A frame shown in place of the video until it is played
+    video_poster = models.ImageField(upload_to='post_posters/', blank=True, null=True)
+    # Rendition name -> {'width', 'height', 'webp', 'jpeg'} (storage names)
+    image_renditions = models.JSONField(default=dict, blank=True)
     
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
     saves = models.ManyToManyField(User, related_name='saved_posts', blank=True)
+
+    # Denormalized counters, kept in step by chatx.counters (see reconcile_counters)
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    saves_count = models.PositiveIntegerField(default=0)
+    counter_fields = ('likes_count', 'comments_count', 'saves_count')
+
+    objects = PostQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
         verbose_name = "Post"
         verbose_name_plural = "Posts"
+        indexes = [
+            # Keyset pagination of the feed walks (created_at, id) newest first
+            models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+            # A profile lists one author's posts newest first
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_created_idx'),
+        ]
 
     def __str__(self):
         return f'Post by {self.author.username} at {self.created_at.strftime("%Y-%m-%d %H:%M")}'
 
 
-class Profile(models.Model):
+class Profile(MediaReferencesMixin, CounterFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='profile_pics', blank=True, null=True)
+    image = models.ImageField(upload_to='profile_pics', storage=media_storage, blank=True, null=True)
     bio = models.TextField(blank=True)
     follows = models.ManyToManyField('self', related_name='followed_by', symmetrical=False, blank=True)
     is_private = models.BooleanField(default=False)
     email_verified = models.BooleanField(default=False)  # NEW
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    counter_fields = ('followers_count', 'following_count')
 
     def __str__(self):
         return f'{self.user.username} Profile'
 
 
+class TimelineEntry(models.Model):
+    """A post materialized into one user's home timeline (fan-out on write)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()  # Copied from post.created_at
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='timeline_unique_user_post'),
+        ]
+        indexes = [
+            # Reading a timeline is one range scan over this index
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx'),
+            # Unfollow prunes one author's entries out of one timeline
+            models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.post} in {self.user.username} timeline'
+
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -46,6 +155,10 @@ class Comment(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # A post's comments, oldest first (cards prefetch the first few)
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_idx'),
+        ]
     
     def __str__(self):
         return f'Comment by {self.author.username} on {self.post}'
@@ -66,15 +179,30 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Aggregation: `sender` is the most recent actor, `actor_count` how many
+    # distinct actors were folded into this row (see chatx.notifications)
+    actor_count = models.PositiveIntegerField(default=1)
+    recent_actor_ids = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-updated_at', '-id']
+        indexes = [
+            # Covers the unread count (recipient, then is_read read from the index)
+            models.Index(fields=['recipient', 'is_read', '-updated_at'], name='notif_recipient_read_idx'),
+            # The inbox and notify() walk one recipient's rows newest first
+            models.Index(fields=['recipient', '-updated_at', '-id'], name='notif_recipient_updated_idx'),
+        ]
     
     def __str__(self):
         return f'{self.sender.username} {self.notification_type} - {self.recipient.username}'
 
 
 class EmailVerification(models.Model):
-    """Store OTP for email verification"""
+    """
+    OTPs as stored before chatx.otp moved them into an expiring cache. No
+    longer written; clear old rows with `manage.py purge_email_verifications`.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     email = models.EmailField()
     otp = models.CharField(max_length=6)
@@ -105,4 +233,112 @@ class EmailVerification(models.Model):
         return f'OTP for {self.email} - {self.otp}'
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+
+class OutboxEmail(models.Model):
+    """A queued email; views enqueue these and `manage.py send_outbox` delivers them"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # The worker picks up pending rows whose next attempt is due
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {self.to} ({self.status})'
+
+
+class MediaJob(models.Model):
+    """
+    Reading a post's video for its details and poster frame. One row per
+    post; views queue it and `manage.py process_media` works through them.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='media_job')
+    # Reset whenever a new video is uploaded, so a worker still busy with the
+    # old one can tell its results are stale
+    queued_at = models.DateTimeField(default=timezone.now)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # The worker picks up pending jobs whose next attempt is due
+            models.Index(fields=['status', 'next_attempt_at'], name='mediajob_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'Media job for post {self.post_id} ({self.status})'
+
+
+class ChunkedUpload(models.Model):
+    """A media file arriving in pieces through the upload API (see chatx/uploads.py)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)  # Of the whole file; checked on completion if given
+    offset = models.PositiveBigIntegerField(default=0)  # Bytes received so far
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # purge_uploads finds abandoned uploads by their last activity
+            models.Index(fields=['updated_at'], name='upload_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size}) by {self.user.username}'
+
+
+class MediaBlob(models.Model):
+    """
+    One stored media file, shared by every field holding the same bytes
+    (see chatx/storage.py). `refcount` is how many fields point at it.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=100, unique=True)  # Storage name, blobs/ab/ab12...ef.jpg
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount} reference(s))'
@@ -0,0 +1,110 @@
+# chatx/mp4.py
+
+import struct
+
+# Just enough of the ISO base media format (MP4, MOV, M4V) to read a video's
+# display size and length from its headers, seeking past everything else.
+
+CONTAINERS = {b'moov', b'trak', b'mdia'}
+
+
+def _boxes(f, start, end):
+    """Yield (type, content_start, box_end) for the boxes between start and end"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - offset  # Runs to the end of the file
+        if size < header:
+            return
+        yield kind, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _find(f, start, end, kind):
+    for found, content_start, box_end in _boxes(f, start, end):
+        if found == kind:
+            return content_start, box_end
+    return None
+
+
+def _duration(f, mvhd_start):
+    f.seek(mvhd_start)
+    version = f.read(4)[0]
+    if version == 1:
+        f.seek(16, 1)
+        timescale, duration = struct.unpack('>IQ', f.read(12))
+    else:
+        f.seek(8, 1)
+        timescale, duration = struct.unpack('>II', f.read(8))
+    return duration / timescale if timescale else None
+
+
+def _display_size(f, tkhd_start):
+    """Width and height from the track header, swapped when the matrix turns it a quarter"""
+    f.seek(tkhd_start)
+    version = f.read(4)[0]
+    f.seek(tkhd_start + (52 if version == 1 else 40))
+    matrix = struct.unpack('>9i', f.read(36))
+    width, height = struct.unpack('>II', f.read(8))
+    width, height = width >> 16, height >> 16
+    if matrix[0] == 0 and matrix[1] != 0:
+        width, height = height, width
+    return width, height
+
+
+def _codec(f, trak):
+    """The first sample entry's four-character code (avc1, hvc1, ...), if it can be found"""
+    box = trak
+    for kind in (b'mdia', b'minf', b'stbl', b'stsd'):
+        box = _find(f, *box, kind)
+        if box is None:
+            return None
+    # Version/flags and the entry count come before the first entry's box header
+    f.seek(box[0] + 12)
+    return f.read(4).decode('latin-1').strip()
+
+
+def _is_video_track(f, trak):
+    mdia = _find(f, *trak, b'mdia')
+    hdlr = mdia and _find(f, *mdia, b'hdlr')
+    if not hdlr:
+        return False
+    f.seek(hdlr[0] + 8)
+    return f.read(4) == b'vide'
+
+
+def probe(f):
+    """
+    {'width', 'height', 'duration', 'codec'} for a seekable MP4/MOV file
+    object, with whatever could be found; None if it isn't one. The codec is
+    the sample entry code, e.g. 'avc1' for H.264.
+    """
+    try:
+        f.seek(0, 2)
+        moov = _find(f, 0, f.tell(), b'moov')
+        if moov is None:
+            return None
+
+        info = {}
+        mvhd = _find(f, *moov, b'mvhd')
+        if mvhd:
+            info['duration'] = _duration(f, mvhd[0])
+
+        for kind, start, end in _boxes(f, *moov):
+            if kind == b'trak' and _is_video_track(f, (start, end)):
+                tkhd = _find(f, start, end, b'tkhd')
+                if tkhd:
+                    info['width'], info['height'] = _display_size(f, tkhd[0])
+                codec = _codec(f, (start, end))
+                if codec:
+                    info['codec'] = codec
+                break
+        return info
+    except (struct.error, IndexError):
+        return None
@@ -0,0 +1,134 @@
+# chatx/notifications.py
+
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Notification
+from .pagination import keyset_page
+
+# Same-type events on the same target share one row until it is this old,
+# counted from the row's first event, so steady activity still starts new rows
+AGGREGATION_WINDOW = timedelta(hours=24)
+
+# How many of the latest actors are remembered on an aggregated row
+RECENT_ACTORS_LIMIT = 3
+
+# Read notifications older than this drop out of the inbox
+READ_RETENTION = timedelta(days=30)
+
+NOTIFICATIONS_PAGE_SIZE = 20
+
+# The cached unread count is dropped on every change (after the commit) and
+# rebuilt by the next read; the timeout only bounds drift from bulk updates
+UNREAD_CACHE_TIMEOUT = 60 * 60
+
+
+def _unread_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def unread_count(user):
+    """Unread notifications for the navbar badge, from the cache when possible"""
+    key = _unread_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        # Counted on the primary: a lagging replica would cache a count
+        # missing the latest notifications until the next change
+        count = Notification.objects.using('default').filter(recipient=user, is_read=False).count()
+        cache.set(key, count, UNREAD_CACHE_TIMEOUT)
+    return count
+
+
+def forget_unread(user_id):
+    """
+    Drop the cached unread count, for the next read to recount. Moving it
+    with incr()/decr() instead would lose updates on caches where those
+    aren't atomic, the database cache among them.
+    """
+    cache.delete(_unread_key(user_id))
+
+
+def notify(recipient_id, sender, notification_type, post=None, comment=None):
+    """
+    Record that `sender` liked/commented/followed, folding it into the
+    recipient's latest notification of the same type on the same target when
+    that one was started within AGGREGATION_WINDOW. Repeats by an actor already on the row refresh
+    it without inflating the actor count.
+    """
+    if recipient_id == sender.pk:
+        return None
+
+    now = timezone.now()
+    with transaction.atomic():
+        notification = (
+            Notification.objects.select_for_update()
+            .filter(
+                recipient_id=recipient_id,
+                notification_type=notification_type,
+                post=post,
+                created_at__gte=now - AGGREGATION_WINDOW,
+                # Implied by the above; bounds the walk down the (recipient, updated_at) index
+                updated_at__gte=now - AGGREGATION_WINDOW,
+            )
+            .order_by('-updated_at', '-id')
+            .first()
+        )
+
+        if notification is None:
+            transaction.on_commit(lambda: forget_unread(recipient_id))
+            return Notification.objects.create(
+                recipient_id=recipient_id,
+                sender=sender,
+                notification_type=notification_type,
+                post=post,
+                comment=comment,
+                recent_actor_ids=[sender.pk],
+                updated_at=now,
+            )
+
+        actors = notification.recent_actor_ids or []
+        if sender.pk not in actors:
+            notification.actor_count = F('actor_count') + 1
+        notification.recent_actor_ids = (
+            [sender.pk] + [pk for pk in actors if pk != sender.pk]
+        )[:RECENT_ACTORS_LIMIT]
+        notification.sender = sender
+        if comment is not None:
+            notification.comment = comment
+        if notification.is_read:
+            transaction.on_commit(lambda: forget_unread(recipient_id))
+        notification.is_read = False
+        notification.updated_at = now
+        notification.save(update_fields=[
+            'actor_count', 'recent_actor_ids', 'sender', 'comment', 'is_read', 'updated_at',
+        ])
+        return notification
+
+
+def inbox_page(user, cursor):
+    """
+    One page of the user's inbox, newest first: everything unread plus what
+    was read within READ_RETENTION, read newest first off the
+    (recipient, updated_at, id) index until the page is full.
+    """
+    notifications = (
+        Notification.objects.filter(recipient=user)
+        .filter(Q(is_read=False) | Q(is_read=True, updated_at__gte=timezone.now() - READ_RETENTION))
+        .select_related('sender__profile', 'comment')
+    )
+    return keyset_page(notifications, cursor, NOTIFICATIONS_PAGE_SIZE, field='updated_at')
+
+
+def mark_delivered_read(user, notifications):
+    """Mark only the notifications actually shown as read, keeping the cached count in step"""
+    unread_ids = [notification.pk for notification in notifications if not notification.is_read]
+    if not unread_ids:
+        return 0
+    marked = Notification.objects.filter(recipient=user, pk__in=unread_ids, is_read=False).update(is_read=True)
+    if marked:
+        forget_unread(user.pk)
+    return marked
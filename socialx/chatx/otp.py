@@ -0,0 +1,108 @@
+# chatx/otp.py
+
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.cache import caches
+from django.utils import timezone
+
+OTP_TTL = timedelta(minutes=10)
+MAX_ATTEMPTS = 5
+
+# Codes are kept this long past expiry so a late entry is reported as
+# "expired" rather than "invalid", then the cache drops them on its own
+EXPIRED_GRACE = timedelta(minutes=30)
+
+# A separate cache alias: codes must outlive a default cache pointed at
+# Memcached, which may evict them early (see CACHES in settings)
+OTP_CACHE_ALIAS = 'otp'
+
+
+class PendingCode:
+    """An issued code as read back from the store"""
+
+    def __init__(self, otp, expires_at, user_id=None):
+        self.otp = otp
+        self.expires_at = expires_at
+        self.user_id = user_id
+
+    def is_valid(self):
+        """Check if OTP is still valid"""
+        return timezone.now() < self.expires_at
+
+    def minutes_remaining(self):
+        return max(0, int((self.expires_at - timezone.now()).total_seconds()) // 60)
+
+
+def _store():
+    return caches[OTP_CACHE_ALIAS]
+
+
+def _keys(email):
+    # Hashed: cache keys must be short and free of arbitrary characters
+    digest = hashlib.sha256(email.strip().lower().encode()).hexdigest()
+    return f'otp:code:{digest}', f'otp:attempts:{digest}'
+
+
+def generate_otp():
+    """Generate 6-digit OTP"""
+    return f'{secrets.randbelow(10 ** 6):06d}'
+
+
+def issue(email, user=None):
+    """Create a fresh code for `email`, replacing any earlier one, and return it"""
+    code_key, attempts_key = _keys(email)
+    otp = generate_otp()
+    expires_at = timezone.now() + OTP_TTL
+    store = _store()
+    store.set(code_key, {
+        'otp': otp,
+        'expires_at': expires_at.timestamp(),
+        'user_id': user.pk if user is not None else None,
+    }, (OTP_TTL + EXPIRED_GRACE).total_seconds())
+    store.delete(attempts_key)
+    return otp
+
+
+def pending(email):
+    """The outstanding code for `email`, or None"""
+    entry = _store().get(_keys(email)[0])
+    if entry is None:
+        return None
+    expires_at = datetime.fromtimestamp(entry['expires_at'], tz=dt_timezone.utc)
+    return PendingCode(entry['otp'], expires_at, entry['user_id'])
+
+
+def discard(email):
+    _store().delete_many(_keys(email))
+
+
+def verify(email, otp, user=None):
+    """
+    Match `otp` against the code issued to `email` (and `user`, when given).
+    Returns the PendingCode on a match, used up either way, so callers can
+    tell a valid code from an expired one with is_valid(); None otherwise.
+    A code is thrown away after MAX_ATTEMPTS wrong guesses.
+    """
+    code = pending(email)
+    if code is None:
+        return None
+    if user is not None and code.user_id != user.pk:
+        return None
+
+    if hmac.compare_digest(code.otp, str(otp)):
+        discard(email)
+        return code
+
+    store = _store()
+    attempts_key = _keys(email)[1]
+    store.add(attempts_key, 0, (OTP_TTL + EXPIRED_GRACE).total_seconds())
+    try:
+        attempts = store.incr(attempts_key)
+    except ValueError:
+        attempts = MAX_ATTEMPTS
+    if attempts >= MAX_ATTEMPTS:
+        discard(email)
+    return None
@@ -0,0 +1,156 @@
+# chatx/outbox.py
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Avg, Count, F, Min, Q
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+OUTBOX_BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+
+# Retries wait 30s, 1m, 2m, 4m, ... capped at an hour
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=1)
+
+# A claimed row is hidden from other workers this long; if the worker dies
+# mid-batch the row simply becomes due again afterwards
+CLAIM_LEASE = timedelta(minutes=5)
+
+# How far back metrics() looks for recent deliveries
+METRICS_WINDOW = timedelta(hours=1)
+
+# Finished mail carries OTP codes in its subject and body, so it isn't kept:
+# sent rows go a day after delivery, failed ones a week after queueing
+SENT_RETENTION = timedelta(days=1)
+FAILED_RETENTION = timedelta(days=7)
+
+
+def enqueue(to, subject, body, html_body=''):
+    """
+    Queue one email and return immediately. The row commits together with
+    whatever the caller is doing (e.g. the OTP it carries).
+    """
+    email = OutboxEmail.objects.create(to=to, subject=subject, body=body, html_body=html_body)
+    if getattr(settings, 'OUTBOX_SEND_IMMEDIATELY', False):
+        # No worker running (see BACKGROUND_WORKERS), so deliver right after
+        # the commit; just this email, never a backlog queued by others
+        transaction.on_commit(lambda: deliver_batch(ids=[email.pk]))
+    return email
+
+
+def retry_delay(attempts):
+    """Backoff before attempt number `attempts + 1`"""
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def _claim(limit, ids=None):
+    """Take up to `limit` due emails, leasing them so no other worker sends them too"""
+    now = timezone.now()
+    due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+    if ids is not None:
+        due = due.filter(pk__in=ids)
+    with transaction.atomic():
+        batch = list(due.select_for_update(skip_locked=True).order_by('next_attempt_at', 'id')[:limit])
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            next_attempt_at=now + CLAIM_LEASE
+        )
+    return batch
+
+
+def _failed(email, error):
+    email.attempts += 1
+    email.last_error = error[:1000]
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboxEmail.FAILED
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+    return email.status == OutboxEmail.FAILED
+
+
+def deliver_batch(limit=OUTBOX_BATCH_SIZE, ids=None):
+    """
+    Send one batch of due emails over a single backend connection, only
+    those with the given `ids` when passed.
+    Returns {'sent', 'retried', 'failed', 'smtp_ms'} for the batch.
+    """
+    stats = {'sent': 0, 'retried': 0, 'failed': 0, 'smtp_ms': 0}
+    batch = _claim(limit, ids)
+    if not batch:
+        return stats
+
+    start = time.perf_counter()
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # Server unreachable: the whole batch waits for its next attempt
+        for email in batch:
+            stats['failed' if _failed(email, f'connect: {e}') else 'retried'] += 1
+    else:
+        try:
+            for email in batch:
+                message = EmailMultiAlternatives(
+                    email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.to],
+                    connection=connection,
+                )
+                if email.html_body:
+                    message.attach_alternative(email.html_body, 'text/html')
+                try:
+                    message.send()
+                except Exception as e:
+                    stats['failed' if _failed(email, str(e)) else 'retried'] += 1
+                else:
+                    email.status = OutboxEmail.SENT
+                    email.attempts += 1
+                    email.sent_at = timezone.now()
+                    email.save(update_fields=['status', 'attempts', 'sent_at'])
+                    stats['sent'] += 1
+        finally:
+            connection.close()
+
+    stats['smtp_ms'] = round((time.perf_counter() - start) * 1000)
+    return stats
+
+
+def purge_finished(now=None):
+    """Delete sent and failed emails past their retention; returns how many"""
+    now = now or timezone.now()
+    finished = (
+        Q(status=OutboxEmail.SENT, sent_at__lt=now - SENT_RETENTION)
+        | Q(status=OutboxEmail.FAILED, created_at__lt=now - FAILED_RETENTION)
+    )
+    deleted, _ = OutboxEmail.objects.filter(finished).delete()
+    return deleted
+
+
+# --- Metrics ---
+def metrics(window=METRICS_WINDOW):
+    """
+    The queue and recent deliveries, read from the outbox rows themselves,
+    so `send_outbox --stats` reports the same from any process. The totals
+    cover the rows purge_finished() hasn't removed yet.
+    """
+    now = timezone.now()
+    pending = Q(status=OutboxEmail.PENDING)
+    recent = Q(status=OutboxEmail.SENT, sent_at__gte=now - window)
+    row = OutboxEmail.objects.aggregate(
+        pending=Count('pk', filter=pending),
+        retrying=Count('pk', filter=pending & Q(attempts__gt=0)),
+        sent_recently=Count('pk', filter=recent),
+        sent_total=Count('pk', filter=Q(status=OutboxEmail.SENT)),
+        failed_total=Count('pk', filter=Q(status=OutboxEmail.FAILED)),
+        oldest_pending=Min('created_at', filter=pending),
+        delivery_time=Avg(F('sent_at') - F('created_at'), filter=recent),
+    )
+    oldest, delivery_time = row.pop('oldest_pending'), row.pop('delivery_time')
+    row['oldest_pending_seconds'] = (now - oldest).total_seconds() if oldest else 0.0
+    # From queueing to sending, averaged over the deliveries in the window
+    row['avg_delivery_seconds'] = delivery_time.total_seconds() if delivery_time else 0.0
+    return row
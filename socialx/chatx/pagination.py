@@ -0,0 +1,54 @@
+# chatx/pagination.py
+
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+FEED_PAGE_SIZE = 10
+
+
+def encode_cursor(created_at, pk):
+    """Encode a (timestamp, id) position as an opaque URL-safe token"""
+    raw = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor token, returning None when it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def keyset_page(queryset, cursor, page_size=FEED_PAGE_SIZE, field='created_at', pk_field='id'):
+    """
+    Return one page of `queryset` newest first, plus the cursor for the next page.
+
+    Pages are addressed by the (field, pk_field) of the last row instead of an
+    OFFSET, so every page is a bounded index range scan no matter how deep.
+    """
+    queryset = queryset.order_by(f'-{field}', f'-{pk_field}')
+
+    position = decode_cursor(cursor)
+    if position:
+        created_at, pk = position
+        # The <= bound keeps the (field, pk) index usable as a range scan
+        queryset = queryset.filter(
+            Q(**{f'{field}__lte': created_at}),
+            Q(**{f'{field}__lt': created_at}) | Q(**{f'{pk_field}__lt': pk}),
+        )
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, field), getattr(last, pk_field))
+    return items, next_cursor
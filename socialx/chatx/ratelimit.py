@@ -0,0 +1,199 @@
+# chatx/ratelimit.py
+
+import hashlib
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.shortcuts import render
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+STATS_KEY = 'ratelimit:stats:{scope}:{outcome}'
+
+# A bucket is read and written back under a lock, so concurrent requests
+# can't spend the same token. A crashed holder blocks it this long at most.
+LOCK_TIMEOUT = 2
+# How long a request waits for the lock before it is throttled instead
+LOCK_WAIT = 0.25
+
+# scope -> rate for every bucket created, i.e. every decorated view once
+# chatx.views is imported; stats() reports on these
+SCOPES = {}
+
+
+def _cache():
+    # Buckets must be shared by all workers to mean what they say, as the
+    # default cache is (see CACHES in settings)
+    return caches[getattr(settings, 'RATELIMIT_CACHE_ALIAS', 'default')]
+
+
+def parse_rate(rate):
+    """'5/m', '3/10m', '100/h' -> (requests, seconds)"""
+    match = re.fullmatch(r'(\d+)/(\d*)([smhd])', rate)
+    if not match:
+        raise ValueError(f'Bad rate {rate!r}; expected e.g. "5/m" or "3/10m".')
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+
+class TokenBucket:
+    """
+    `rate` tokens per period, refilled continuously, holding at most `burst`
+    (default: the rate's count). Each request takes one token.
+    """
+
+    def __init__(self, scope, rate, burst=None):
+        count, period = parse_rate(rate)
+        self.scope = scope
+        self.capacity = burst or count
+        self.refill_per_second = count / period
+        # Idle buckets are full again after this, so their entries can expire
+        self.timeout = int(self.capacity / self.refill_per_second) + 1
+        SCOPES[scope] = rate
+
+    def consume(self, identity):
+        """Take a token for `identity`; returns 0 if allowed, else seconds until one is free"""
+        # Hashed: identities can be submitted emails, which aren't valid cache keys everywhere
+        digest = hashlib.sha256(identity.encode()).hexdigest()
+        key = f'ratelimit:{self.scope}:{digest}'
+        cache = _cache()
+
+        with _locked(cache, key) as locked:
+            if not locked:
+                # Busy with other requests from the same identity
+                _count(self.scope, 'throttled')
+                return 1
+            now = time.time()
+            tokens, last = cache.get(key) or (self.capacity, now)
+            tokens = min(self.capacity, tokens + (now - last) * self.refill_per_second)
+            if tokens >= 1:
+                cache.set(key, (tokens - 1, now), self.timeout)
+                _count(self.scope, 'allowed')
+                return 0
+            cache.set(key, (tokens, now), self.timeout)
+        _count(self.scope, 'throttled')
+        return (1 - tokens) / self.refill_per_second
+
+
+@contextmanager
+def _locked(cache, key):
+    """
+    Hold the lock on `key`, yielding False if it can't be had within
+    LOCK_WAIT. cache.add() is atomic on every shared backend (Redis,
+    Memcached, the database cache), so only one request gets it.
+    """
+    lock = f'{key}:lock'
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(lock, 1, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            yield False
+            return
+        time.sleep(0.01)
+    try:
+        yield True
+    finally:
+        cache.delete(lock)
+
+
+# --- Who a request counts against ---
+def client_ip(request):
+    """
+    REMOTE_ADDR, or the last X-Forwarded-For hop when RATELIMIT_TRUST_PROXY is
+    set (the one our own proxy appended; earlier hops are client-supplied).
+    """
+    if getattr(settings, 'RATELIMIT_TRUST_PROXY', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def by_user(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def by_ip(request):
+    return f'ip:{client_ip(request)}'
+
+
+def by_email(request):
+    """
+    The address an OTP goes to: the one being submitted, else the pending
+    registration or email change, else the signed-in user's own.
+    """
+    registration = request.session.get('registration_data') or {}
+    email = (
+        request.POST.get('email') or request.POST.get('new_email')
+        or registration.get('email') or request.session.get('pending_email')
+    )
+    if not email and request.user.is_authenticated:
+        email = request.user.email
+    return f'email:{email.strip().lower()}' if email else None
+
+
+# --- View decorator ---
+def ratelimit(scope, rate, key=by_user, burst=None, methods=None):
+    """
+    Throttle a view with a token bucket per `key(request)` (None skips the
+    check). Only `methods` are counted when given. Throttled requests get a
+    429 with Retry-After. Stack several for per-user, per-IP and per-email
+    limits on one view.
+    """
+    bucket = TokenBucket(scope, rate, burst)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if methods is None or request.method in methods:
+                identity = key(request)
+                if identity is not None:
+                    retry_after = bucket.consume(identity)
+                    if retry_after:
+                        return _throttled(request, retry_after)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _throttled(request, retry_after):
+    seconds = max(1, round(retry_after))
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        response = JsonResponse({'error': 'Too many requests', 'retry_after': seconds}, status=429)
+    else:
+        response = render(request, 'ratelimited.html', {'retry_after': seconds}, status=429)
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+# --- Counters ---
+def _count(scope, outcome):
+    # Shared by every worker through the cache; on the database cache incr()
+    # isn't atomic, so simultaneous requests can go uncounted now and then
+    cache = _cache()
+    key = STATS_KEY.format(scope=scope, outcome=outcome)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, None)
+
+
+def stats():
+    """{scope: {'allowed': n, 'throttled': n}} since the cache was last cleared"""
+    outcomes = ('allowed', 'throttled')
+    keys = {
+        (scope, outcome): STATS_KEY.format(scope=scope, outcome=outcome)
+        for scope in SCOPES for outcome in outcomes
+    }
+    found = _cache().get_many(keys.values())
+    return {
+        scope: {outcome: found.get(keys[scope, outcome], 0) for outcome in outcomes}
+        for scope in sorted(SCOPES)
+    }
@@ -0,0 +1,97 @@
+# chatx/routers.py
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+REPLICA_ALIAS = 'replica'
+CACHE_ALIAS = 'cache'
+
+# After a request writes anything, that client reads from the primary for
+# this long, so it always sees its own changes despite replica lag.
+STICKY_SECONDS = 5
+STICKY_COOKIE = 'recent_write'
+
+_use_replica = ContextVar('use_replica', default=False)
+_request_writes = ContextVar('request_writes', default=None)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+class CacheRouter:
+    """
+    Keep the database cache tables (CACHES entries using DatabaseCache) in
+    the cache database and nothing else there. Listed first, so cache writes
+    never reach ReplicaRouter and never count as the client's writes.
+    """
+
+    def _is_cache(self, model):
+        return model._meta.app_label == 'django_cache'
+
+    def db_for_read(self, model, **hints):
+        return CACHE_ALIAS if self._is_cache(model) else None
+
+    def db_for_write(self, model, **hints):
+        return CACHE_ALIAS if self._is_cache(model) else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == CACHE_ALIAS or app_label == 'django_cache':
+            return db == CACHE_ALIAS and app_label == 'django_cache'
+        return None
+
+
+class ReplicaRouter:
+    """
+    Send chatx reads to the replica inside @read_from_replica views; everything
+    else, including all auth and session queries, stays on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and model._meta.app_label == 'chatx':
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        writes = _request_writes.get()
+        if writes is not None:
+            writes['seen'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary (see sync_replica), never migrated itself
+        if db == REPLICA_ALIAS:
+            return False
+        return None
+
+
+def read_from_replica(view):
+    """Run a read-only view against the replica, unless the client wrote just now"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not replica_configured() or STICKY_COOKIE in request.COOKIES:
+            return view(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+@contextmanager
+def tracking_writes():
+    """Yield a dict whose 'seen' turns True once anything is written to the primary"""
+    writes = {'seen': False}
+    token = _request_writes.set(writes)
+    try:
+        yield writes
+    finally:
+        _request_writes.reset(token)
@@ -0,0 +1,141 @@
+# chatx/search.py
+
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection, connections, router
+
+from .models import Post, Profile
+
+SEARCH_TABLE = 'chatx_search_index'  # Created by migration 0014_search_index
+
+SEARCH_PAGE_SIZE = 20
+USER_RESULTS_LIMIT = 10
+
+# Title (username) matches outrank body (post text / bio) matches.
+# bm25() takes one weight per column, including the UNINDEXED ones.
+RANK = f'bm25({SEARCH_TABLE}, 0, 0, 10.0, 1.0)'
+
+# kind and object_id are UNINDEXED, so filtering on them scans the whole table.
+# Each row's rowid is derived from them instead: object_id * len(KINDS) + offset.
+KINDS = {'post': 0, 'user': 1}
+
+
+def fts_enabled():
+    """The FTS5 index only exists on the SQLite backend"""
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query where every word is a quoted prefix term"""
+    terms = re.findall(r'\w+', query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def row_id(kind, object_id):
+    return object_id * len(KINDS) + KINDS[kind]
+
+
+def _replace(kind, object_id, title, body):
+    """Write one object's row, skipping the FTS rewrite when its text is unchanged"""
+    rowid = row_id(kind, object_id)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT title, body FROM {SEARCH_TABLE} WHERE rowid = %s', [rowid])
+        if cursor.fetchone() == (title, body):
+            return
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [rowid])
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, kind, object_id, title, body) VALUES (%s, %s, %s, %s, %s)',
+            [rowid, kind, object_id, title, body],
+        )
+
+
+def _remove(kind, object_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [row_id(kind, object_id)])
+
+
+def index_post(post):
+    if fts_enabled():
+        _replace('post', post.pk, '', post.text)
+
+
+def remove_post(post_id):
+    if fts_enabled():
+        _remove('post', post_id)
+
+
+def index_profile(profile):
+    if fts_enabled():
+        user = profile.user
+        _replace('user', user.pk, user.username, profile.bio)
+
+
+def remove_user(user_id):
+    if fts_enabled():
+        _remove('user', user_id)
+
+
+def rebuild_index():
+    """Recreate the whole index from Post, User and Profile; returns the rows written"""
+    if not fts_enabled():
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        insert = (
+            f'INSERT INTO {SEARCH_TABLE} (rowid, kind, object_id, title, body) VALUES (%s, %s, %s, %s, %s)'
+        )
+
+        posts = Post.objects.values_list('pk', 'text').iterator()
+        cursor.executemany(insert, [(row_id('post', pk), 'post', pk, '', text) for pk, text in posts])
+        profiles = Profile.objects.values_list('user_id', 'user__username', 'bio').iterator()
+        cursor.executemany(insert, [
+            (row_id('user', pk), 'user', pk, username, bio) for pk, username, bio in profiles
+        ])
+
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def ranked_ids(kind, query, limit, offset=0):
+    expression = match_expression(query)
+    if not expression:
+        return []
+    # Read from wherever the rows will be fetched from, replica included
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute(
+            f'SELECT object_id FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s AND kind = %s '
+            f'ORDER BY {RANK} LIMIT %s OFFSET %s',
+            [expression, kind, limit, offset],
+        )
+        return [int(row[0]) for row in cursor.fetchall()]
+
+
+def _in_order(queryset, ids):
+    by_id = queryset.in_bulk(ids)
+    return [by_id[pk] for pk in ids if pk in by_id]
+
+
+def search_users(query, limit=USER_RESULTS_LIMIT):
+    """Best matching users by username (then bio), prefix-matched"""
+    users = User.objects.select_related('profile')
+    if not fts_enabled():
+        return list(users.filter(username__icontains=query)[:limit])
+    return _in_order(users, ranked_ids('user', query, limit))
+
+
+def search_posts(query, page=1, posts=None, page_size=SEARCH_PAGE_SIZE):
+    """Return (posts, has_next) for one page of ranked post matches"""
+    if posts is None:
+        posts = Post.objects.all()
+    offset = (page - 1) * page_size
+
+    if not fts_enabled():
+        found = list(posts.filter(text__icontains=query)[offset:offset + page_size + 1])
+        return found[:page_size], len(found) > page_size
+
+    ids = ranked_ids('post', query, page_size + 1, offset)
+    return _in_order(posts, ids[:page_size]), len(ids) > page_size
@@ -0,0 +1,143 @@
+# chatx/serving.py
+
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .storage import BLOB_DIR
+
+READ_BLOCK = 64 * 1024
+
+# Blobs are named after their content, so a URL never changes what it serves
+IMMUTABLE_PREFIXES = (f'{BLOB_DIR}/',)
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# Other media (renditions, posters) can be replaced under the same name
+# after a delete; caches keep it a day, then revalidate with the ETag
+MUTABLE_CACHE = 'public, max-age=86400'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    The (start, end) bytes, end inclusive, asked for by a Range header.
+    None means send the whole file: no header, one we don't understand, or
+    several ranges (allowed, and simpler than a multipart reply). Raises
+    ValueError when the range lies entirely past the end of the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-500: the last 500 bytes
+        length = int(last)
+        if not length or not size:
+            raise ValueError('Empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start > end:
+        if last and int(last) < start:
+            return None  # Malformed, not unsatisfiable
+        raise ValueError('Range starts past the end of the file')
+    return start, end
+
+
+def _range_applies(request, etag, last_modified):
+    """If-Range: only resume from a range when the file hasn't changed since"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _read_span(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(READ_BLOCK, length))
+            if not block:
+                return
+            length -= len(block)
+            yield block
+
+
+def _sendfile(path, name):
+    """Headers handing the transfer (ranges included) to nginx or Apache, or None to stream it ourselves"""
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if mode == 'x-accel-redirect':
+        return {'X-Accel-Redirect': settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + quote(name)}
+    if mode == 'x-sendfile':
+        return {'X-Sendfile': path}
+    return None
+
+
+def serve(request, name, download_as=None, cache_control=None):
+    """
+    Answer a GET or HEAD for the stored media file `name`: conditional
+    requests (ETag, Last-Modified), single byte ranges so video can seek,
+    and cache headers. `download_as` makes it an attachment with that name.
+    """
+    try:
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, NotImplementedError, OSError):
+        raise Http404('No such file')
+    if not os.path.isfile(path):
+        raise Http404('No such file')
+
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+    if cache_control is None:
+        cache_control = IMMUTABLE_CACHE if name.startswith(IMMUTABLE_PREFIXES) else MUTABLE_CACHE
+
+    def headers(response):
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(last_modified)
+        response.headers['Cache-Control'] = cache_control
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return headers(not_modified)
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    disposition = content_disposition_header(bool(download_as), download_as or os.path.basename(name))
+
+    handoff = _sendfile(path, name)
+    if handoff:
+        response = HttpResponse(content_type=content_type, headers=handoff)
+        response.headers['Content-Disposition'] = disposition
+        return headers(response)
+
+    try:
+        span = parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}'})
+        return headers(response)
+    if span is not None and not _range_applies(request, etag, last_modified):
+        span = None
+
+    start, end = span or (0, size - 1)
+    length = end - start + 1 if size else 0
+    response = StreamingHttpResponse(
+        _read_span(path, start, length), status=206 if span else 200, content_type=content_type,
+    )
+    response.headers['Content-Length'] = str(length)
+    if span:
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response.headers['Content-Disposition'] = disposition
+    return headers(response)
@@ -1,9 +1,16 @@
 # chatx/signals.py
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Profile
+from django.db import transaction
+from .models import Post, Profile, Comment
+from . import search
+from .versions import bump_author_posts, bump_post, bump_user
+from .lookups import forget_user, writable_profile
+from .autocomplete import username_index
+from .images import delete_renditions
+from .storage import acquire, release
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -17,5 +24,155 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     """
     This signal ensures that the Profile is saved whenever the User is saved.
+    Partial saves that leave the username alone (login's last_login) skip it.
     """
-    instance.profile.save()
\ No newline at end of file
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    profile = instance.profile
+    if getattr(profile, '_from_lookup_cache', False):
+        profile = writable_profile(instance)
+    profile.save()
+
+
+# --- Full-text search index ---
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'text' not in update_fields:
+        return
+    search.index_post(instance)
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, update_fields=None, **kwargs):
+    """
+    User saves that touch the username also save the profile (save_user_profile
+    above), so this covers username changes as well as bio edits.
+    """
+    if update_fields is not None and 'bio' not in update_fields:
+        return
+    search.index_profile(instance)
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    search.remove_user(instance.pk)
+
+
+# --- Username autocomplete index ---
+@receiver(post_init, sender=User)
+def remember_username(sender, instance, **kwargs):
+    instance._stored_username = instance.__dict__.get('username')
+
+@receiver(post_save, sender=User)
+def autocomplete_user_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Only new users and renames reach the index; every publish reloads the other workers"""
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    # Users unpickled from the lookup cache may predate remember_username
+    if not created and instance.username == getattr(instance, '_stored_username', None):
+        return
+    instance._stored_username = instance.username
+    username_index.user_saved(instance)
+
+@receiver(post_delete, sender=User)
+def autocomplete_user_deleted(sender, instance, **kwargs):
+    username_index.user_deleted(instance.pk)
+
+
+# --- Post card fragment cache (see chatx/versions.py) ---
+@receiver(post_save, sender=Post)
+def post_card_changed(sender, instance, **kwargs):
+    bump_post(instance.pk)
+    bump_author_posts(instance.author_id)
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def post_card_comments_changed(sender, instance, **kwargs):
+    bump_post(instance.post_id)
+
+@receiver(post_save, sender=Profile)
+def author_cards_changed(sender, instance, **kwargs):
+    """Avatar, username and privacy all show on the author's cards"""
+    bump_user(instance.user_id)
+
+
+# --- Cached user/profile lookups (see chatx/lookups.py) ---
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk, instance.username)
+
+@receiver(post_save, sender=Profile)
+def forget_cached_profile(sender, instance, **kwargs):
+    forget_user(instance.user_id)
+
+
+# --- Image renditions (see chatx/images.py) ---
+@receiver(post_delete, sender=Post)
+def delete_post_renditions(sender, instance, **kwargs):
+    """django_cleanup removes post.image itself; the renditions aren't file fields"""
+    renditions = instance.image_renditions
+    transaction.on_commit(lambda: delete_renditions(renditions))
+
+
+# --- Deduplicated media references (see chatx/storage.py) ---
+DEDUP_FIELDS = {Post: ('image', 'video'), Profile: ('image',)}
+
+
+def _stored_name(instance, field):
+    value = instance.__dict__.get(field)
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Post)
+@receiver(post_init, sender=Profile)
+def remember_media_names(sender, instance, **kwargs):
+    """What the row points at now; deferred fields are looked up in pre_save if needed"""
+    instance._stored_media = {
+        field: _stored_name(instance, field) for field in DEDUP_FIELDS[sender] if field in instance.__dict__
+    }
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Profile)
+def fetch_deferred_media_names(sender, instance, update_fields=None, **kwargs):
+    # Instances unpickled from the cache may predate remember_media_names
+    stored = instance.__dict__.setdefault('_stored_media', {})
+    missing = [
+        field for field in DEDUP_FIELDS[sender]
+        if field not in stored and (update_fields is None or field in update_fields)
+    ]
+    if missing and instance.pk:
+        row = sender.objects.filter(pk=instance.pk).values(*missing).first() or {}
+        stored.update({field: row.get(field) or '' for field in missing})
+    # Uploads about to be stored, which take their reference as they are
+    instance._uploading_media = {
+        field for field in DEDUP_FIELDS[sender]
+        if field in instance.__dict__ and (update_fields is None or field in update_fields)
+        and not getattr(instance, field)._committed
+    }
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def settle_media_references(sender, instance, update_fields=None, **kwargs):
+    """
+    Uploads took their reference when stored; the same bytes uploaded over
+    themselves keep the same name, so that extra one goes back. A field set
+    to an already stored name takes its reference here. django_cleanup gives
+    the old file's reference back once this commits.
+    """
+    uploaded = instance.__dict__.pop('_uploading_media', set())
+    for field in DEDUP_FIELDS[sender]:
+        if update_fields is not None and field not in update_fields:
+            continue
+        name = _stored_name(instance, field)
+        changed = name != instance._stored_media.get(field)
+        if field in uploaded and not changed:
+            release(name)
+        elif field not in uploaded and changed:
+            acquire(name)
+        instance._stored_media[field] = name
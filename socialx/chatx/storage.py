@@ -0,0 +1,122 @@
+# chatx/storage.py
+
+import hashlib
+import os
+import uuid
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+BLOB_DIR = 'blobs'
+
+
+def content_sha256(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_name(sha256, filename):
+    """blobs/ab/ab12...ef.jpg: the extension is kept so URLs still say what the file is"""
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{BLOB_DIR}/{sha256[:2]}/{sha256}{extension}'
+
+
+class DedupStorage(FileSystemStorage):
+    """
+    Content-addressed storage for uploaded media. Files are stored once per
+    SHA-256 under blobs/, whatever field or name they arrive under, and a
+    MediaBlob row counts the fields pointing at each one. Saving the same
+    bytes again returns the existing name; delete() drops one reference and
+    only removes the file along with the last.
+
+    Saving takes the new field's reference in the same locked transaction
+    that finds the blob, so a concurrent delete() can't remove the file in
+    between; Post and Profile save their rows in that transaction too (see
+    MediaReferencesMixin). django_cleanup gives references back by calling
+    delete() whenever a field stops pointing at a file (replaced, cleared or
+    its row deleted). Code that replaces media should therefore just assign
+    the new file, never delete the old one itself.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save() picks the real name from the content, and equal names are the point
+        return name
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        sha256 = content_sha256(content)
+        with transaction.atomic():
+            # The lock keeps a concurrent delete() of the same blob from removing the file under us
+            blob, created = MediaBlob.objects.select_for_update().get_or_create(
+                sha256=sha256, defaults={'name': blob_name(sha256, name), 'size': content.size, 'refcount': 1}
+            )
+            if not created:
+                MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+            if created or not self.exists(blob.name):
+                self._write(blob.name, content)
+        return blob.name
+
+    def _write(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+        else:
+            # Written aside and renamed into place, so a blob is never seen half-written
+            partial = f'{full_path}.{uuid.uuid4().hex}.part'
+            with open(partial, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.replace(partial, full_path)
+
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+
+    def delete(self, name):
+        """Give back one reference to the file; it goes when the last one does"""
+        from .models import MediaBlob
+
+        if not name:
+            raise ValueError('The name must be given to delete().')
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.refcount > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            # No row at all: a file stored before deduplication, which nothing else shares
+            super().delete(name)
+
+
+def acquire(name):
+    """Count one more field pointing at the blob `name` without storing anything (a no-op for older, unshared files)"""
+    from .models import MediaBlob
+
+    if name:
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def release(name):
+    """Give back a reference taken by a save that left the field where it was"""
+    from .models import MediaBlob
+
+    if name:
+        MediaBlob.objects.filter(name=name, refcount__gt=1).update(refcount=F('refcount') - 1)
+
+
+media_storage = DedupStorage()
@@ -0,0 +1,81 @@
+# chatx/templatetags/post_media.py
+
+import os
+
+from django import template
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+register = template.Library()
+
+# A feed card is at most ~600px wide and full width on phones
+FEED_SIZES = '(max-width: 640px) 100vw, 600px'
+
+# Anything else (.mp4, .mov, .m4v) is announced as MP4, which is what
+# browsers need to hear to play H.264 in a QuickTime wrapper
+VIDEO_TYPES = {'.webm': 'video/webm', '.ogv': 'video/ogg'}
+
+
+def _srcset(renditions, extension):
+    return ', '.join(
+        f"{default_storage.url(entry[extension])} {entry['width']}w" for entry in renditions
+    )
+
+
+@register.simple_tag
+def post_image(post, sizes=FEED_SIZES, rendition='feed', **attrs):
+    """
+    Markup for post.image: a <picture> with a WebP srcset and a JPEG <img>
+    fallback, so the browser fetches the smallest rendition that fills
+    `sizes`. Width and height are set so the card keeps its shape while the
+    image loads, and it loads lazily unless told otherwise. Other keywords
+    become <img> attributes, e.g.
+    {% post_image post class="img-fluid rounded" alt="Post image" %}
+    """
+    if not post.image:
+        return ''
+    attrs = {'loading': 'lazy', 'decoding': 'async', **attrs}
+
+    renditions = sorted((post.image_renditions or {}).values(), key=lambda entry: entry['width'])
+    if not renditions:
+        # Not processed (animated, or uploaded before renditions existed)
+        attrs.update(src=post.image.url, width=post.media_width, height=post.media_height)
+        return format_html('<img{}>', flatatt(attrs))
+
+    default = post.image_renditions.get(rendition) or renditions[-1]
+    attrs.update(
+        src=default_storage.url(default['jpeg']),
+        srcset=_srcset(renditions, 'jpeg'),
+        sizes=sizes,
+        width=default['width'],
+        height=default['height'],
+    )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}"><img{}></picture>',
+        _srcset(renditions, 'webp'), sizes, flatatt(attrs),
+    )
+
+
+@register.simple_tag
+def post_video(post, **attrs):
+    """
+    Markup for post.video that downloads nothing until it is played:
+    preload="none", the poster frame when there is one, and width/height
+    from the stored dimensions so the card keeps its shape. Other keywords
+    become <video> attributes; controls=False drops the controls.
+    """
+    if not post.video:
+        return ''
+    attrs = {'controls': True, 'preload': 'none', 'playsinline': True, **attrs}
+    if post.video_poster:
+        attrs.setdefault('poster', post.video_poster.url)
+    if post.media_width and post.media_height:
+        attrs.setdefault('width', post.media_width)
+        attrs.setdefault('height', post.media_height)
+
+    extension = os.path.splitext(post.video.name)[1].lower()
+    return format_html(
+        '<video{}><source src="{}" type="{}"><p>Your browser doesn\'t support HTML5 video.</p></video>',
+        flatatt(attrs), post.video.url, VIDEO_TYPES.get(extension, 'video/mp4'),
+    )
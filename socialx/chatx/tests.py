@@ -1,3 +1,1427 @@
-from django.test import TestCase
+import hashlib
+import io
+import re
+import shutil
+import struct
+import tempfile
+import time
+import warnings
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, OperationalError, connection, connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+from .models import (
+    Post, Comment, Notification, TimelineEntry, OutboxEmail, MediaJob, ChunkedUpload,
+    MediaBlob, Profile,
+)
+from .notifications import (
+    AGGREGATION_WINDOW, NOTIFICATIONS_PAGE_SIZE, READ_RETENTION, notify, unread_count,
+)
+from .pagination import FEED_PAGE_SIZE, keyset_page
+from .outbox import SENT_RETENTION, deliver_batch, metrics, purge_finished
+from .autocomplete import AUTOCOMPLETE_LIMIT, VERSION_CACHE_KEY, UsernameIndex
+from .extractors import Mp4HeaderExtractor
+from .lookups import attach_profile, get_user_or_404
+from .media import process_batch
+from .search import fts_enabled, search_posts, search_users
+from .storage import blob_name
+from .routers import STICKY_COOKIE, STICKY_SECONDS, ReplicaRouter, read_from_replica
+from .ratelimit import TokenBucket, stats as ratelimit_stats
+from . import otp as otp_store
+from . import uploads
+from .interactions import set_follow, set_like
+from .timeline import fan_out_post
+from .versions import attach_card_versions
+from .utils import send_verification_email
+
+
+class ChatxTestCase(TestCase):
+    # Database cache entries are kept in their own database (see chatx.routers.CacheRouter);
+    # query counts below are taken on the default connection, so they leave them out
+    databases = {'default', 'cache'}
+
+
+class TempMediaRootMixin:
+    """Each test gets an empty MEDIA_ROOT of its own, removed afterwards"""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir_setting('MEDIA_ROOT')
+
+    def temp_dir_setting(self, setting):
+        """Point a directory setting at a fresh temporary directory for this test"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        override = override_settings(**{setting: directory})
+        override.enable()
+        self.addCleanup(override.disable)
+        return directory
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class QueryBudgetTests(ChatxTestCase):
+    """Each page must render in a fixed number of queries, however many posts it shows"""
+
+    # Includes the session and request.user lookups done by the middleware,
+    # measured with the navbar's unread count and the user/profile lookups
+    # already cached (count_queries loads each page once first). post_list,
+    # post_detail and profile also run their ETag validator query first.
+    BUDGETS = {
+        'post_list': 7,
+        'post_list_page': 6,
+        'post_detail': 6,
+        'profile': 10,
+        'saved_posts': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'pass')
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.viewer.profile.follows.add(cls.author.profile)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.viewer)
+        self.client.get(reverse('about'))
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(author=self.author, text=f'Post {i}')
+            fan_out_post(post)
+            post.likes.add(self.viewer)
+            post.saves.add(self.viewer)
+            for j in range(4):
+                Comment.objects.create(post=post, author=self.viewer, text=f'Comment {j}')
+
+    def urls(self):
+        post = Post.objects.first()
+        return {
+            'post_list': reverse('post_list'),
+            'post_list_page': reverse('post_list_page'),
+            'post_detail': reverse('post_detail', args=[post.pk]),
+            'profile': reverse('profile', args=[self.author.username]),
+            'saved_posts': reverse('saved_posts'),
+        }
+
+    def count_queries(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_views_stay_within_budget(self):
+        self.create_posts(10)
+        for name, url in self.urls().items():
+            with self.subTest(view=name):
+                self.assertLessEqual(self.count_queries(url), self.BUDGETS[name])
+
+    def test_query_count_does_not_grow_with_posts(self):
+        self.create_posts(2)
+        small = {name: self.count_queries(url) for name, url in self.urls().items()}
+        self.create_posts(8)
+        for name, url in self.urls().items():
+            with self.subTest(view=name):
+                self.assertEqual(self.count_queries(url), small[name])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ConditionalGetTests(ChatxTestCase):
+    """Unchanged pages are answered with 304 after just the validator query"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'pass')
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.viewer.profile.follows.add(cls.author.profile)
+        cls.post = Post.objects.create(author=cls.author, text='Hello')
+        fan_out_post(cls.post)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.viewer)
+        self.client.get(reverse('about'))
+        self.urls = [
+            reverse('post_list'),
+            reverse('post_detail', args=[self.post.pk]),
+            reverse('profile', args=[self.author.username]),
+        ]
+
+    def test_unchanged_page_is_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertLessEqual(len(queries), 4)
+
+    def test_changes_invalidate_the_etag(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        self.post.likes.add(self.author)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=1)
+        Comment.objects.create(post=self.post, author=self.author, text='First')
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_profile_etag_sees_new_and_edited_posts(self):
+        url = reverse('profile', args=[self.author.username])
+
+        def changes(change):
+            etag = self.client.get(url)['ETag']
+            change()
+            return self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+        def edit():
+            self.post.text = 'Hello, edited'
+            self.post.save()
+
+        self.assertTrue(changes(edit))
+        self.assertTrue(changes(lambda: Post.objects.create(author=self.author, text='Another')))
+        self.assertTrue(changes(lambda: Post.objects.filter(text='Another').delete()))
+        self.assertFalse(changes(lambda: None))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Reads SQLite EXPLAIN QUERY PLAN output')
+class QueryPlanTests(ChatxTestCase):
+    """Every hot query must be answered from its index, never a full table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('planner', 'planner@example.com', 'pass')
+        cls.post = Post.objects.create(author=cls.user, text='Plan')
+
+    def hot_queries(self):
+        """(name, queryset, index it should use)"""
+        user, post = self.user, self.post
+        recent = timezone.now() - READ_RETENTION
+        return [
+            ('feed page', TimelineEntry.objects.filter(user=user).order_by('-created_at', '-post_id')[:11],
+             'timeline_user_created_idx'),
+            ('profile posts', Post.objects.filter(author=user).order_by('-created_at', '-id'),
+             'post_author_created_idx'),
+            ('recent comments', Comment.objects.filter(post__in=[post.pk]).order_by('created_at', 'id'),
+             'comment_post_created_idx'),
+            ('inbox page', Notification.objects.filter(recipient=user)
+             .filter(Q(is_read=False) | Q(is_read=True, updated_at__gte=recent))
+             .order_by('-updated_at', '-id')[:21],
+             'notif_recipient_updated_idx'),
+        ]
+
+    def test_hot_queries_use_their_index(self):
+        for name, queryset, index in self.hot_queries():
+            with self.subTest(query=name):
+                plan = queryset.explain()
+                # "SCAN <table>" with no "USING ... INDEX" reads every row
+                self.assertIsNone(re.search(r'\bSCAN \w+$', plan, re.MULTILINE), plan)
+                self.assertIn(index, plan)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', OUTBOX_SEND_IMMEDIATELY=False)
+class OutboxTests(ChatxTestCase):
+    """OTP mails are queued by the request and sent later by the worker"""
+
+    def test_queued_then_delivered(self):
+        self.assertTrue(send_verification_email(None, 'new@example.com'))
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(deliver_batch()['sent'], 1)
+        otp = otp_store.pending('new@example.com').otp
+        self.assertEqual(mail.outbox[0].to, ['new@example.com'])
+        self.assertIn(otp, mail.outbox[0].body)
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_failed_send_is_retried_later(self):
+        send_verification_email(None, 'new@example.com')
+        with mock.patch('django.core.mail.EmailMultiAlternatives.send', side_effect=OSError('down')):
+            self.assertEqual(deliver_batch()['retried'], 1)
+
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # Not due yet, so the next run leaves it alone
+        self.assertEqual(deliver_batch()['retried'], 0)
+
+    def test_sending_in_the_request_sends_only_its_own_email(self):
+        send_verification_email(None, 'earlier@example.com')
+        with override_settings(OUTBOX_SEND_IMMEDIATELY=True), self.captureOnCommitCallbacks(execute=True):
+            send_verification_email(None, 'new@example.com')
+        self.assertEqual([m.to for m in mail.outbox], [['new@example.com']])
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.PENDING).count(), 1)
+
+    def test_finished_mail_is_purged(self):
+        send_verification_email(None, 'old@example.com')
+        send_verification_email(None, 'new@example.com')
+        deliver_batch()
+        OutboxEmail.objects.filter(to='old@example.com').update(sent_at=timezone.now() - SENT_RETENTION * 2)
+        send_verification_email(None, 'queued@example.com')
+
+        self.assertEqual(purge_finished(), 1)
+        self.assertEqual(
+            sorted(OutboxEmail.objects.values_list('to', flat=True)), ['new@example.com', 'queued@example.com']
+        )
+
+    def test_metrics_come_from_the_rows(self):
+        send_verification_email(None, 'one@example.com')
+        send_verification_email(None, 'two@example.com')
+        deliver_batch(limit=1)
+
+        stats = metrics()
+        self.assertEqual((stats['pending'], stats['sent_recently'], stats['failed_total']), (1, 1, 0))
+        self.assertGreaterEqual(stats['avg_delivery_seconds'], 0)
+        out = io.StringIO()
+        call_command('send_outbox', '--stats', stdout=out)
+        self.assertRegex(out.getvalue(), r'sent_total\s+1\b')
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, OUTBOX_SEND_IMMEDIATELY=False)
+class RateLimitTests(ChatxTestCase):
+    """Token buckets shed excess requests with 429 + Retry-After"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bucket_refuses_once_empty(self):
+        bucket = TokenBucket('test', '2/m')
+        self.assertEqual(bucket.consume('someone'), 0)
+        self.assertEqual(bucket.consume('someone'), 0)
+        self.assertGreater(bucket.consume('someone'), 0)
+        # Buckets are per identity
+        self.assertEqual(bucket.consume('someone else'), 0)
+
+    def test_identities_make_valid_cache_keys(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.assertEqual(TokenBucket('test', '2/m').consume('email:Someone Else@example.com'), 0)
+
+    def test_a_bucket_in_use_is_not_spent_twice(self):
+        bucket = TokenBucket('test', '5/m')
+        # As if a request from the same identity were halfway through consume()
+        lock = f'ratelimit:test:{hashlib.sha256(b"someone").hexdigest()}:lock'
+        cache.add(lock, 1)
+        with mock.patch('chatx.ratelimit.LOCK_WAIT', 0):
+            self.assertGreater(bucket.consume('someone'), 0)
+        cache.delete(lock)
+        self.assertEqual(bucket.consume('someone'), 0)
+
+    def test_otp_resends_are_throttled_per_email(self):
+        session = self.client.session
+        session['registration_data'] = {'username': 'newbie', 'email': 'new@example.com', 'password': 'x'}
+        session.save()
+
+        url = reverse('resend_registration_otp')
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).status_code, 302)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+        self.assertEqual(ratelimit_stats()['otp_send_email'], {'allowed': 3, 'throttled': 1})
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ImageRenditionTests(TempMediaRootMixin, ChatxTestCase):
+    """Uploaded images are stored upright without EXIF, with resized renditions"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def upload(self, size):
+        exif = Image.Exif()
+        exif[0x0112] = 6      # Orientation: rotate 90 degrees to display
+        exif[0x8827] = 100    # ISO speed, standing in for camera/GPS details
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', exif=exif.tobytes())
+        media = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+        self.client.post(reverse('post_create'), {'text': 'photo', 'media': media})
+        return Post.objects.get(author=self.user)
+
+    def test_upload_is_rotated_stripped_and_resized(self):
+        post = self.upload((1800, 1200))
+
+        self.assertEqual((post.media_width, post.media_height), (1200, 1800))
+        self.assertEqual(dict(Image.open(post.image.path).getexif()), {})
+        self.assertEqual(
+            {name: (entry['width'], entry['height']) for name, entry in post.image_renditions.items()},
+            {'thumb': (320, 480), 'feed': (640, 960), 'full': (1200, 1800)},
+        )
+
+        html = self.client.get(reverse('post_list')).content.decode()
+        self.assertIn('<source type="image/webp" srcset="/media/post_images/renditions/photo_thumb', html)
+        self.assertIn('width="640"', html)
+        self.assertIn('height="960"', html)
+
+    def test_small_images_are_not_upscaled(self):
+        post = self.upload((200, 100))
+        self.assertEqual(list(post.image_renditions), ['thumb'])
+        self.assertEqual(post.image_renditions['thumb']['width'], 100)
+
+    def test_unreadable_image_is_rejected(self):
+        media = SimpleUploadedFile('photo.jpg', b'not an image', content_type='image/jpeg')
+        response = self.client.post(reverse('post_create'), {'text': 'photo', 'media': media})
+        self.assertContains(response, 'could not be read')
+        self.assertFalse(Post.objects.exists())
+
+    def test_oversized_images_are_rejected_before_decoding(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (50, 50), 'red').save(buffer, 'JPEG')
+
+        def post():
+            media = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+            return self.client.post(reverse('post_create'), {'text': 'photo', 'media': media})
+
+        with mock.patch.object(Image.Image, 'load') as load:
+            with mock.patch('chatx.images.MAX_IMAGE_PIXELS', 1000):
+                self.assertContains(post(), 'too large')
+            with mock.patch('chatx.images.MAX_IMAGE_SIZE', 100):
+                self.assertContains(post(), 'too large')
+        load.assert_not_called()
+        self.assertFalse(Post.objects.exists())
+
+
+def mp4_box(kind, *payload):
+    body = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def tiny_mp4(width, height, seconds, rotated=False):
+    """Just the boxes chatx.mp4 reads: a movie header and one H.264 video track"""
+    mvhd = mp4_box(b'mvhd', bytes(4), bytes(8), struct.pack('>II', 1000, seconds * 1000), bytes(80))
+    a, b = (0, 0x10000) if rotated else (0x10000, 0)
+    matrix = struct.pack('>9i', a, b, 0, -b, a, 0, 0, 0, 0x40000000)
+    tkhd = mp4_box(b'tkhd', bytes(4), bytes(20), bytes(16), matrix, struct.pack('>II', width << 16, height << 16))
+    hdlr = mp4_box(b'hdlr', bytes(8), b'vide', bytes(13))
+    stsd = mp4_box(b'stsd', bytes(4), struct.pack('>I', 1), mp4_box(b'avc1', bytes(78)))
+    minf = mp4_box(b'minf', mp4_box(b'stbl', stsd))
+    moov = mp4_box(b'moov', mvhd, mp4_box(b'trak', tkhd, mp4_box(b'mdia', hdlr, minf)))
+    return mp4_box(b'ftyp', b'isom', bytes(4)) + mp4_box(b'mdat', bytes(64)) + moov
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MediaDetailsTests(TempMediaRootMixin, ChatxTestCase):
+    """Video details and posters come from a background job; pages never preload video"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def upload(self, data, url=None):
+        media = SimpleUploadedFile('clip.mp4', data, content_type='video/mp4')
+        self.client.post(url or reverse('post_create'), {'text': 'clip', 'media': media})
+        return Post.objects.get(author=self.user)
+
+    def process(self, extractor=None):
+        stats = process_batch(extractor=extractor or Mp4HeaderExtractor())
+        return stats, Post.objects.get(author=self.user)
+
+    def test_video_details_are_read_from_its_headers(self):
+        data = tiny_mp4(1920, 1080, 12, rotated=True)
+        post = self.upload(data)
+        self.assertEqual(post.media_bytes, len(data))
+        self.assertIsNone(post.media_duration)
+        self.assertEqual(post.media_job.status, MediaJob.PENDING)
+
+        stats, post = self.process()
+        self.assertEqual(stats['done'], 1)
+        self.assertEqual((post.media_width, post.media_height), (1080, 1920))
+        self.assertEqual(post.media_duration, 12.0)
+        self.assertEqual(post.video_codec, 'h264')
+        self.assertEqual(post.media_job.status, MediaJob.DONE)
+
+    def test_uploads_are_only_queued_by_default(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = self.upload(tiny_mp4(640, 360, 5))
+        self.assertEqual(post.media_job.status, MediaJob.PENDING)
+
+    def test_without_workers_a_request_probes_only_its_own_video(self):
+        earlier = self.upload(tiny_mp4(640, 360, 5))
+        with override_settings(MEDIA_PROCESS_IMMEDIATELY=True), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post_create'), {
+                'text': 'second', 'media': SimpleUploadedFile('two.mp4', tiny_mp4(320, 240, 2), content_type='video/mp4'),
+            })
+        latest = Post.objects.get(text='second')
+        self.assertEqual((latest.media_job.status, latest.media_duration), (MediaJob.DONE, 2.0))
+        self.assertEqual(MediaJob.objects.get(post=earlier).status, MediaJob.PENDING)
+
+    def test_poster_comes_from_the_extractor(self):
+        class FakeExtractor:
+            def probe(self, path):
+                return {'width': 640, 'height': 360, 'duration': 3.0, 'codec': 'vp9'}
+
+            def poster(self, path, seconds):
+                buffer = io.BytesIO()
+                Image.new('RGB', (64, 36), 'blue').save(buffer, 'JPEG')
+                return buffer.getvalue()
+
+        self.upload(b'any container')
+        _, post = self.process(FakeExtractor())
+        self.assertTrue(post.video_poster.name.startswith('post_posters/'))
+        self.assertIn(f'poster="{post.video_poster.url}"', self.client.get(reverse('post_list')).content.decode())
+
+    def test_failing_extractor_retries_then_gives_up(self):
+        class BrokenExtractor:
+            def probe(self, path):
+                raise OSError('unreadable')
+
+        self.upload(b'not really a video')
+        self.assertEqual(self.process(BrokenExtractor())[0]['retried'], 1)
+        MediaJob.objects.update(next_attempt_at=timezone.now())
+        self.process(BrokenExtractor())
+        MediaJob.objects.update(next_attempt_at=timezone.now())
+        stats, post = self.process(BrokenExtractor())
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(post.media_job.status, MediaJob.FAILED)
+        self.assertEqual(post.media_bytes, 18)
+
+    def test_replacing_the_video_starts_a_new_job(self):
+        post = self.upload(tiny_mp4(640, 360, 5))
+        self.process()
+        post = self.upload(tiny_mp4(1280, 720, 9), url=reverse('post_edit', args=[post.pk]))
+        self.assertIsNone(post.media_duration)
+        self.assertEqual(post.media_job.status, MediaJob.PENDING)
+        _, post = self.process()
+        self.assertEqual(post.media_duration, 9.0)
+
+    def test_feed_does_not_preload_media(self):
+        self.upload(tiny_mp4(640, 360, 5))
+        self.process()
+        html = self.client.get(reverse('post_list')).content.decode()
+        self.assertIn('preload="none"', html)
+        self.assertIn('width="640"', html)
+        self.assertIn('height="360"', html)
+        self.assertNotIn('preload="auto"', html)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ChunkedUploadTests(TempMediaRootMixin, ChatxTestCase):
+    """Media can arrive in checksummed pieces, resume, and then be attached to a post"""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir_setting('CHUNKED_UPLOAD_DIR')
+
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_login(self.user)
+        self.data = tiny_mp4(640, 360, 5)
+
+    def start(self, **extra):
+        response = self.client.post(reverse('upload_start'), {
+            'filename': 'clip.mp4', 'size': len(self.data), 'content_type': 'video/mp4', **extra,
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def send(self, upload, offset, chunk, checksum=None):
+        return self.client.patch(
+            upload['url'], chunk, content_type='application/octet-stream',
+            headers={
+                'Upload-Offset': str(offset),
+                'Upload-Checksum': checksum or hashlib.sha256(chunk).hexdigest(),
+            },
+        )
+
+    def test_upload_resumes_and_attaches_to_a_post(self):
+        upload = self.start(sha256=hashlib.sha256(self.data).hexdigest())
+        half = len(self.data) // 2
+
+        self.assertEqual(self.send(upload, 0, self.data[:half]).json()['offset'], half)
+        # A retry of a chunk that already landed is told where to carry on
+        response = self.send(upload, 0, self.data[:half])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, half))
+        # A damaged chunk is refused and the offset stays put
+        response = self.send(upload, half, self.data[half:], checksum='0' * 64)
+        self.assertEqual((response.status_code, response.json()['offset']), (400, half))
+        self.assertEqual(self.client.get(upload['url']).json()['offset'], half)
+
+        self.send(upload, half, self.data[half:])
+        self.assertTrue(self.client.post(upload['url'] + 'complete/').json()['complete'])
+
+        self.client.post(reverse('post_create'), {'text': 'clip', 'upload': upload['id']})
+        post = Post.objects.get(author=self.user)
+        with post.video.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(post.media_bytes, len(self.data))
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_incomplete_or_corrupt_uploads_cannot_be_used(self):
+        upload = self.start(sha256='0' * 64)
+        self.assertEqual(self.client.post(upload['url'] + 'complete/').status_code, 400)
+        self.send(upload, 0, self.data)
+        self.assertEqual(self.client.post(upload['url'] + 'complete/').status_code, 422)
+
+        self.client.post(reverse('post_create'), {'text': 'clip', 'upload': upload['id']})
+        self.assertFalse(Post.objects.get(author=self.user).video)
+
+    def test_rejected_upload_is_closed(self):
+        self.data = b'not really a png'
+        upload = self.start(filename='broken.png', content_type='image/png')
+        self.send(upload, 0, self.data)
+        self.client.post(upload['url'] + 'complete/')
+
+        opened = []
+
+        class RecordingUpload(uploads.SpooledUpload):
+            def __init__(self, *args):
+                super().__init__(*args)
+                opened.append(self)
+
+        with mock.patch.object(uploads, 'SpooledUpload', RecordingUpload):
+            response = self.client.post(reverse('post_create'), {'text': 'broken', 'upload': upload['id']})
+        self.assertContains(response, 'could not be read')
+        self.assertEqual([f.closed for f in opened], [True])
+
+    def test_uploads_belong_to_their_owner(self):
+        upload = self.start()
+        self.client.force_login(User.objects.create_user('bob', 'bob@example.com', 'pw'))
+        self.assertEqual(self.send(upload, 0, self.data).status_code, 404)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class DedupStorageTests(TempMediaRootMixin, ChatxTestCase):
+    """The same bytes are stored once and only removed with their last reference"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_login(self.user)
+        self.data = tiny_mp4(640, 360, 5)
+
+    def post_video(self, data, name='clip.mp4'):
+        media = SimpleUploadedFile(name, data, content_type='video/mp4')
+        self.client.post(reverse('post_create'), {'text': 'clip', 'media': media})
+        return Post.objects.latest('pk')
+
+    def test_duplicates_share_one_file_until_the_last_reference_goes(self):
+        first = self.post_video(self.data)
+        second = self.post_video(self.data, 'copy.mp4')
+        self.assertEqual(first.video.name, second.video.name)
+        blob = MediaBlob.objects.get()
+        self.assertEqual((blob.name, blob.refcount), (first.video.name, 2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post_delete', args=[first.pk]))
+        self.assertTrue(default_storage.exists(blob.name))
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+
+        # Uploading the same file again over itself changes nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post_edit', args=[second.pk]), {
+                'text': 'again', 'media': SimpleUploadedFile('clip.mp4', self.data, content_type='video/mp4'),
+            })
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post_edit', args=[second.pk]), {
+                'text': 'replaced', 'media': SimpleUploadedFile('new.mp4', tiny_mp4(320, 240, 2), content_type='video/mp4'),
+            })
+        self.assertFalse(default_storage.exists(blob.name))
+        self.assertEqual(list(MediaBlob.objects.values_list('refcount', flat=True)), [1])
+
+    def test_storing_takes_the_reference_and_a_failed_save_gives_it_back(self):
+        first = self.post_video(self.data)
+        counts_during_save = []
+
+        def fail_save(sender, **kwargs):
+            counts_during_save.append(dict(MediaBlob.objects.values_list('name', 'refcount')))
+            raise DatabaseError('save failed')
+
+        new_data = tiny_mp4(320, 240, 2)
+        post_save.connect(fail_save, sender=Post)
+        self.addCleanup(post_save.disconnect, fail_save, sender=Post)
+        for data in (self.data, new_data):
+            with self.assertRaises(DatabaseError):
+                Post.objects.create(author=self.user, text='x', video=SimpleUploadedFile('v.mp4', data))
+
+        # Each upload was counted as it was stored, and rolled back with the row
+        self.assertEqual(counts_during_save[0], {first.video.name: 2})
+        self.assertEqual(len(counts_during_save[1]), 2)
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'refcount')), {first.video.name: 1})
+
+        stray = blob_name(hashlib.sha256(new_data).hexdigest(), 'v.mp4')
+        self.assertTrue(default_storage.exists(stray))
+        with mock.patch('chatx.management.commands.dedupe_media.ORPHAN_GRACE', timedelta(seconds=-60)):
+            call_command('dedupe_media', stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(stray))
+        self.assertTrue(default_storage.exists(first.video.name))
+
+    def test_backfill_moves_existing_media_into_shared_blobs(self):
+        posts = []
+        for name in ('post_videos/a.mp4', 'post_videos/b.mp4'):
+            stored = default_storage.save(name, ContentFile(self.data))
+            posts.append(Post.objects.create(author=self.user, text='old', video=stored))
+        MediaBlob.objects.all().delete()  # As if stored before deduplication
+
+        call_command('dedupe_media', stdout=io.StringIO())
+
+        names = {post.video.name for post in Post.objects.filter(pk__in=[p.pk for p in posts])}
+        self.assertEqual(len(names), 1)
+        self.assertEqual(MediaBlob.objects.get().refcount, 2)
+        self.assertFalse(default_storage.exists('post_videos/a.mp4'))
+        self.assertFalse(default_storage.exists('post_videos/b.mp4'))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MediaServingTests(TempMediaRootMixin, ChatxTestCase):
+    """Media is served with byte ranges and validators, and downloads follow the privacy setting"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.data = tiny_mp4(640, 360, 5)
+        self.post = Post.objects.create(
+            author=self.user, text='clip', video=SimpleUploadedFile('clip.mp4', self.data, content_type='video/mp4'),
+        )
+        self.url = self.post.video.url
+
+    def test_ranges_and_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=-8'})
+        self.assertEqual(b''.join(response.streaming_content), self.data[-8:])
+        # A stale If-Range gets the whole (changed) file instead of a piece of it
+        response = self.client.get(self.url, headers={'Range': 'bytes=0-9', 'If-Range': '"old"'})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get(self.url, headers={'Range': f'bytes={len(self.data)}-'}).status_code, 416)
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': response['ETag']}).status_code, 304)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_hands_off_to_the_web_server(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.post.video.name)
+        self.assertEqual(response.content, b'')
+
+    def test_downloads_of_private_media_are_for_the_author_only(self):
+        url = reverse('post_media_download', args=[self.post.pk])
+        self.user.profile.is_private = True
+        self.user.profile.save()
+
+        self.client.force_login(User.objects.create_user('bob', 'bob@example.com', 'pw'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="socialx-{self.post.pk}.mp4"')
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ProfileLookupCacheTests(ChatxTestCase):
+    """The viewer's cached profile is only read; saves go through a fresh copy"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def edit_elsewhere(self):
+        # Like another worker's write: the row changes, this worker's cache doesn't hear of it
+        Profile.objects.filter(user=self.user).update(bio='Written elsewhere', is_private=True)
+
+    def assert_edit_kept(self):
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual((profile.bio, profile.is_private), ('Written elsewhere', True))
+        return profile
+
+    def test_username_lookups_are_cached_and_follow_changes(self):
+        get_user_or_404('alice')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_or_404('alice').profile.bio, '')
+
+        self.user.profile.bio = 'Hello'
+        self.user.profile.save()
+        self.assertEqual(get_user_or_404('alice').profile.bio, 'Hello')
+
+        self.user.username = 'alicia'
+        self.user.save()
+        self.assertEqual(get_user_or_404('alicia').pk, self.user.pk)
+        with self.assertRaises(Http404):
+            get_user_or_404('alice')
+
+        bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        get_user_or_404('bob')
+        with self.captureOnCommitCallbacks(execute=True):
+            set_follow(self.user.profile, bob.profile, True)
+            # Dropped only after the commit, so nothing re-caches the old count in between
+            self.assertEqual(get_user_or_404('bob').profile.followers_count, 0)
+        self.assertEqual(get_user_or_404('bob').profile.followers_count, 1)
+
+    def test_verifying_email_keeps_newer_profile_edits(self):
+        self.client.get(reverse('settings'))  # Caches the viewer's profile
+        self.edit_elsewhere()
+
+        session = self.client.session
+        session['verifying_current_email'] = True
+        session.save()
+        otp = otp_store.issue(self.user.email, self.user)
+        self.client.post(reverse('verify_current_email_otp'), {'otp': otp})
+
+        self.assertTrue(self.assert_edit_kept().email_verified)
+
+    def test_saving_the_user_keeps_newer_profile_edits(self):
+        user = attach_profile(User.objects.get(pk=self.user.pk))  # Puts it in the cache
+        user = attach_profile(User.objects.get(pk=self.user.pk))  # Served from the cache
+        self.edit_elsewhere()
+
+        user.first_name = 'Alice'
+        user.save()
+        self.assert_edit_kept()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CounterTests(ChatxTestCase):
+    """Stored counters move only with the rows they count"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+
+    def follow_counts(self):
+        return (
+            Profile.objects.get(user=self.alice).following_count,
+            Profile.objects.get(user=self.bob).followers_count,
+        )
+
+    def test_repeated_follows_and_unfollows_count_once(self):
+        alice, bob = self.alice.profile, self.bob.profile
+        self.assertTrue(set_follow(alice, bob, True))
+        self.assertFalse(set_follow(alice, bob, True))  # A second request racing the first
+        self.assertEqual(self.follow_counts(), (1, 1))
+
+        self.assertTrue(set_follow(alice, bob, False))
+        self.assertFalse(set_follow(alice, bob, False))
+        self.assertEqual(self.follow_counts(), (0, 0))
+
+    def test_follow_view_toggles(self):
+        self.client.force_login(self.alice)
+        url = reverse('follow', args=['bob'])
+        self.client.get(url)
+        self.assertEqual(self.follow_counts(), (1, 1))
+        self.assertEqual(Notification.objects.filter(recipient=self.bob).count(), 1)
+        self.client.get(url)
+        self.assertEqual(self.follow_counts(), (0, 0))
+        self.assertFalse(self.alice.profile.follows.exists())
+
+    def test_comments_and_likes_move_post_counters(self):
+        post = Post.objects.create(author=self.bob, text='Hello')
+        self.client.force_login(self.alice)
+        self.client.post(reverse('add_comment', args=[post.pk]), {'text': 'Hi'})
+        self.client.post(reverse('add_comment', args=[post.pk]), {'text': 'Again'})
+        set_like(post, self.alice, True)
+        set_like(post, self.bob, True)
+        set_like(post, self.bob, False)
+        post.refresh_from_db()
+        self.assertEqual((post.comments_count, post.likes_count), (2, 1))
+
+    def test_reconcile_fixes_drift(self):
+        post = Post.objects.create(author=self.bob, text='Hello')
+        set_like(post, self.alice, True)
+        set_follow(self.alice.profile, self.bob.profile, True)
+        Post.objects.filter(pk=post.pk).update(likes_count=7)
+        Profile.objects.filter(user=self.bob).update(followers_count=0)
+
+        out = io.StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('2 row(s) have drifted', out.getvalue())
+        self.assertEqual(Post.objects.get(pk=post.pk).likes_count, 7)
+
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertEqual(Post.objects.get(pk=post.pk).likes_count, 1)
+        self.assertEqual(self.follow_counts(), (1, 1))
+        out = io.StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('All counters match', out.getvalue())
+
+    def test_failed_account_delete_keeps_counters(self):
+        set_follow(self.alice.profile, self.bob.profile, True)
+        self.client.force_login(self.alice)
+        with mock.patch.object(User, 'delete', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('delete_account'))
+        self.assertEqual(self.follow_counts(), (1, 1))
+
+        self.client.post(reverse('delete_account'))
+        self.assertFalse(User.objects.filter(pk=self.alice.pk).exists())
+        self.assertEqual(Profile.objects.get(user=self.bob).followers_count, 0)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class FeedPaginationTests(ChatxTestCase):
+    """Cursor pages cover the feed exactly once, even across equal timestamps"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_login(self.user)
+        posts = [Post.objects.create(author=self.user, text=f'Post {i}') for i in range(FEED_PAGE_SIZE * 2 + 5)]
+        # Half the posts share one timestamp, so ids have to break the tie
+        Post.objects.filter(pk__in=[p.pk for p in posts[::2]]).update(created_at=posts[0].created_at)
+        for post in Post.objects.all():
+            fan_out_post(post)
+        self.expected = list(Post.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+    def test_keyset_pages_are_disjoint_and_ordered(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(Post.objects.all(), cursor)
+            self.assertLessEqual(len(page), FEED_PAGE_SIZE)
+            seen += [post.pk for post in page]
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+
+    def test_page_endpoint_follows_the_cursor(self):
+        response = self.client.get(reverse('post_list'))
+        self.assertEqual([p.pk for p in response.context['posts']], self.expected[:FEED_PAGE_SIZE])
+
+        seen, cursor = list(self.expected[:FEED_PAGE_SIZE]), response.context['next_cursor']
+        while cursor:
+            data = self.client.get(reverse('post_list_page'), {'cursor': cursor}).json()
+            seen += [int(pk) for pk in re.findall(r'id="like-count-(\d+)"', data['html'])]
+            cursor = data['next_cursor']
+        self.assertEqual(seen, self.expected)
+
+    def test_malformed_cursor_starts_over(self):
+        data = self.client.get(reverse('post_list_page'), {'cursor': 'not-a-cursor!'}).json()
+        self.assertEqual(data['html'].count('id="like-count-'), FEED_PAGE_SIZE)
+        self.assertIsNotNone(data['next_cursor'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TimelineTests(ChatxTestCase):
+    """Posts are written into followers' timelines; follows copy in and prune"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        set_follow(self.alice.profile, self.bob.profile, True)
+
+    def timeline(self, user):
+        return set(TimelineEntry.objects.filter(user=user).values_list('post__text', flat=True))
+
+    def post_as(self, user, text):
+        self.client.force_login(user)
+        self.client.post(reverse('post_create'), {'text': text})
+
+    def test_new_posts_fan_out_to_followers_only(self):
+        self.post_as(self.bob, 'From bob')
+        self.assertEqual(self.timeline(self.alice), {'From bob'})
+        self.assertEqual(self.timeline(self.bob), {'From bob'})
+        self.assertEqual(self.timeline(self.carol), set())
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        self.post_as(self.carol, 'From carol')
+        self.post_as(self.alice, 'From alice')
+        follow = reverse('follow', args=['carol'])
+
+        self.client.get(follow)
+        self.assertEqual(self.timeline(self.alice), {'From alice', 'From carol'})
+        self.client.get(follow)
+        self.assertEqual(self.timeline(self.alice), {'From alice'})
+
+    def test_rebuild_matches_fan_out(self):
+        self.post_as(self.bob, 'From bob')
+        self.post_as(self.carol, 'From carol')
+        before = {user.pk: self.timeline(user) for user in User.objects.all()}
+        TimelineEntry.objects.all().delete()
+
+        call_command('rebuild_timelines', stdout=io.StringIO())
+        self.assertEqual({user.pk: self.timeline(user) for user in User.objects.all()}, before)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class InteractionTests(ChatxTestCase):
+    """Likes and saves are set or toggled in one write, and repeats change nothing"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.post = Post.objects.create(author=self.bob, text='Hello')
+        self.client.force_login(self.alice)
+
+    def send(self, name, **params):
+        return self.client.post(
+            reverse(name, args=[self.post.pk]), params, headers={'X-Requested-With': 'XMLHttpRequest'}
+        ).json()
+
+    def test_setting_a_like_twice_counts_and_notifies_once(self):
+        self.assertEqual(self.send('like_post', liked='true'), {'liked': True, 'likes_count': 1})
+        self.assertEqual(self.send('like_post', liked='true'), {'liked': True, 'likes_count': 1})
+        self.assertEqual(Notification.objects.filter(recipient=self.bob).count(), 1)
+        self.assertEqual(self.send('like_post', liked='false'), {'liked': False, 'likes_count': 0})
+        self.assertEqual(self.send('like_post', liked='false'), {'liked': False, 'likes_count': 0})
+
+    def test_toggles_flip_state(self):
+        self.assertEqual(self.send('save_post'), {'saved': True, 'saves_count': 1})
+        self.assertEqual(self.send('save_post'), {'saved': False, 'saves_count': 0})
+        self.assertFalse(self.post.saves.exists())
+
+    def test_repeated_set_is_a_single_write(self):
+        set_like(self.post, self.alice, True)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(set_like(self.post, self.alice, True))
+        writes = [q['sql'] for q in queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(writes), 1, writes)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class NotificationTests(ChatxTestCase):
+    """Events on one target fold into one row; the inbox pages and counts unread"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.post = Post.objects.create(author=self.owner, text='Hello')
+        self.fans = [User.objects.create_user(f'fan{i}', f'fan{i}@example.com', 'pw') for i in range(5)]
+
+    def test_likes_on_one_post_share_a_row(self):
+        for fan in self.fans:
+            notify(self.owner.pk, fan, 'like', post=self.post)
+        notify(self.owner.pk, self.fans[3], 'like', post=self.post)  # Liked again after an unlike
+
+        notification = Notification.objects.get(recipient=self.owner)
+        self.assertEqual(notification.actor_count, 5)
+        self.assertEqual(notification.sender, self.fans[3])
+        self.assertEqual(notification.recent_actor_ids, [self.fans[3].pk, self.fans[4].pk, self.fans[2].pk])
+
+        self.client.force_login(self.owner)
+        self.assertContains(self.client.get(reverse('notifications')), 'and 4 others')
+
+    def test_other_targets_and_old_rows_are_not_folded(self):
+        notify(self.owner.pk, self.fans[0], 'like', post=self.post)
+        notify(self.owner.pk, self.fans[1], 'like', post=Post.objects.create(author=self.owner, text='Other'))
+        notify(self.owner.pk, self.fans[2], 'follow')
+        self.assertEqual(Notification.objects.filter(recipient=self.owner).count(), 3)
+
+        Notification.objects.update(updated_at=timezone.now() - AGGREGATION_WINDOW * 2)
+        notify(self.owner.pk, self.fans[3], 'like', post=self.post)
+        self.assertEqual(Notification.objects.filter(recipient=self.owner, post=self.post).count(), 2)
+
+    def test_the_window_counts_from_the_first_event(self):
+        first = notify(self.owner.pk, self.fans[0], 'like', post=self.post)
+        # Recent likes kept the row fresh, but it was started too long ago
+        Notification.objects.filter(pk=first.pk).update(
+            created_at=timezone.now() - AGGREGATION_WINDOW - timedelta(hours=1),
+            updated_at=timezone.now() - timedelta(minutes=5),
+        )
+        second = notify(self.owner.pk, self.fans[1], 'like', post=self.post)
+        self.assertNotEqual(second.pk, first.pk)
+        self.assertEqual(notify(self.owner.pk, self.fans[2], 'like', post=self.post).pk, second.pk)
+
+    def test_unread_count_is_cached_until_it_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.owner.pk, self.fans[0], 'follow')
+        with self.assertNumQueries(1):
+            self.assertEqual(unread_count(self.owner), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(self.owner), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.owner.pk, self.fans[1], 'like', post=self.post)
+            notify(self.owner.pk, self.fans[2], 'like', post=self.post)  # Folded, still one unread row
+        self.assertEqual(unread_count(self.owner), 2)
+
+        self.client.force_login(self.owner)
+        self.client.get(reverse('notifications'))
+        self.assertEqual(unread_count(self.owner), 0)
+
+    def test_inbox_pages_and_marks_only_what_it_showed(self):
+        now = timezone.now()
+        for i in range(NOTIFICATIONS_PAGE_SIZE + 5):
+            Notification.objects.create(
+                recipient=self.owner, sender=self.fans[i % 5], notification_type='like',
+                post=Post.objects.create(author=self.owner, text=f'Post {i}'), updated_at=now - timedelta(minutes=i),
+            )
+        self.client.force_login(self.owner)
+
+        response = self.client.get(reverse('notifications'))
+        first_page = response.context['notifications']
+        self.assertEqual(len(first_page), NOTIFICATIONS_PAGE_SIZE)
+        self.assertEqual(Notification.objects.filter(is_read=False).count(), 5)
+
+        response = self.client.get(reverse('notifications'), {'cursor': response.context['next_cursor']})
+        self.assertEqual(len(response.context['notifications']), 5)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertFalse({n.pk for n in first_page} & {n.pk for n in response.context['notifications']})
+        self.assertFalse(Notification.objects.filter(is_read=False).exists())
+
+    def test_old_read_notifications_leave_the_inbox(self):
+        notify(self.owner.pk, self.fans[0], 'follow')
+        notify(self.owner.pk, self.fans[1], 'like', post=self.post)
+        long_ago = timezone.now() - READ_RETENTION - timedelta(days=1)
+        Notification.objects.filter(notification_type='follow').update(is_read=True, updated_at=long_ago)
+        Notification.objects.filter(notification_type='like').update(updated_at=long_ago)
+
+        self.client.force_login(self.owner)
+        shown = self.client.get(reverse('notifications')).context['notifications']
+        self.assertEqual([n.notification_type for n in shown], ['like'])  # Unread, however old
+
+    def test_own_actions_are_not_notified(self):
+        self.assertIsNone(notify(self.owner.pk, self.owner, 'like', post=self.post))
+        self.assertFalse(Notification.objects.exists())
+
+
+@skipUnless(fts_enabled(), 'The FTS5 index is SQLite only')
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SearchTests(ChatxTestCase):
+    """The FTS5 index follows posts and profiles and ranks username hits first"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+
+    def post_texts(self, query):
+        return [post.text for post in search_posts(query)[0]]
+
+    def test_posts_are_found_by_prefix_and_follow_edits_and_deletes(self):
+        post = Post.objects.create(author=self.alice, text='Sunsets over the harbour')
+        self.assertEqual(self.post_texts('harb'), ['Sunsets over the harbour'])
+
+        post.text = 'Sunrise at the beach'
+        post.save()
+        self.assertEqual(self.post_texts('harb'), [])
+        self.assertEqual(self.post_texts('sunrise beach'), ['Sunrise at the beach'])
+
+        post.delete()
+        self.assertEqual(self.post_texts('sunrise'), [])
+
+    def test_username_matches_outrank_bios(self):
+        Profile.objects.filter(user=self.bob).update(bio='Big fan of alice')
+        self.bob.profile.refresh_from_db()
+        self.bob.profile.save()
+        self.assertEqual([user.username for user in search_users('alice')], ['alice', 'bob'])
+
+    def test_unchanged_saves_leave_the_index_alone(self):
+        post = Post.objects.create(author=self.alice, text='Sunsets over the harbour')
+
+        def index_writes(action):
+            with CaptureQueriesContext(connection) as ctx:
+                action()
+            return [
+                q['sql'] for q in ctx.captured_queries
+                if 'chatx_search_index' in q['sql'] and not q['sql'].startswith('SELECT')
+            ]
+
+        self.assertEqual(index_writes(lambda: self.client.login(username='alice', password='pw')), [])
+        self.assertEqual(index_writes(post.save), [])
+        self.assertEqual(index_writes(self.alice.save), [])
+
+        self.alice.username = 'alicia'
+        writes = index_writes(self.alice.save)
+        self.assertTrue(writes and all('rowid' in sql for sql in writes), writes)
+        self.assertEqual([user.username for user in search_users('alicia')], ['alicia'])
+
+    def test_query_syntax_is_treated_as_text(self):
+        Post.objects.create(author=self.alice, text='C and C++ notes')
+        for query in ['"', 'NOT', 'c AND (', '*', 'near(']:
+            with self.subTest(query=query):
+                search_posts(query)
+        self.assertEqual(self.post_texts('notes'), ['C and C++ notes'])
+
+    def test_pages_and_rebuild(self):
+        for i in range(25):
+            Post.objects.create(author=self.alice, text=f'Kitten picture {i}')
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('search'), {'q': 'kitten'})
+        self.assertEqual((len(response.context['posts']), response.context['has_next']), (20, True))
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM chatx_search_index')
+        self.assertEqual(self.post_texts('kitten'), [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        response = self.client.get(reverse('search'), {'q': 'kitten', 'page': 2})
+        self.assertEqual((len(response.context['posts']), response.context['has_next']), (5, False))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class AutocompleteTests(ChatxTestCase):
+    """Prefix lookups come from the in-memory index, which follows every worker's changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ['Anna', 'annabel', 'anne', 'bob', *[f'ann{i}' for i in range(10)]]:
+            User.objects.create_user(name, f'{name}@example.com', 'pw')
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, index, prefix):
+        return [username for username, _ in index.search(prefix)]
+
+    def test_prefix_matches_are_case_insensitive_and_limited(self):
+        index = UsernameIndex()
+        self.assertEqual(self.names(index, 'ANNA'), ['Anna', 'annabel'])
+        self.assertEqual(len(index.search('ann')), AUTOCOMPLETE_LIMIT)
+        self.assertEqual(self.names(index, 'zz'), [])
+        self.assertEqual(self.names(index, ''), [])
+
+    @mock.patch('chatx.autocomplete.VERSION_CHECK_INTERVAL', 0)
+    def test_changes_reach_every_workers_copy(self):
+        this_worker, other_worker = UsernameIndex(), UsernameIndex()
+        self.names(this_worker, 'a')
+        self.names(other_worker, 'a')
+
+        with mock.patch('chatx.signals.username_index', this_worker):
+            user = User.objects.get(username='bob')
+            user.username = 'annika'
+            user.save()
+            User.objects.get(username='anne').delete()
+
+        for index in (this_worker, other_worker):
+            with self.subTest(index=index):
+                self.assertEqual(self.names(index, 'anni'), ['annika'])
+                self.assertEqual(self.names(index, 'anne'), [])
+                self.assertEqual(self.names(index, 'bob'), [])
+
+    def test_only_renames_publish_and_lookups_check_once_a_second(self):
+        index = UsernameIndex()
+        self.names(index, 'a')
+        version = cache.get(VERSION_CACHE_KEY)
+
+        with mock.patch('chatx.signals.username_index', index):
+            self.client.login(username='bob', password='pw')
+            user = User.objects.get(username='bob')
+            user.first_name = 'Bob'
+            user.save()
+            self.assertEqual(cache.get(VERSION_CACHE_KEY), version)
+            user.username = 'bobby'
+            user.save()
+            self.assertEqual(cache.get(VERSION_CACHE_KEY), version + 1)
+
+        later = time.monotonic() + 10
+        with mock.patch('chatx.autocomplete.cache.get', wraps=cache.get) as cache_get, \
+                mock.patch('chatx.autocomplete.time.monotonic', side_effect=[later, later + 0.5, later + 1.5]):
+            for _ in range(3):
+                self.names(index, 'bob')
+        self.assertEqual(cache_get.call_count, 2)
+
+    def test_endpoint_reports_follow_state(self):
+        viewer = User.objects.get(username='bob')
+        set_follow(viewer.profile, User.objects.get(username='anne').profile, True)
+        self.client.force_login(viewer)
+        results = self.client.get(reverse('username_autocomplete'), {'q': 'anne'}).json()['results']
+        self.assertEqual(results, [{'username': 'anne', 'url': reverse('profile', args=['anne']), 'is_following': True}])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class PostCardCacheTests(ChatxTestCase):
+    """Card fragments are reused until the post, its comments or its author change"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pw')
+        self.post = Post.objects.create(author=self.author, text='First words')
+        self.neighbour = Post.objects.create(author=self.other, text='Next door')
+
+    def versions(self):
+        posts = attach_card_versions(Post.objects.order_by('pk'))
+        return [post.card_version for post in posts]
+
+    def test_versions_move_only_for_what_changed(self):
+        first, neighbour = self.versions()
+        self.assertEqual(self.versions(), [first, neighbour])
+
+        Comment.objects.create(post=self.post, author=self.other, text='Nice')
+        changed, same = self.versions()
+        self.assertNotEqual(changed, first)
+        self.assertEqual(same, neighbour)
+
+        self.author.profile.bio = 'New bio'
+        self.author.profile.save()
+        self.assertNotEqual(self.versions()[0], changed)
+        self.assertEqual(self.versions()[1], neighbour)
+
+    def test_rendered_cards_are_reused_until_the_post_changes(self):
+        fan_out_post(self.post)
+        url = reverse('post_list')
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(url), 'First words')
+
+        # A bypassing write bumps nothing, so the cached card still shows
+        Post.objects.filter(pk=self.post.pk).update(text='Unseen words')
+        self.assertContains(self.client.get(url), 'First words')
+
+        self.post.text = 'Edited words'
+        self.post.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Edited words')
+        self.assertNotContains(response, 'First words')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite connection settings')
+class SQLiteSettingsTests(ChatxTestCase):
+    """Connections to a database file run in WAL mode and wait out a busy writer"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.name = f'{directory}/check.sqlite3'
+
+    def open(self, alias='settings_check', **options):
+        """A connection to the scratch file with the project's settings, registered under `alias`"""
+        settings_dict = {**connection.settings_dict, 'NAME': self.name}
+        settings_dict['OPTIONS'] = {**settings_dict['OPTIONS'], **options}
+        wrapper = type(connections['default'])(settings_dict, alias=alias)
+        connections[alias] = wrapper
+        self.addCleanup(delattr, connections._connections, alias)
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def test_readers_are_not_blocked_by_a_writer(self):
+        writer, reader = self.open('writer').connection, self.open('reader').connection
+
+        pragmas = {pragma: writer.execute(f'PRAGMA {pragma}').fetchone()[0]
+                   for pragma in ('journal_mode', 'synchronous', 'busy_timeout')}
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000})
+
+        writer.execute('CREATE TABLE item (x)')
+        writer.execute('INSERT INTO item VALUES (1)')
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute('INSERT INTO item VALUES (2)')
+        # Mid-write, a reader still gets the last committed state straight away
+        self.assertEqual(reader.execute('SELECT count(*) FROM item').fetchone()[0], 1)
+        writer.execute('COMMIT')
+        self.assertEqual(reader.execute('SELECT count(*) FROM item').fetchone()[0], 2)
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        self.open('first').connection.execute('CREATE TABLE item (x)')
+        self.open('second', timeout=0.05)
+        with transaction.atomic(using='first'):
+            connections['first'].cursor().execute('SELECT count(*) FROM item')
+            # Even a transaction that has only read holds the lock, so a second
+            # one waits at BEGIN instead of failing later, mid-way, on its write
+            with self.assertRaisesMessage(OperationalError, 'locked'):
+                with transaction.atomic(using='second'):
+                    pass
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ReplicaRoutingTests(ChatxTestCase):
+    """Marked views read app data from the replica unless the client just wrote"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.post = Post.objects.create(author=self.user, text='Hello')
+
+    def routes(self, request):
+        router = ReplicaRouter()
+
+        @read_from_replica
+        def view(request):
+            return {model.__name__: router.db_for_read(model) for model in (Post, User)}
+        return view(request)
+
+    @mock.patch('chatx.routers.replica_configured', return_value=True)
+    def test_marked_views_read_app_data_from_the_replica(self, _):
+        request = RequestFactory().get('/')
+        self.assertEqual(self.routes(request), {'Post': 'replica', 'User': None})
+        self.assertIsNone(ReplicaRouter().db_for_read(Post))  # Outside the view
+        self.assertEqual(ReplicaRouter().db_for_write(Post), 'default')
+
+        request.COOKIES[STICKY_COOKIE] = '1'
+        self.assertEqual(self.routes(request), {'Post': None, 'User': None})
+
+    def test_cache_queries_stay_out_of_the_app_database(self):
+        with CaptureQueriesContext(connections['cache']) as cache_queries:
+            with self.assertNumQueries(0):
+                cache.set('routing-check', 1)
+                self.assertEqual(cache.get('routing-check'), 1)
+        self.assertTrue(cache_queries)
+
+    @mock.patch('chatx.middleware.replica_configured', return_value=True)
+    def test_only_real_writes_make_the_client_sticky(self, _):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('post_list'))  # Fills the database cache, nothing else
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+        response = self.client.post(reverse('like_post', args=[self.post.pk]))
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], STICKY_SECONDS)
+
+
+class OTPStoreTests(ChatxTestCase):
+    """Codes live in the expiring otp cache under hashed keys and are single use"""
+
+    def setUp(self):
+        caches['otp'].clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+
+    def stored_keys(self):
+        with connections['cache'].cursor() as cursor:
+            cursor.execute('SELECT cache_key FROM chatx_otp_cache')
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_codes_are_stored_under_hashed_emails(self):
+        otp_store.issue('Alice@Example.com ')
+        keys = self.stored_keys()
+        self.assertEqual(len(keys), 1)
+        self.assertNotIn('example', keys[0].lower())
+        self.assertIn(hashlib.sha256(b'alice@example.com').hexdigest(), keys[0])
+        self.assertIsNotNone(otp_store.pending('alice@example.com'))
+
+    def test_codes_are_single_use_and_replaced_on_reissue(self):
+        with mock.patch('chatx.otp.generate_otp', side_effect=['111111', '222222']):
+            first = otp_store.issue('alice@example.com', self.user)
+            second = otp_store.issue('alice@example.com', self.user)
+        self.assertIsNone(otp_store.verify('alice@example.com', first, self.user))
+        self.assertIsNone(otp_store.verify('alice@example.com', second, User(pk=self.user.pk + 1)))
+        self.assertIsNotNone(otp_store.verify('alice@example.com', second, self.user))
+        self.assertIsNone(otp_store.verify('alice@example.com', second, self.user))
+
+    def test_wrong_guesses_burn_the_code(self):
+        otp = otp_store.issue('alice@example.com')
+        wrong = f'{(int(otp) + 1) % 10 ** 6:06d}'
+        for _ in range(otp_store.MAX_ATTEMPTS):
+            self.assertIsNone(otp_store.verify('alice@example.com', wrong))
+        self.assertIsNone(otp_store.verify('alice@example.com', otp))
+        self.assertEqual(self.stored_keys(), [])
+
+    def test_expired_codes_are_told_apart(self):
+        otp = otp_store.issue('alice@example.com')
+        with mock.patch('chatx.otp.timezone.now', return_value=timezone.now() + otp_store.OTP_TTL * 2):
+            code = otp_store.verify('alice@example.com', otp)
+            self.assertFalse(code.is_valid())
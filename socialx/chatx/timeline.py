@@ -0,0 +1,81 @@
+# chatx/timeline.py
+
+from .models import Post, Profile, TimelineEntry
+from .pagination import keyset_page
+
+# Rows written per INSERT while fanning out, so memory stays flat for big audiences
+FANOUT_BATCH_SIZE = 500
+
+# How many of an account's recent posts are copied in when someone follows it
+BACKFILL_LIMIT = 100
+
+
+def _entry(user_id, post):
+    return TimelineEntry(
+        user_id=user_id,
+        post=post,
+        author_id=post.author_id,
+        created_at=post.created_at,
+    )
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=FANOUT_BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    """Write a new post into its author's timeline and every follower's timeline"""
+    follower_ids = (
+        Profile.objects.filter(follows__user_id=post.author_id)
+        .values_list('user_id', flat=True)
+        .iterator(chunk_size=FANOUT_BATCH_SIZE)
+    )
+
+    batch = [_entry(post.author_id, post)]
+    for user_id in follower_ids:
+        batch.append(_entry(user_id, post))
+        if len(batch) >= FANOUT_BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+    if batch:
+        _bulk_insert(batch)
+
+
+def backfill_follow(user, followed_user):
+    """Copy the followed account's most recent posts into the follower's timeline"""
+    posts = Post.objects.filter(author=followed_user).order_by('-created_at', '-id')[:BACKFILL_LIMIT]
+    _bulk_insert([_entry(user.pk, post) for post in posts])
+
+
+def prune_unfollow(user, unfollowed_user):
+    """Remove an unfollowed account's posts from the follower's timeline"""
+    TimelineEntry.objects.filter(user=user, author=unfollowed_user).delete()
+
+
+def rebuild_timeline(user):
+    """Recreate a user's timeline from their own posts and the accounts they follow"""
+    TimelineEntry.objects.filter(user=user).delete()
+    backfill_follow(user, user)
+    for profile in user.profile.follows.select_related('user'):
+        backfill_follow(user, profile.user)
+
+
+def home_timeline(user, cursor, posts=None):
+    """
+    Return one page of the user's home timeline and the cursor for the next one.
+
+    The page is read from the user's TimelineEntry rows, then the posts are
+    fetched by primary key from `posts` (so callers can pass a queryset with
+    their own select_related/prefetch_related applied).
+    """
+    if posts is None:
+        posts = Post.objects.all()
+
+    entries, next_cursor = keyset_page(
+        TimelineEntry.objects.filter(user=user).only('post_id', 'created_at'),
+        cursor,
+        pk_field='post_id',
+    )
+    post_ids = [entry.post_id for entry in entries]
+    by_id = posts.in_bulk(post_ids)
+    return [by_id[pk] for pk in post_ids if pk in by_id], next_cursor
@@ -0,0 +1,170 @@
+# chatx/uploads.py
+
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
+
+from .models import ChunkedUpload
+
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+CHUNK_SIZE = 5 * 1024 * 1024      # What clients are told to send
+MAX_CHUNK_SIZE = 8 * 1024 * 1024  # What is accepted
+READ_BLOCK = 64 * 1024            # A chunk streams to disk this much at a time
+
+# Uploads untouched this long are removed by `manage.py purge_uploads`
+UPLOAD_EXPIRY = timedelta(hours=24)
+
+
+class UploadError(Exception):
+    """A request the upload API refuses; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_dir():
+    path = getattr(settings, 'CHUNKED_UPLOAD_DIR', None) or os.path.join(
+        settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir(), 'socialx-uploads'
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def spool_path(upload):
+    return os.path.join(upload_dir(), f'{upload.pk}.part')
+
+
+def start(user, filename, content_type, size, sha256=''):
+    """Open an upload of `size` bytes; chunks are then sent with append()"""
+    if not content_type.startswith(('image/', 'video/')):
+        raise UploadError('Only images and videos can be uploaded.')
+    if not 0 < size <= MAX_UPLOAD_SIZE:
+        raise UploadError(f'Files must be between 1 byte and {MAX_UPLOAD_SIZE // (1024 * 1024)}MB.', 413)
+    return ChunkedUpload.objects.create(
+        user=user,
+        filename=os.path.basename(filename)[:255] or 'upload',
+        content_type=content_type[:100],
+        size=size,
+        sha256=sha256.lower(),
+    )
+
+
+def append(upload, offset, stream, length, checksum=''):
+    """
+    Write `length` bytes from `stream` at `offset` and return the new offset.
+    The offset must be where the upload left off; a client that lost track
+    asks for upload.offset and carries on from there. With a SHA-256
+    `checksum`, a damaged chunk is refused and has to be sent again.
+    """
+    if upload.completed_at:
+        raise UploadError('This upload is already complete.', 409)
+    if offset != upload.offset:
+        raise UploadError(f'Expected offset {upload.offset}.', 409)
+    if not 0 < length <= MAX_CHUNK_SIZE:
+        raise UploadError(f'Chunks must be between 1 byte and {MAX_CHUNK_SIZE // (1024 * 1024)}MB.', 413)
+    if offset + length > upload.size:
+        raise UploadError('Chunk runs past the declared file size.', 413)
+
+    path = spool_path(upload)
+    digest = hashlib.sha256()
+    remaining = length
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        # Anything past the offset is left over from a chunk that never got acknowledged
+        f.seek(offset)
+        f.truncate()
+        while remaining:
+            block = stream.read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            f.write(block)
+            digest.update(block)
+            remaining -= len(block)
+
+    if remaining:
+        raise UploadError('The chunk ended early; send it again.')
+    if checksum and checksum.lower() != digest.hexdigest():
+        raise UploadError('Chunk checksum mismatch; send it again.')
+
+    # Only one of two racing requests for the same offset gets to move it on
+    advanced = ChunkedUpload.objects.filter(pk=upload.pk, offset=offset).update(
+        offset=offset + length, updated_at=timezone.now()
+    )
+    if not advanced:
+        raise UploadError('Another request wrote this chunk first.', 409)
+    upload.offset = offset + length
+    return upload.offset
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete(upload):
+    """Check the assembled file against the declared size and checksum"""
+    if upload.completed_at:
+        return upload
+    if upload.offset != upload.size:
+        raise UploadError(f'Only {upload.offset} of {upload.size} bytes have arrived.')
+    if upload.sha256 and _file_sha256(spool_path(upload)) != upload.sha256:
+        discard(upload)
+        raise UploadError('The file does not match its checksum; upload it again.', 422)
+    upload.completed_at = timezone.now()
+    upload.save(update_fields=['completed_at'])
+    return upload
+
+
+class SpooledUpload(UploadedFile):
+    """
+    A finished upload handed to a FileField. Like Django's own temporary
+    uploads it exposes temporary_file_path(), so FileSystemStorage moves the
+    file into place instead of copying it.
+    """
+
+    def __init__(self, upload):
+        self._path = spool_path(upload)
+        super().__init__(
+            open(self._path, 'rb'), upload.filename, upload.content_type, upload.size, None
+        )
+
+    def temporary_file_path(self):
+        return self._path
+
+
+def completed_upload(user, upload_id):
+    """The user's finished upload with this id, or None"""
+    if not upload_id:
+        return None
+    try:
+        return ChunkedUpload.objects.filter(pk=upload_id, user=user, completed_at__isnull=False).first()
+    except ValidationError:
+        return None  # Not a UUID
+
+
+def discard(upload):
+    """Forget the upload and remove its spool file, if storage didn't move it away"""
+    try:
+        os.remove(spool_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def purge_expired(now=None):
+    """Remove uploads that saw no activity for UPLOAD_EXPIRY; returns how many"""
+    expired = ChunkedUpload.objects.filter(updated_at__lt=(now or timezone.now()) - UPLOAD_EXPIRY)
+    count = 0
+    for upload in expired.iterator():
+        discard(upload)
+        count += 1
+    return count
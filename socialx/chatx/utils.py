@@ -1,25 +1,17 @@
 # chatx/utils.py
 
-from django.core.mail import send_mail
-from django.conf import settings
-from django.utils import timezone
-from .models import EmailVerification
+import logging
+
+from .outbox import enqueue
+from . import otp as otp_store
+
+logger = logging.getLogger(__name__)
 
 
 def send_verification_email(user, email):
     """Send OTP verification email"""
-    # Generate OTP
-    otp = EmailVerification.generate_otp()
-    
-    # Delete old unverified OTPs
-    EmailVerification.objects.filter(email=email, verified=False).delete()
-    
-    # Create new verification record
-    verification = EmailVerification.objects.create(
-        user=user if (user and user.pk) else None,
-        email=email,
-        otp=otp
-    )
+    # Issue OTP (replaces any earlier code for this email)
+    otp = otp_store.issue(email, user if (user and user.pk) else None)
     
     # Prepare email
     username = user.username if hasattr(user, 'username') else 'there'
@@ -110,44 +102,14 @@ SocialX Web Team
     """
     
     try:
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [email],
-            fail_silently=False,
-            html_message=html_message,
-        )
-        print(f"✅ Email sent to {email} with OTP: {otp}")
+        enqueue(email, subject, message, html_message)
         return True
-    except Exception as e:
-        print(f"❌ Error sending email: {e}")
+    except Exception:
+        logger.exception('Could not queue the verification email')
         return False
 
 
 def verify_otp(user, email, otp):
     """Verify OTP code"""
-    try:
-        if user and user.pk:
-            verification = EmailVerification.objects.get(
-                user=user,
-                email=email,
-                otp=otp,
-                verified=False
-            )
-        else:
-            verification = EmailVerification.objects.get(
-                email=email,
-                otp=otp,
-                verified=False
-            )
-        
-        if verification.is_valid():
-            verification.verified = True
-            verification.save()
-            return True
-        else:
-            return False
-            
-    except EmailVerification.DoesNotExist:
-        return False
\ No newline at end of file
+    verification = otp_store.verify(email, otp, user if (user and user.pk) else None)
+    return verification is not None and verification.is_valid()
@@ -0,0 +1,67 @@
+# chatx/versions.py
+
+import uuid
+
+from django.core.cache import cache
+
+# Version tokens outlive the fragments they key; a lost token is simply
+# replaced by a fresh one, which can never match an old fragment.
+VERSION_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _key(kind, pk):
+    return f'version:{kind}:{pk}'
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def bump(kind, pk):
+    """Invalidate everything cached under the current version of (kind, pk)"""
+    cache.set(_key(kind, pk), _new_token(), VERSION_TIMEOUT)
+
+
+def bump_post(post_id):
+    bump('post', post_id)
+
+
+def bump_user(user_id):
+    """For changes shown on every card by the user (avatar, username, privacy)"""
+    bump('user', user_id)
+
+
+def bump_author_posts(user_id):
+    """For edits to any of the user's posts, which their profile page lists"""
+    bump('posts', user_id)
+
+
+def bump_viewer(user_id):
+    """For the user's own likes, saves and follows, which only change what they see"""
+    bump('viewer', user_id)
+
+
+def get_versions(pairs):
+    """Current tokens for many (kind, pk) pairs in one cache round trip"""
+    keys = {pair: _key(*pair) for pair in pairs}
+    found = cache.get_many(keys.values())
+
+    versions, missing = {}, {}
+    for pair, key in keys.items():
+        if key in found:
+            versions[pair] = found[key]
+        else:
+            versions[pair] = missing[key] = _new_token()
+    if missing:
+        cache.set_many(missing, VERSION_TIMEOUT)
+    return versions
+
+
+def attach_card_versions(posts):
+    """Set post.card_version, the fragment-cache key part for each rendered card"""
+    posts = list(posts)
+    pairs = {('post', post.pk) for post in posts} | {('user', post.author_id) for post in posts}
+    versions = get_versions(pairs)
+    for post in posts:
+        post.card_version = f"{versions[('post', post.pk)]}.{versions[('user', post.author_id)]}"
+    return posts
@@ -1,18 +1,59 @@
 # chatx/views.py
 
+import logging
+import os
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.http import JsonResponse
-from django.utils import timezone
-from .models import Post, Profile, Comment, Notification, EmailVerification
+from django.db import transaction
+from django.http import Http404, HttpResponseForbidden, JsonResponse
+from django.views.decorators.http import require_POST, require_http_methods, require_safe
+from django.urls import reverse
+from django.template.loader import render_to_string
+from .models import Post, Profile, Comment, Notification, ChunkedUpload
 from .forms import (
     PostForm, UserRegistrationForm, ProfileUpdateForm, CommentForm,
     UsernameChangeForm, EmailChangeForm, OTPVerificationForm
 )
 from .utils import send_verification_email, verify_otp
+from .outbox import enqueue
+from . import otp as otp_store
+from .counters import adjust, release_user
+from .notifications import notify, inbox_page, mark_delivered_read
+from .search import search_users, search_posts
+from .autocomplete import username_index
+from .interactions import set_like, toggle_like, set_save, toggle_save, toggle_follow
+from .timeline import home_timeline, fan_out_post, backfill_follow, prune_unfollow
+from .versions import attach_card_versions, bump_viewer
+from .conditional import conditional_page, feed_etag, profile_etag, post_detail_etag
+from .lookups import get_user_or_404, forget_user, writable_profile
+from .routers import read_from_replica
+from .ratelimit import ratelimit, by_user, by_ip, by_email
+from .images import MAX_IMAGE_SIZE, InvalidImage
+from .media import update_post_media
+from . import uploads
+from . import serving
+
+logger = logging.getLogger(__name__)
+
+# --- Rate limits (token buckets, see chatx/ratelimit.py) ---
+# Every OTP send costs an email; verifies are capped across resends too
+otp_send_per_ip = ratelimit('otp_send_ip', '10/h', key=by_ip, methods=('POST',))
+otp_resend_per_ip = ratelimit('otp_send_ip', '10/h', key=by_ip)
+otp_send_per_user = ratelimit('otp_send_user', '5/h', key=by_user, methods=('POST',))
+otp_resend_per_user = ratelimit('otp_send_user', '5/h', key=by_user)
+otp_send_per_email = ratelimit('otp_send_email', '3/10m', key=by_email, methods=('POST',))
+otp_resend_per_email = ratelimit('otp_send_email', '3/10m', key=by_email)
+otp_verify_per_ip = ratelimit('otp_verify_ip', '20/10m', key=by_ip, methods=('POST',))
+otp_verify_per_user = ratelimit('otp_verify_user', '10/10m', key=by_user, methods=('POST',))
+otp_verify_per_email = ratelimit('otp_verify_email', '10/10m', key=by_email, methods=('POST',))
+interaction_limit = ratelimit('interaction', '60/m', key=by_user)
+comment_limit = ratelimit('comment', '10/m', key=by_user, methods=('POST',))
+upload_limit = ratelimit('upload', '30/h', key=by_user)
+
 
 # --- Main and Static Pages ---
 def home(request):
@@ -23,6 +64,8 @@ def about(request):
 
 
 # --- Authentication & Registration ---
+@otp_send_per_ip
+@otp_send_per_email
 def register(request):
     """
     Registration with mandatory email verification
@@ -45,25 +88,11 @@ def register(request):
             email = form.cleaned_data['email']
             username = form.cleaned_data['username']
             
-            # Generate and save OTP
-            from .models import EmailVerification
-            otp = EmailVerification.generate_otp()
-            
-            # Delete old OTPs
-            EmailVerification.objects.filter(email=email, verified=False).delete()
+            # Issue OTP (replaces any earlier code; user doesn't exist yet)
+            otp = otp_store.issue(email)
             
-            # Create verification
-            EmailVerification.objects.create(
-                user=None,  # User doesn't exist yet
-                email=email,
-                otp=otp
-            )
-            
-            # Send email
+            # Queue email (delivered by the outbox worker)
             try:
-                from django.core.mail import send_mail
-                from django.conf import settings
-                
                 subject = f'ChatX - Your Verification Code is {otp}'
                 message = f"""
 Hi {username},
@@ -80,15 +109,7 @@ Thanks,
 ChatX Team
                 """
                 
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [email],
-                    fail_silently=False,
-                )
-                
-                print(f"✅ OTP sent to {email}: {otp}")  # For development debugging
+                enqueue(email, subject, message)
                 
                 messages.success(
                     request,
@@ -96,8 +117,8 @@ ChatX Team
                 )
                 return redirect('verify_registration_otp')
                 
-            except Exception as e:
-                print(f"❌ Email error: {e}")
+            except Exception:
+                logger.exception('Could not queue the verification email')
                 messages.error(request, 'Failed to send verification email. Please try again.')
     else:
         form = UserRegistrationForm()
@@ -105,6 +126,8 @@ ChatX Team
     return render(request, 'registration/register.html', {'form': form})
 
 
+@otp_verify_per_ip
+@otp_verify_per_email
 def verify_registration_otp(request):
     """Registration Step 2: Verify OTP and create account"""
     registration_data = request.session.get('registration_data')
@@ -119,62 +142,44 @@ def verify_registration_otp(request):
             otp = form.cleaned_data['otp']
             email = registration_data['email']
             
-            # Verify OTP
-            try:
-                verification = EmailVerification.objects.get(
-                    email=email,
-                    otp=otp,
-                    verified=False
+            # Verify OTP (a matching code is used up, expired or not)
+            verification = otp_store.verify(email, otp)
+            
+            if verification is None:
+                messages.error(request, 'Invalid verification code. Please try again.')
+            elif verification.is_valid():
+                # CREATE USER NOW
+                user = User.objects.create_user(
+                    username=registration_data['username'],
+                    email=registration_data['email'],
+                    password=registration_data['password']
                 )
                 
-                if verification.is_valid():
-                    # CREATE USER NOW
-                    user = User.objects.create_user(
-                        username=registration_data['username'],
-                        email=registration_data['email'],
-                        password=registration_data['password']
-                    )
-                    
-                    # Mark email as verified
-                    user.profile.email_verified = True
-                    user.profile.save()
-                    
-                    # Mark OTP as used
-                    verification.verified = True
-                    verification.user = user  # Link to user now
-                    verification.save()
-                    
-                    # Clear session
-                    del request.session['registration_data']
-                    
-                    # Log user in
-                    login(request, user)
-                    
-                    messages.success(
-                        request,
-                        f'Welcome to ChatX, {user.username}! Your account has been created! 🎉'
-                    )
-                    return redirect('home')
-                else:
-                    messages.error(request, 'Verification code has expired. Please register again.')
-                    del request.session['registration_data']
-                    return redirect('register')
-                    
-            except EmailVerification.DoesNotExist:
-                messages.error(request, 'Invalid verification code. Please try again.')
+                # Mark email as verified
+                user.profile.email_verified = True
+                user.profile.save()
+                
+                # Clear session
+                del request.session['registration_data']
+                
+                # Log user in
+                login(request, user)
+                
+                messages.success(
+                    request,
+                    f'Welcome to ChatX, {user.username}! Your account has been created! 🎉'
+                )
+                return redirect('home')
+            else:
+                messages.error(request, 'Verification code has expired. Please register again.')
+                del request.session['registration_data']
+                return redirect('register')
     else:
         form = OTPVerificationForm()
     
     # Calculate time remaining
-    try:
-        verification = EmailVerification.objects.filter(
-            email=registration_data['email'],
-            verified=False
-        ).latest('created_at')
-        
-        time_remaining = max(0, (verification.expires_at - timezone.now()).seconds // 60)
-    except EmailVerification.DoesNotExist:
-        time_remaining = 0
+    verification = otp_store.pending(registration_data['email'])
+    time_remaining = verification.minutes_remaining() if verification else 0
     
     context = {
         'form': form,
@@ -185,6 +190,8 @@ def verify_registration_otp(request):
     return render(request, 'registration/verify_otp.html', context)
 
 
+@otp_resend_per_ip
+@otp_resend_per_email
 def resend_registration_otp(request):
     """Resend OTP during registration"""
     registration_data = request.session.get('registration_data')
@@ -196,22 +203,11 @@ def resend_registration_otp(request):
     email = registration_data['email']
     username = registration_data['username']
     
-    # Delete old OTPs
-    EmailVerification.objects.filter(email=email, verified=False).delete()
-    
-    # Generate new OTP
-    otp = EmailVerification.generate_otp()
-    EmailVerification.objects.create(
-        user=None,
-        email=email,
-        otp=otp
-    )
+    # Issue a new OTP (the old one stops working)
+    otp = otp_store.issue(email)
     
-    # Send email
+    # Queue email (delivered by the outbox worker)
     try:
-        from django.core.mail import send_mail
-        from django.conf import settings
-        
         subject = f'ChatX - Your Verification Code is {otp}'
         message = f"""
 Hi {username},
@@ -224,11 +220,10 @@ Thanks,
 ChatX Team
         """
         
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [email], fail_silently=False)
-        print(f"✅ New OTP sent to {email}: {otp}")
+        enqueue(email, subject, message)
         messages.success(request, 'New verification code sent!')
-    except Exception as e:
-        print(f"❌ Email error: {e}")
+    except Exception:
+        logger.exception('Could not queue the verification email')
         messages.error(request, 'Failed to send verification code.')
     
     return redirect('verify_registration_otp')
@@ -236,14 +231,53 @@ ChatX Team
 
 # --- Post Feed and CRUD ---
 @login_required
+@read_from_replica
+@conditional_page(feed_etag)
 def post_list(request):
-    posts = Post.objects.all()
+    posts, next_cursor = home_timeline(
+        request.user, request.GET.get('cursor'), Post.objects.for_viewer(request.user)
+    )
+    attach_card_versions(posts)
     comment_form = CommentForm()
     return render(request, 'post_list.html', {
         'posts': posts,
+        'next_cursor': next_cursor,
         'comment_form': comment_form
     })
 
+@login_required
+@read_from_replica
+def post_list_page(request):
+    """Next page of the feed as an HTML fragment for infinite scroll"""
+    posts, next_cursor = home_timeline(
+        request.user, request.GET.get('cursor'), Post.objects.for_viewer(request.user)
+    )
+    attach_card_versions(posts)
+    html = render_to_string('includes/post_cards.html', {'posts': posts}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
+INVALID_IMAGE_MESSAGE = (
+    'That image could not be read or is too large. '
+    f'Please upload a JPEG, PNG, GIF or WebP file of at most {MAX_IMAGE_SIZE // (1024 * 1024)}MB.'
+)
+
+def _posted_media(request):
+    """
+    The post form's media: a regular file field, or the id of a finished
+    upload from the chunked upload API. Returns (file, ChunkedUpload or None).
+    """
+    if 'media' in request.FILES:
+        return request.FILES['media'], None
+    upload = uploads.completed_upload(request.user, request.POST.get('upload'))
+    if upload is None:
+        return None, None
+    return uploads.SpooledUpload(upload), upload
+
+def _used_upload(upload):
+    """Once the post is saved its file has been stored, so the upload can go"""
+    if upload is not None:
+        uploads.discard(upload)
+
 @login_required
 def post_create(request):
     if request.method == "POST":
@@ -253,16 +287,28 @@ def post_create(request):
             post.author = request.user
             
             # Handle unified media upload
-            if 'media' in request.FILES:
-                media_file = request.FILES['media']
-                if media_file.content_type.startswith('image'):
-                    post.image = media_file
-                elif media_file.content_type.startswith('video'):
-                    post.video = media_file
+            media_file, upload = _posted_media(request)
+            try:
+                if media_file:
+                    if media_file.content_type.startswith('image'):
+                        post.image = media_file
+                    elif media_file.content_type.startswith('video'):
+                        post.video = media_file
             
-            post.save()
-            messages.success(request, 'Post created successfully!')
-            return redirect('post_list')
+                try:
+                    media_change = update_post_media(post)
+                except InvalidImage:
+                    form.add_error(None, INVALID_IMAGE_MESSAGE)
+                else:
+                    post.save()
+                    media_change.saved(post)
+                    _used_upload(upload)
+                    fan_out_post(post)
+                    messages.success(request, 'Post created successfully!')
+                    return redirect('post_list')
+            finally:
+                if upload is not None:
+                    media_file.close()  # We opened the spooled file, so it's ours to close
     else:
         form = PostForm()
     return render(request, 'post_form.html', {'form': form})
@@ -276,26 +322,32 @@ def post_edit(request, pk):
             post = form.save(commit=False)
             
             # Handle media replacement
-            if 'media' in request.FILES:
-                media_file = request.FILES['media']
-                
-                # Clear old media
-                if post.image:
-                    post.image.delete(save=False)
+            media_file, upload = _posted_media(request)
+            try:
+                if media_file:
+                    # The old file's reference is given back after the save (see chatx/storage.py)
                     post.image = None
-                if post.video:
-                    post.video.delete(save=False)
                     post.video = None
                 
-                # Add new media
-                if media_file.content_type.startswith('image'):
-                    post.image = media_file
-                elif media_file.content_type.startswith('video'):
-                    post.video = media_file
+                    # Add new media
+                    if media_file.content_type.startswith('image'):
+                        post.image = media_file
+                    elif media_file.content_type.startswith('video'):
+                        post.video = media_file
             
-            post.save()
-            messages.success(request, 'Post updated successfully!')
-            return redirect('post_detail', pk=post.pk)
+                try:
+                    media_change = update_post_media(post)
+                except InvalidImage:
+                    form.add_error(None, INVALID_IMAGE_MESSAGE)
+                else:
+                    post.save()
+                    media_change.saved(post)
+                    _used_upload(upload)
+                    messages.success(request, 'Post updated successfully!')
+                    return redirect('post_detail', pk=post.pk)
+            finally:
+                if upload is not None:
+                    media_file.close()  # We opened the spooled file, so it's ours to close
     else:
         form = PostForm(instance=post)
     
@@ -305,20 +357,18 @@ def post_edit(request, pk):
 def post_delete(request, pk):
     post = get_object_or_404(Post, pk=pk, author=request.user)
     if request.method == "POST":
-        if post.image:
-            post.image.delete(save=False)
-        if post.video:
-            post.video.delete(save=False)
+        # Media is shared by content, so its files go only with their last reference
         post.delete()
         messages.success(request, 'Post deleted successfully!')
         return redirect('post_list')
     return render(request, 'post_confirm_delete.html', {'post': post})
 
 @login_required
+@conditional_page(post_detail_etag)
 def post_detail(request, pk):
-    post = get_object_or_404(Post, pk=pk)
+    post = get_object_or_404(Post.objects.for_viewer(request.user), pk=pk)
     comment_form = CommentForm()
-    comments = post.comments.all()
+    comments = post.comments.select_related('author__profile')
     
     context = {
         'post': post,
@@ -328,79 +378,183 @@ def post_detail(request, pk):
     return render(request, 'post_detail.html', context)
 
 
+# --- Chunked Uploads (see chatx/uploads.py) ---
+def _upload_state(upload):
+    return {
+        'id': str(upload.pk),
+        'offset': upload.offset,
+        'size': upload.size,
+        'chunk_size': uploads.CHUNK_SIZE,
+        'complete': upload.completed_at is not None,
+        'url': reverse('upload_detail', args=[upload.pk]),
+    }
+
+def _upload_error(error, upload=None):
+    data = {'error': str(error)}
+    if upload is not None:
+        data['offset'] = upload.offset
+    return JsonResponse(data, status=error.status)
+
+@login_required
+@require_POST
+@upload_limit
+def upload_start(request):
+    """Open an upload: POST filename, size, content_type and optionally sha256"""
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'size must be a number of bytes.'}, status=400)
+    try:
+        upload = uploads.start(
+            request.user,
+            request.POST.get('filename', ''),
+            request.POST.get('content_type', ''),
+            size,
+            request.POST.get('sha256', ''),
+        )
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse(_upload_state(upload), status=201)
+
+@login_required
+@require_http_methods(['GET', 'PATCH'])
+def upload_detail(request, upload_id):
+    """
+    GET: how far the upload has got, to resume from there.
+    PATCH: append the request body at the Upload-Offset header, optionally
+    checked against the Upload-Checksum header (SHA-256, hex).
+    """
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(_upload_state(upload))
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Upload-Offset must be a number of bytes.'}, status=400)
+    try:
+        # The body is read straight off the request, never held in memory whole
+        uploads.append(upload, offset, request, length, request.headers.get('Upload-Checksum', ''))
+    except uploads.UploadError as e:
+        upload.refresh_from_db()
+        return _upload_error(e, upload)
+    return JsonResponse(_upload_state(upload))
+
+@login_required
+@require_POST
+def upload_complete(request, upload_id):
+    """Check the assembled file; its id can then be sent with the post form as `upload`"""
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user)
+    try:
+        uploads.complete(upload)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse(_upload_state(upload))
+
+
+# --- Media Files (see chatx/serving.py) ---
+@require_safe
+def media_file(request, name):
+    """Stored media as embedded in pages: anyone who can see the post can load it"""
+    return serving.serve(request, name)
+
+@require_safe
+def post_media_download(request, pk):
+    """The post's original image or video as a download, unless its author's account is private"""
+    post = get_object_or_404(Post.objects.select_related('author__profile'), pk=pk)
+    media = post.video or post.image
+    if not media:
+        raise Http404('This post has no media')
+    if post.author_id != request.user.pk and post.author.profile.is_private:
+        return HttpResponseForbidden('Only the author can download media from a private account.')
+    extension = os.path.splitext(media.name)[1]
+    # The response depends on who asks, so shared caches must not keep it
+    return serving.serve(
+        request, media.name, download_as=f'socialx-{post.pk}{extension}', cache_control='private, max-age=3600',
+    )
+
+
 # --- User Actions ---
+def _requested_state(request, name):
+    """Read an explicit true/false from the request, or None to toggle"""
+    value = request.POST.get(name, request.GET.get(name))
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+def _redirect_to_post(request, pk):
+    referer = request.META.get('HTTP_REFERER', reverse('post_list'))
+    if '#' in referer:
+        return redirect(referer)
+    else:
+        return redirect(f"{referer}#post-{pk}")
+
 @login_required
+@interaction_limit
 def like_post(request, pk):
-    post = get_object_or_404(Post, pk=pk)
+    """Toggle a like, or set it with ?liked=true/false (repeats are free no-ops)"""
+    post = get_object_or_404(Post.objects.only('pk', 'author_id'), pk=pk)
     
-    if post.likes.filter(id=request.user.id).exists():
-        post.likes.remove(request.user)
-        liked = False
+    liked = _requested_state(request, 'liked')
+    if liked is None:
+        liked, changed = toggle_like(post, request.user)
     else:
-        post.likes.add(request.user)
-        liked = True
-        if post.author != request.user:
-            Notification.objects.create(
-                recipient=post.author,
-                sender=request.user,
-                notification_type='like',
-                post=post
-            )
+        changed = set_like(post, request.user, liked)
+    
+    if changed and liked:
+        notify(post.author_id, request.user, 'like', post=post)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'liked': liked, 'likes_count': post.likes.count()})
+        likes_count = Post.objects.filter(pk=pk).values_list('likes_count', flat=True).get()
+        return JsonResponse({'liked': liked, 'likes_count': likes_count})
     
-    referer = request.META.get('HTTP_REFERER', 'post_list')
-    if '#' in referer:
-        return redirect(referer)
-    else:
-        return redirect(f"{referer}#post-{pk}")
+    return _redirect_to_post(request, pk)
 
 @login_required
+@interaction_limit
 def save_post(request, pk):
-    post = get_object_or_404(Post, pk=pk)
+    """Toggle a save, or set it with ?saved=true/false (repeats are free no-ops)"""
+    post = get_object_or_404(Post.objects.only('pk'), pk=pk)
     
-    if post.saves.filter(id=request.user.id).exists():
-        post.saves.remove(request.user)
-        saved = False
+    saved = _requested_state(request, 'saved')
+    if saved is None:
+        saved, _ = toggle_save(post, request.user)
     else:
-        post.saves.add(request.user)
-        saved = True
+        set_save(post, request.user, saved)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'saved': saved, 'saves_count': post.saves.count()})
+        saves_count = Post.objects.filter(pk=pk).values_list('saves_count', flat=True).get()
+        return JsonResponse({'saved': saved, 'saves_count': saves_count})
     
-    referer = request.META.get('HTTP_REFERER', 'post_list')
-    if '#' in referer:
-        return redirect(referer)
-    else:
-        return redirect(f"{referer}#post-{pk}")
+    return _redirect_to_post(request, pk)
 
 @login_required
 def follow_view(request, username):
-    user_to_follow = get_object_or_404(User, username=username)
+    user_to_follow = get_user_or_404(username)
     
     if user_to_follow == request.user:
         messages.error(request, "You cannot follow yourself!")
         return redirect('profile', username=username)
     
-    if request.user.profile.follows.filter(user=user_to_follow).exists():
-        request.user.profile.follows.remove(user_to_follow.profile)
-        messages.success(request, f'You unfollowed {user_to_follow.username}')
-    else:
-        request.user.profile.follows.add(user_to_follow.profile)
+    following, changed = toggle_follow(request.user.profile, user_to_follow.profile)
+    # A concurrent request may have made the same change; only the one that did it follows up
+    if following:
+        if changed:
+            backfill_follow(request.user, user_to_follow)
+            notify(user_to_follow.pk, request.user, 'follow')
         messages.success(request, f'You are now following {user_to_follow.username}')
-        Notification.objects.create(
-            recipient=user_to_follow,
-            sender=request.user,
-            notification_type='follow'
-        )
+    else:
+        prune_unfollow(request.user, user_to_follow)
+        messages.success(request, f'You unfollowed {user_to_follow.username}')
     
+    bump_viewer(request.user.pk)
     return redirect('profile', username=username)
 
 
 # --- Comments ---
 @login_required
+@comment_limit
 def add_comment(request, pk):
     post = get_object_or_404(Post, pk=pk)
     
@@ -411,15 +565,9 @@ def add_comment(request, pk):
             comment.post = post
             comment.author = request.user
             comment.save()
+            adjust(Post.objects.filter(pk=pk), comments_count=1)
             
-            if post.author != request.user:
-                Notification.objects.create(
-                    recipient=post.author,
-                    sender=request.user,
-                    notification_type='comment',
-                    post=post,
-                    comment=comment
-                )
+            notify(post.author_id, request.user, 'comment', post=post, comment=comment)
             
             messages.success(request, 'Comment added!')
     
@@ -434,9 +582,11 @@ def add_comment(request, pk):
 
 
 # --- Profile and Settings ---
+@read_from_replica
+@conditional_page(profile_etag)
 def profile_view(request, username):
-    profile_user = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=profile_user)
+    profile_user = get_user_or_404(username)
+    posts = attach_card_versions(Post.objects.for_viewer(request.user).filter(author=profile_user))
     
     is_following = False
     if request.user.is_authenticated:
@@ -452,7 +602,7 @@ def profile_view(request, username):
 @login_required
 def settings_view(request):
     if request.method == 'POST':
-        form = ProfileUpdateForm(request.POST, request.FILES, instance=request.user.profile)
+        form = ProfileUpdateForm(request.POST, request.FILES, instance=writable_profile(request.user))
         if form.is_valid():
             form.save()
             request.user.first_name = form.cleaned_data.get('first_name')
@@ -478,6 +628,7 @@ def change_username(request):
             
             request.user.username = new_username
             request.user.save()
+            forget_user(request.user.pk, old_username)
             
             messages.success(request, f'Username changed from "{old_username}" to "{new_username}"!')
             return redirect('settings')
@@ -487,6 +638,8 @@ def change_username(request):
     return render(request, 'change_username.html', {'form': form})
 
 @login_required
+@otp_send_per_user
+@otp_send_per_email
 def change_email(request):
     if request.method == 'POST':
         form = EmailChangeForm(request.POST, user=request.user)
@@ -505,6 +658,7 @@ def change_email(request):
     return render(request, 'change_email.html', {'form': form})
 
 @login_required
+@otp_verify_per_user
 def verify_email_otp(request):
     pending_email = request.session.get('pending_email')
     
@@ -522,8 +676,9 @@ def verify_email_otp(request):
                 request.user.email = pending_email
                 request.user.save()
                 
-                request.user.profile.email_verified = True
-                request.user.profile.save()
+                profile = writable_profile(request.user)
+                profile.email_verified = True
+                profile.save(update_fields=['email_verified'])
                 
                 del request.session['pending_email']
                 
@@ -534,15 +689,8 @@ def verify_email_otp(request):
     else:
         form = OTPVerificationForm()
     
-    try:
-        verification = EmailVerification.objects.filter(
-            user=request.user,
-            email=pending_email,
-            verified=False
-        ).latest('created_at')
-        time_remaining = max(0, (verification.expires_at - timezone.now()).seconds // 60)
-    except EmailVerification.DoesNotExist:
-        time_remaining = 0
+    verification = otp_store.pending(pending_email)
+    time_remaining = verification.minutes_remaining() if verification else 0
     
     context = {
         'form': form,
@@ -552,6 +700,8 @@ def verify_email_otp(request):
     return render(request, 'verify_email_otp.html', context)
 
 @login_required
+@otp_resend_per_user
+@otp_resend_per_email
 def resend_otp(request):
     pending_email = request.session.get('pending_email')
     
@@ -559,8 +709,6 @@ def resend_otp(request):
         messages.error(request, 'No pending email verification.')
         return redirect('settings')
     
-    EmailVerification.objects.filter(user=request.user, email=pending_email, verified=False).delete()
-    
     if send_verification_email(request.user, pending_email):
         messages.success(request, 'New verification code sent!')
     else:
@@ -569,6 +717,8 @@ def resend_otp(request):
     return redirect('verify_email_otp')
 
 @login_required
+@otp_send_per_user
+@otp_send_per_email
 def verify_current_email(request):
     if request.user.profile.email_verified:
         messages.info(request, 'Your email is already verified!')
@@ -585,6 +735,7 @@ def verify_current_email(request):
     return render(request, 'verify_current_email.html')
 
 @login_required
+@otp_verify_per_user
 def verify_current_email_otp(request):
     if not request.session.get('verifying_current_email'):
         messages.error(request, 'No pending email verification.')
@@ -596,8 +747,9 @@ def verify_current_email_otp(request):
             otp = form.cleaned_data['otp']
             
             if verify_otp(request.user, request.user.email, otp):
-                request.user.profile.email_verified = True
-                request.user.profile.save()
+                profile = writable_profile(request.user)
+                profile.email_verified = True
+                profile.save(update_fields=['email_verified'])
                 
                 del request.session['verifying_current_email']
                 
@@ -608,15 +760,8 @@ def verify_current_email_otp(request):
     else:
         form = OTPVerificationForm()
     
-    try:
-        verification = EmailVerification.objects.filter(
-            user=request.user,
-            email=request.user.email,
-            verified=False
-        ).latest('created_at')
-        time_remaining = max(0, (verification.expires_at - timezone.now()).seconds // 60)
-    except EmailVerification.DoesNotExist:
-        time_remaining = 0
+    verification = otp_store.pending(request.user.email)
+    time_remaining = verification.minutes_remaining() if verification else 0
     
     context = {
         'form': form,
@@ -633,20 +778,13 @@ def delete_account(request):
         user = request.user
         username = user.username
         
-        try:
-            for post in user.post_set.all():
-                if post.image:
-                    post.image.delete(save=False)
-                if post.video:
-                    post.video.delete(save=False)
-            
-            if user.profile.image:
-                user.profile.image.delete(save=False)
-        except Exception as e:
-            print(f"Error deleting media: {e}")
-        
+        # Deleting the user deletes their posts and profile, and with them
+        # their references to media files; shared files stay for the others.
+        # One transaction, so a failed delete doesn't leave the counters released
+        with transaction.atomic():
+            release_user(user)
+            user.delete()
         logout(request)
-        user.delete()
         
         messages.success(request, f'Account "{username}" has been permanently deleted.')
         return redirect('home')
@@ -656,33 +794,64 @@ def delete_account(request):
 
 # --- Other Pages ---
 @login_required
+@read_from_replica
 def saved_posts_view(request):
-    saved_posts = request.user.saved_posts.all()
+    saved_posts = attach_card_versions(Post.objects.for_viewer(request.user).filter(saves=request.user))
     return render(request, 'saved_posts.html', {'posts': saved_posts})
 
 @login_required
 def notifications_view(request):
-    notifications = request.user.notifications.all()
-    request.user.notifications.filter(is_read=False).update(is_read=True)
-    return render(request, 'notifications.html', {'notifications': notifications})
+    notifications, next_cursor = inbox_page(request.user, request.GET.get('cursor'))
+    mark_delivered_read(request.user, notifications)
+    return render(request, 'notifications.html', {
+        'notifications': notifications,
+        'next_cursor': next_cursor,
+    })
 
 def help_center_view(request):
     return render(request, 'help_center.html')
 
 @login_required
+@read_from_replica
 def search(request):
-    query = request.GET.get('q', '')
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
     
+    has_next = False
     if query:
-        users = User.objects.filter(username__icontains=query)[:10]
-        posts = Post.objects.filter(text__icontains=query)[:20]
+        users = search_users(query) if page == 1 else []
+        posts, has_next = search_posts(query, page, Post.objects.for_viewer(request.user))
     else:
-        users = User.objects.none()
-        posts = Post.objects.none()
+        users = []
+        posts = []
     
     context = {
         'query': query,
         'users': users,
         'posts': posts,
+        'page': page,
+        'has_next': has_next,
     }
-    return render(request, 'search.html', context)
\ No newline at end of file
+    return render(request, 'search.html', context)
+
+@login_required
+def username_autocomplete(request):
+    """Typeahead for the navbar search box: username prefix matches plus follow state"""
+    matches = username_index.search(request.GET.get('q', '').strip())
+    following = set(
+        request.user.profile.follows.filter(user_id__in=[pk for _, pk in matches])
+        .values_list('user_id', flat=True)
+    ) if matches else set()
+    
+    results = [
+        {
+            'username': username,
+            'url': reverse('profile', args=[username]),
+            'is_following': pk in following,
+        }
+        for username, pk in matches
+    ]
+    return JsonResponse({'results': results})
@@ -44,6 +44,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chatx.middleware.ViewerProfileMiddleware',
+    'chatx.middleware.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -61,6 +63,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'chatx.context_processors.notifications',
             ],
         },
     },
@@ -68,14 +71,82 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'socialx.wsgi.application'
 
-# Database - SQLite
+# Database - SQLite, tuned for several gunicorn workers writing at once:
+# - WAL lets readers carry on while one connection writes
+# - synchronous=NORMAL is durable in WAL mode except across a power cut
+# - transactions start IMMEDIATE, taking the write lock up front, so two
+#   read-then-write transactions can't deadlock into "database is locked"
+# - a writer that finds the lock taken waits up to `timeout` seconds
+# Compare with the old defaults using `manage.py benchmark_writes`.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=134217728;'
+                'PRAGMA journal_size_limit=67108864;'
+                'PRAGMA temp_store=MEMORY'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    }
+}
+
+# Optional read replica for the heavy read-only views (see chatx/routers.py).
+# Locally a copy of db.sqlite3 refreshed by `manage.py sync_replica` will do.
+REPLICA_DATABASE_NAME = os.getenv('REPLICA_DATABASE_NAME')
+if REPLICA_DATABASE_NAME:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': REPLICA_DATABASE_NAME,
+        'OPTIONS': {'init_command': 'PRAGMA query_only=ON', 'timeout': 20},
+        'TEST': {'MIRROR': 'default'},
     }
+
+# Database caches live in their own SQLite file (see chatx.routers.CacheRouter),
+# so cache reads and writes never queue behind the app's write lock
+DATABASES['cache'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.getenv('CACHE_DATABASE_NAME') or BASE_DIR / 'cache.sqlite3',
+    'OPTIONS': {
+        'init_command': 'PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;PRAGMA temp_store=MEMORY',
+        'timeout': 20,
+    },
 }
 
+DATABASE_ROUTERS = ['chatx.routers.CacheRouter', 'chatx.routers.ReplicaRouter']
+
+# Cache. Unread counts, lookups, rate-limit buckets and the version keys
+# behind fragment caching and ETags are invalidated by whichever gunicorn
+# worker handles the write, so every worker must see the same cache. In
+# production point it at Redis, e.g.
+#   CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+#   CACHE_LOCATION=redis://127.0.0.1:6379/1
+# (needs the `redis` package). Without that it falls back to a database cache
+# in the cache database above (table made by
+# `manage.py createcachetable --database cache`).
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'chatx_cache'),
+    },
+    # OTP codes (chatx.otp) must be seen by whichever worker checks them and
+    # must not be evicted early, so they stay in the cache database
+    'otp': {
+        'BACKEND': os.getenv('OTP_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('OTP_CACHE_LOCATION', 'chatx_otp_cache'),
+    },
+}
+
+if CACHE_BACKEND.endswith('.DatabaseCache'):
+    # Room for every post card fragment; the stock 300 entries would thrash
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 50000}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -99,10 +170,21 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-# File upload settings - 100MB
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600
-DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600
+# File uploads. Anything over 2.5MB is spooled to a temporary file rather
+# than held in worker memory; large media goes through the chunked upload
+# API (chatx/uploads.py, up to 100MB), which streams each chunk to
+# CHUNKED_UPLOAD_DIR (default: <temp dir>/socialx-uploads).
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440
 FILE_UPLOAD_PERMISSIONS = 0o644
+CHUNKED_UPLOAD_DIR = os.getenv('CHUNKED_UPLOAD_DIR') or None
+
+# Media is served by chatx (chatx/serving.py), with byte ranges and cache
+# headers. Behind nginx, set MEDIA_SENDFILE to 'x-accel-redirect' and add an
+# internal location at MEDIA_ACCEL_PREFIX aliasing MEDIA_ROOT; behind Apache
+# with mod_xsendfile, 'x-sendfile'. The web server then sends the file.
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
 
 # Default primary key
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -127,6 +209,22 @@ else:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
     DEFAULT_FROM_EMAIL = 'SocialX Web <noreply@socialxweb.com>'
 
+# Mail and video probing are queued and done by the worker processes in
+# procflie, which must run alongside the web server. Only where they can't
+# (a quick local runserver), set BACKGROUND_WORKERS=False: each request
+# then does the work it queued itself, right after its commit.
+BACKGROUND_WORKERS = os.getenv('BACKGROUND_WORKERS', 'True') == 'True'
+
+# Mail is queued in the chatx outbox and delivered by `manage.py send_outbox --loop`
+OUTBOX_SEND_IMMEDIATELY = not BACKGROUND_WORKERS
+
+# Uploaded videos are probed for their details and poster frame by
+# `manage.py process_media --loop`, under the same BACKGROUND_WORKERS rule.
+# The extractor is ffmpeg when installed, else a pure-Python MP4 header
+# reader (no poster); MEDIA_EXTRACTOR can name another class instead.
+MEDIA_PROCESS_IMMEDIATELY = not BACKGROUND_WORKERS
+MEDIA_EXTRACTOR = os.getenv('MEDIA_EXTRACTOR') or None
+
 # Cloudinary Configuration
 CLOUDINARY_STORAGE = {
     'CLOUD_NAME': os.getenv('dyt08mpkv'),
@@ -1,9 +1,10 @@
 # socialx/urls.py
 
+import re
+
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from chatx import views as chatx_views
 from django.contrib.auth import views as auth_views
 
@@ -22,6 +23,7 @@ urlpatterns = [
     path('', chatx_views.home, name='home'),
     path('about/', chatx_views.about, name='about'),
     path('feed/', chatx_views.post_list, name='post_list'),
+    path('feed/page/', chatx_views.post_list_page, name='post_list_page'),
     path('chatx/', chatx_views.post_list, name='chat_list'),
     
     # Posts
@@ -32,6 +34,12 @@ urlpatterns = [
     path('post/<int:pk>/like/', chatx_views.like_post, name='like_post'),
     path('post/<int:pk>/save/', chatx_views.save_post, name='save_post'),
     path('post/<int:pk>/comment/', chatx_views.add_comment, name='add_comment'),
+    path('post/<int:pk>/download/', chatx_views.post_media_download, name='post_media_download'),
+
+    # Chunked media uploads
+    path('uploads/', chatx_views.upload_start, name='upload_start'),
+    path('uploads/<uuid:upload_id>/', chatx_views.upload_detail, name='upload_detail'),
+    path('uploads/<uuid:upload_id>/complete/', chatx_views.upload_complete, name='upload_complete'),
 
     # Profile
     path('profile/<str:username>/', chatx_views.profile_view, name='profile'),
@@ -53,8 +61,13 @@ urlpatterns = [
     path('saved/', chatx_views.saved_posts_view, name='saved_posts'),
     path('notifications/', chatx_views.notifications_view, name='notifications'),
     path('search/', chatx_views.search, name='search'),
+    path('search/autocomplete/', chatx_views.username_autocomplete, name='username_autocomplete'),
     path('help/', chatx_views.help_center_view, name='help_center'),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+if settings.MEDIA_URL.startswith('/'):
+    # Media on local disk, served with byte ranges and cache headers (or
+    # handed to the web server with MEDIA_SENDFILE) in production as well
+    urlpatterns += [
+        re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<name>.+)$', chatx_views.media_file, name='media_file'),
+    ]
\ No newline at end of file